@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from typing import Optional
+
+from spade.message import Message
+
+# times a waiting queue may be passed over for queues of higher priority before it is served
+STARVATION_LIMIT = 8
+
+
+class MessageQueue:
+    """Bounded queue of received messages of one ontology, the oldest message is dropped when a new one does not fit."""
+
+    def __init__(self, ontology: str, priority: int, limit: int):
+        self.ontology = ontology
+        self.priority = priority
+        self.limit = limit
+        self.messages: deque[Message] = deque()
+        self.received = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.skipped = 0
+
+    def put(self, message: Message) -> None:
+        if len(self.messages) >= self.limit:
+            self.messages.popleft()
+            self.dropped += 1
+        self.messages.append(message)
+        self.received += 1
+        self.max_depth = max(self.max_depth, len(self.messages))
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "depth": len(self.messages),
+            "max_depth": self.max_depth,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+
+class MessageDispatcher:
+    """Routes the messages received by an agent to queues by their ontology.
+    Messages are taken from the queue with the lowest priority number first, in arrival order within a queue.
+    Queues of the same priority take turns, and a waiting queue passed over `STARVATION_LIMIT` times is served next,
+    so e.g. status messages keep the known agents fresh under a flood of revisions."""
+
+    def __init__(self):
+        self.queues: dict[str, MessageQueue] = {}
+        self._by_priority: list[MessageQueue] = []
+        self._ready: Optional[asyncio.Event] = None
+
+    def add_queue(self, ontology: str, priority: int, limit: int) -> None:
+        queue = MessageQueue(ontology, priority, limit)
+        self.queues[ontology] = queue
+        self._by_priority = sorted(self.queues.values(), key=lambda q: q.priority)
+
+    def put(self, message: Message) -> bool:
+        """Queues the message, returns False if no queue accepts its ontology."""
+        queue = self.queues.get(message.metadata.get("ontology"))
+        if queue is None:
+            return False
+        queue.put(message)
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def get_nowait(self) -> Optional[Message]:
+        waiting = [queue for queue in self._by_priority if len(queue.messages) > 0]
+        if len(waiting) == 0:
+            return None
+        chosen = next((queue for queue in waiting if queue.skipped >= STARVATION_LIMIT), waiting[0])
+        for queue in waiting:
+            queue.skipped += 1
+        chosen.skipped = 0
+        # the chosen queue goes behind the others of its priority
+        self._by_priority.remove(chosen)
+        position = next((i for i, queue in enumerate(self._by_priority) if queue.priority > chosen.priority), len(self._by_priority))
+        self._by_priority.insert(position, chosen)
+        return chosen.messages.popleft()
+
+    async def get(self) -> Message:
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while True:
+            message = self.get_nowait()
+            if message is not None:
+                return message
+            self._ready.clear()
+            await self._ready.wait()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue.messages) for queue in self.queues.values())
+
+    def metrics(self) -> dict[str, dict[str, int]]:
+        return {ontology: queue.metrics() for ontology, queue in self.queues.items()}
@@ -1,45 +1,105 @@
+import asyncio
 import datetime
 import json
+import random
 import time
 from typing import Optional
 from uuid import uuid4
 
-from spade.agent import Agent
 from spade.behaviour import (CyclicBehaviour, OneShotBehaviour,
                              PeriodicBehaviour)
 from spade.message import Message
+from spade.template import Template
 
 from agents.message_delivery_fail import MessageDeliveryFail
+from agents.message_dispatcher import MessageDispatcher
+from agents.revision_batch_message import RevisionBatchMessage, ONTOLOGY_REVISION_BATCH
 from agents.revision_message import RevisionMessage, ONTOLOGY_REVISION
 from agents.revision_request_message import RevisionRequestMessage, ONTOLOGY_REVISION_REQUEST
 from agents.status_message import StatusMessage, ONTOLOGY_STATUS
+from agents.transport_agent import TransportAgent
+from config import (COMPACTION_MIN_REVISIONS, COMPACTION_PERIOD, FANOUT_CONCURRENCY, GOSSIP_FANOUT, STATUS_MODE, STORE_DIRECTORY, STORE_FLUSH_PERIOD,
+                    STORE_SNAPSHOT_REVISIONS, STORE_SYNC)
 from logger.logger import get_logger
+from services.bloom_filter import BloomFilter
 from services.change_log import ChangeLog
+from services.metrics import COUNTER, GAUGE, AgentMetrics, MetricFamily, family_of
 from services.rdf_document import RDFDocument, RDFRevision, MissingRevision
+from services.revision_codec import REVISION_FORMAT_BINARY, REVISION_FORMAT_JSON
+from services.revision_store import RevisionStore
 
 KNOWN_AGENTS_TTL = 10
 STATUS_SEND_PERIOD = 5
+STATUS_MODE_BROADCAST = "broadcast"
+STATUS_MODE_GOSSIP = "gossip"
+# status reaches peers over several gossip rounds, so they are given more time before being considered lost
+GOSSIP_KNOWN_AGENTS_TTL = 60
+# maximum number of status periods between gossip rounds while nothing changes
+GOSSIP_MAX_BACKOFF = 4
 LOCAL_REVISION_CREATE_PERIOD = 2
+REVISION_REQUEST_RETRY_PERIOD = 3
+REVISION_BATCH_SIZE = 64
+SYNC_MAX_REVISIONS = 1024
+SYNC_KNOWN_REVISIONS = 1024
+# received messages waiting for their handler, revisions are handled first and status last
+REVISION_QUEUE_LIMIT = 4096
+REQUEST_QUEUE_LIMIT = 1024
+STATUS_QUEUE_LIMIT = 256
+# messages are routed by the agent's dispatcher, so behaviours must not collect them in their own queues
+NO_MESSAGES = ~Template()
 
 
-class RDFAgent(Agent):
+def readdress(message: Message, to: str) -> Message:
+    """Copies an already serialized message for another recipient."""
+    return Message(to=to, body=message.body, metadata=dict(message.metadata))
+
+
+class RDFAgent(TransportAgent):
     class KnownAgent:
-        def __init__(self, jid: str, uuid: str, latest_revision: str, status: str):
+        def __init__(self, jid: str, uuid: str, latest_revision: str, status: str, formats: Optional[list[str]] = None, created: Optional[float] = None):
             self.jid = jid
             self.uuid = uuid
             self.latest_revision = latest_revision
             self.status = status
-            self.created = time.time()
+            self.formats = formats if formats is not None else [REVISION_FORMAT_JSON]
+            self.created = created if created is not None else time.time()
 
     def __init__(self, jid: str, password: str, simulation: 'Simulation'):
-        super().__init__(jid, password)
+        super().__init__(jid, password, simulation.transport)
 
         self.logger = get_logger(f"Agent-{jid}")
         self.simulation = simulation
-        self.uuid = str(uuid4())
+        self.store = RevisionStore.for_agent(STORE_DIRECTORY, jid, synchronous=STORE_SYNC, snapshot_revisions=STORE_SNAPSHOT_REVISIONS) if STORE_DIRECTORY else None
+        # a restarted agent keeps authoring revisions under its stored identity
+        self.uuid = (self.store.author() if self.store is not None else None) or str(uuid4())
         self.doc = RDFDocument(self.uuid)
+        if self.store is not None:
+            loaded = self.store.open(self.doc)
+            self.logger.info("Loaded %s revisions from %s", loaded, self.store.path)
+            if loaded > 0:
+                # the restored state was uncovered from the generator of the previous run
+                simulation.graph_generator.adopt(self.doc.cached_state.values())
         self.known_agents: dict[str, RDFAgent.KnownAgent] = {}
         self.merge_master = jid
+        self.status_mode = STATUS_MODE
+        self.known_agents_ttl = GOSSIP_KNOWN_AGENTS_TTL if self.status_mode == STATUS_MODE_GOSSIP else KNOWN_AGENTS_TTL
+        self._status_state: Optional[tuple] = None
+        self._status_backoff = 1
+        self._status_skipped = 0
+        self.requested_revisions: dict[str, float] = {}
+        self._known_summary: tuple[Optional[tuple[int, str]], Optional[BloomFilter]] = (None, None)
+        self.metrics = AgentMetrics()
+        self.dispatcher = MessageDispatcher()
+        self.dispatcher.add_queue(ONTOLOGY_REVISION, 0, REVISION_QUEUE_LIMIT)
+        self.dispatcher.add_queue(ONTOLOGY_REVISION_BATCH, 0, REVISION_QUEUE_LIMIT)
+        self.dispatcher.add_queue(ONTOLOGY_REVISION_REQUEST, 1, REQUEST_QUEUE_LIMIT)
+        self.dispatcher.add_queue(ONTOLOGY_STATUS, 2, STATUS_QUEUE_LIMIT)
+        self.message_handlers = {
+            ONTOLOGY_REVISION: self.receive_revisions,
+            ONTOLOGY_REVISION_BATCH: self.receive_revisions,
+            ONTOLOGY_REVISION_REQUEST: self.receive_revision_request,
+            ONTOLOGY_STATUS: self.receive_status
+        }
 
     @property
     def is_merge_master(self) -> bool:
@@ -65,45 +125,287 @@ class RDFAgent(Agent):
             self.logger.debug("I am the merge master")
             self.merge_master = str(self.jid)
         else:
-            self.logger.debug(f"Merge master is {min_jid}")
+            self.logger.debug("Merge master is %s", min_jid)
             self.merge_master = min_jid
 
-    async def send_and_log(self, behaviour: CyclicBehaviour, message: Message, label: str, extra: Optional[any] = None):
-        ChangeLog.log("message", (label, str(self.jid), str(message.to), extra))
+    def update_known_agent(self, agent: 'RDFAgent.KnownAgent') -> bool:
+        """Stores the agent unless fresher knowledge about it is already known.
+        Returns whether the agent was not known before."""
+        known = self.known_agents.get(agent.jid)
+        if known is None or known.created <= agent.created:
+            self.known_agents[agent.jid] = agent
+        return known is None
+
+    def expire_known_agents(self):
+        now = time.time()
+        to_remove = [jid for jid, agent in self.known_agents.items() if agent.created + self.known_agents_ttl < now]
+        for agent_jid in to_remove:
+            self.logger.warning(f"Lost connection with {agent_jid}")
+            self.simulation.server.deregister_agent(agent_jid)
+            del self.known_agents[agent_jid]
+        if self.merge_master in to_remove:
+            self.elect_merge_master()
+
+    def peers_digest(self) -> dict[str, dict]:
+        now = time.time()
+        return {jid: {
+            "uuid": agent.uuid,
+            "latest_revision": agent.latest_revision,
+            "status": agent.status,
+            "formats": agent.formats,
+            "age": now - agent.created
+        } for jid, agent in self.known_agents.items()}
+
+    async def broadcast_status(self, behaviour: CyclicBehaviour):
+        recipients = self.simulation.server.registered_agents - {str(self.jid)}
+        self.logger.debug("Sending status message to %s agents", len(recipients))
+        message = StatusMessage(to=None, uuid=self.uuid, latest_revision=self.doc.current_hash)
+        await self.fan_out(behaviour, [readdress(message, jid) for jid in recipients], "status")
+
+    async def gossip_status(self, behaviour: CyclicBehaviour):
+        # back off exponentially while neither the document nor the known agents change
+        state = (self.doc.current_hash, frozenset(self.known_agents))
+        unchanged = state == self._status_state
+        if unchanged and self._status_skipped + 1 < self._status_backoff:
+            self._status_skipped += 1
+            return
+        self._status_backoff = min(self._status_backoff * 2, GOSSIP_MAX_BACKOFF) if unchanged else 1
+        self._status_skipped = 0
+        self._status_state = state
+
+        peers = (self.simulation.server.registered_agents | self.known_agents.keys()) - {str(self.jid)}
+        targets = random.sample(sorted(peers), min(GOSSIP_FANOUT, len(peers)))
+        self.logger.debug("Sending status gossip to %s", targets)
+        message = StatusMessage(to=None, uuid=self.uuid, latest_revision=self.doc.current_hash, peers=self.peers_digest())
+        await self.fan_out(behaviour, [readdress(message, jid) for jid in targets], "status")
+
+    async def send_and_log(self, behaviour: CyclicBehaviour, message: Message, label: str, revisions: Optional[list[RDFRevision]] = None):
+        ChangeLog.log_message(label, str(self.jid), str(message.to), ChangeLog.encode_deltas(revisions) if revisions is not None else None)
+        self.metrics.message_sent(message.metadata.get("ontology"), message.body)
         try:
-            return await behaviour.send(message)
+            return await self.transport.send(behaviour, message)
         except MessageDeliveryFail:
             self.logger.warning(f"Failed to deliver message to {message.to}")
 
-    async def send_revision(self, revision: RDFRevision, to: Optional[str], behaviour: CyclicBehaviour):
-        if to is not None:
-            self.logger.debug(f"Sending revision to {to}")
-            await self.send_and_log(behaviour, RevisionMessage(to=to, revision=revision), "revision", {
-                "+": list(revision.deltas_add.keys()),
-                "-": list(revision.deltas_remove.keys())
-            })
+    async def fan_out(self, behaviour: CyclicBehaviour, messages: list[Message], label: str, revisions: Optional[list[RDFRevision]] = None) -> dict[str, BaseException]:
+        """Sends the messages concurrently, at most FANOUT_CONCURRENCY at a time, so a slow recipient does not delay the others.
+        Returns the failures by recipient."""
+        semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+        deltas = ChangeLog.encode_deltas(revisions) if revisions is not None else None
+
+        async def send(message: Message):
+            async with semaphore:
+                ChangeLog.log_message(label, str(self.jid), str(message.to), deltas)
+                self.metrics.message_sent(message.metadata.get("ontology"), message.body)
+                await self.transport.send(behaviour, message)
+
+        results = await asyncio.gather(*(send(message) for message in messages), return_exceptions=True)
+        failures = {str(message.to): result for message, result in zip(messages, results) if isinstance(result, BaseException)}
+        for to, error in failures.items():
+            if isinstance(error, MessageDeliveryFail):
+                self.logger.warning(f"Failed to deliver message to {to}")
+            else:
+                self.logger.error(f"Failed to send message to {to}: {error!r}")
+        return failures
+
+    def compact_history(self) -> int:
+        """Drops the history every known agent has moved past, keeping the revisions between it and their latest ones."""
+        if self.doc.current_hash is None:
+            return 0
+        live = [self.doc.current_hash] + [agent.latest_revision for agent in self.known_agents.values() if agent.latest_revision is not None]
+        dropped = self.doc.compact(live, COMPACTION_MIN_REVISIONS)
+        if dropped > 0:
+            self.logger.info("Compacted history, dropped %s revisions and kept %s", dropped, len(self.doc.revisions))
+        return dropped
+
+    def collect_metrics(self, families: dict[str, MetricFamily]):
+        agent = str(self.jid)
+        self.metrics.collect(agent, families)
+        family_of(families, "rdf_revisions", GAUGE, "Revisions in the agent's document").add({"agent": agent}, len(self.doc.revisions))
+        family_of(families, "rdf_heads", GAUGE, "Revisions without children in the agent's document").add({"agent": agent}, len(self.doc.heads))
+        family_of(families, "rdf_state_triples", GAUGE, "Triples in the agent's current state").add({"agent": agent}, len(self.doc.cached_state))
+        family_of(families, "rdf_known_agents", GAUGE, "Agents the agent knows about").add({"agent": agent}, len(self.known_agents))
+        for ontology, queue in self.dispatcher.metrics().items():
+            labels = {"agent": agent, "ontology": ontology}
+            family_of(families, "rdf_queue_depth", GAUGE, "Received messages waiting for their handler").add(labels, queue["depth"])
+            family_of(families, "rdf_queue_max_depth", GAUGE, "Most messages that waited for their handler at once").add(labels, queue["max_depth"])
+            family_of(families, "rdf_queue_dropped_total", COUNTER, "Received messages dropped from a full queue").add(labels, queue["dropped"])
+
+    def revision_format(self, jid: str) -> str:
+        agent = self.known_agents.get(jid)
+        if agent is not None and REVISION_FORMAT_BINARY in agent.formats:
+            return REVISION_FORMAT_BINARY
+        return REVISION_FORMAT_JSON
+
+    async def send_revision(self, revision: RDFRevision, to: Optional[str], behaviour: CyclicBehaviour) -> dict[str, BaseException]:
+        recipients = [to] if to is not None else list(self.known_agents)
+        self.logger.debug("Sending revision to %s", recipients)
+        # the revision is serialized once per wire format, not once per recipient
+        encoded = {}
+        messages = []
+        for jid in recipients:
+            language = self.revision_format(jid)
+            if language not in encoded:
+                encoded[language] = RevisionMessage(to=None, revision=revision, language=language)
+            messages.append(readdress(encoded[language], jid))
+        return await self.fan_out(behaviour, messages, "revision", [revision])
+
+    async def send_revisions(self, revisions: list[RDFRevision], to: str, behaviour: CyclicBehaviour):
+        for i in range(0, len(revisions), REVISION_BATCH_SIZE):
+            batch = revisions[i:i + REVISION_BATCH_SIZE]
+            self.logger.debug("Sending %s revisions to %s", len(batch), to)
+            await self.send_and_log(behaviour, RevisionBatchMessage(to=to, revisions=batch, language=self.revision_format(to)), "revision", batch)
+
+    def known_revisions_summary(self) -> Optional[BloomFilter]:
+        if len(self.doc.revisions) == 0:
+            return None
+        key = (len(self.doc.revisions), self.doc.current_hash)
+        if self._known_summary[0] != key:
+            self._known_summary = (key, BloomFilter.of(self.doc.recent_hashes(SYNC_KNOWN_REVISIONS), SYNC_KNOWN_REVISIONS))
+        return self._known_summary[1]
+
+    async def send_revision_request(self, hashes: list[str], to: Optional[str], behaviour: CyclicBehaviour):
+        now = time.time()
+        if len(self.requested_revisions) > SYNC_MAX_REVISIONS:
+            self.requested_revisions = {k: t for k, t in self.requested_revisions.items() if t + REVISION_REQUEST_RETRY_PERIOD > now}
+        hashes = [h for h in dict.fromkeys(hashes) if self.requested_revisions.get(h, 0) + REVISION_REQUEST_RETRY_PERIOD <= now]
+        if len(hashes) == 0:
             return
-        for agent in self.known_agents.values():
-            self.logger.debug(f"Sending revision to {agent.jid}")
-            await self.send_and_log(behaviour, RevisionMessage(to=agent.jid, revision=revision), "revision", {
-                "+": list(revision.deltas_add.keys()),
-                "-": list(revision.deltas_remove.keys())
-            })
-
-    async def send_revision_request(self, hash_: str, to: Optional[str], behaviour: CyclicBehaviour):
+        for hash_ in hashes:
+            self.requested_revisions[hash_] = now
+
         if not self.is_merge_master:
-            self.logger.debug(f"Sending revision request to merge master {self.merge_master}")
-            await self.send_and_log(behaviour, RevisionRequestMessage(to=self.merge_master, hash_=hash_), "request")
+            self.logger.debug("Sending revision request to merge master %s", self.merge_master)
+            recipients = [self.merge_master]
+        elif to is not None:
+            self.logger.debug("Sending revision request to %s", to)
+            recipients = [to]
+        else:
+            self.logger.debug("Sending revision request to all known agents")
+            recipients = list(self.known_agents)
+
+        message = RevisionRequestMessage(to=None, hashes=hashes, heads=list(self.doc.complete_heads()), known=self.known_revisions_summary())
+        await self.fan_out(behaviour, [readdress(message, jid) for jid in recipients], "request")
+
+    async def integrate_revision(self, revision: RDFRevision, sender: str, behaviour: CyclicBehaviour):
+        if self.doc.has_revision(revision.hash):
             return
+        self.logger.debug("Revision from %s is new", sender)
 
-        if to is not None:
-            self.logger.debug(f"Sending revision request to {to}")
-            await self.send_and_log(behaviour, RevisionRequestMessage(to=to, hash_=hash_), "request")
+        if len(self.doc.revisions) == 0:
+            self.doc.append_revision(revision)
             return
 
-        for agent in self.known_agents.values():
-            self.logger.debug(f"Sending revision request to {agent.jid}")
-            await self.send_and_log(behaviour, RevisionRequestMessage(to=agent.jid, hash_=hash_), "request")
+        to_insert = True
+        try:
+            if revision.is_merge and self.doc.can_rebase(revision):
+                to_insert = False
+                self.logger.debug("Rebasing revision from %s", sender)
+                started = time.perf_counter()
+                rebased = self.doc.rebase_revision(revision)
+                self.metrics.rebases.observe(time.perf_counter() - started)
+                self.metrics.rebased_revisions += len(rebased)
+                for rev in rebased:
+                    await self.send_revision(rev, None, behaviour)
+
+            if self.is_merge_master:
+                started = time.perf_counter()
+                merge_revision = self.doc.merge_revision(revision)
+                if merge_revision is not None:
+                    to_insert = False
+                    self.logger.debug("Merging revision from %s", sender)
+                    self.doc.append_revision(revision)
+                    self.doc.append_revision(merge_revision)
+                    self.metrics.merges.observe(time.perf_counter() - started)
+                    await self.send_revision(merge_revision, None, behaviour)
+        except MissingRevision:
+            self.logger.debug("Detected missing ancestor revision from %s", sender)
+
+        if to_insert:
+            self.doc.append_revision(revision)
+
+    def dispatch(self, msg: Message) -> list:
+        # replaces delivery to every behaviour, so messages are only queued once, for the handler of their ontology
+        if not self.dispatcher.put(msg):
+            self.logger.warning("Dropping message with unknown ontology %s from %s", msg.metadata.get("ontology"), msg.sender)
+        return []
+
+    async def receive_status(self, msg: Message, behaviour: CyclicBehaviour):
+        self.logger.debug("Received status message from %s", msg.sender)
+        body = json.loads(msg.body)
+        sender = str(msg.sender)
+        is_new = self.update_known_agent(RDFAgent.KnownAgent(sender, body["uuid"], body["latest_revision"], body["status"], body.get("formats")))
+
+        now = time.time()
+        for jid, peer in body.get("peers", {}).items():
+            if jid == str(self.jid):
+                continue
+            is_new |= self.update_known_agent(RDFAgent.KnownAgent(jid, peer["uuid"], peer["latest_revision"], peer["status"], peer.get("formats"), now - peer["age"]))
+
+        if is_new:
+            self.elect_merge_master()
+
+        # with gossip the merge master may not talk to this agent directly, so its latest revision is requested too
+        hashes = [body["latest_revision"], self.merge_master_agent.latest_revision]
+        hashes = [hash_ for hash_ in hashes if hash_ is not None and not self.doc.has_revision(hash_)]
+        if len(hashes) > 0:
+            await self.send_revision_request(hashes, sender, behaviour)
+
+    async def receive_revisions(self, msg: Message, behaviour: CyclicBehaviour):
+        if str(msg.sender) not in self.known_agents:
+            return
+        self.logger.debug("Received revision message from %s", msg.sender)
+        if msg.metadata["ontology"] == ONTOLOGY_REVISION_BATCH:
+            revisions = RevisionBatchMessage.parse(msg)
+        else:
+            revisions = [RevisionMessage.parse(msg)]
+
+        # revisions in a batch come oldest first, so only parents missing from both the document and the batch are requested
+        missing = []
+        for revision in revisions:
+            for parent in revision.parents:
+                if not self.doc.has_revision(parent):
+                    missing.append(parent)
+            await self.integrate_revision(revision, str(msg.sender), behaviour)
+
+        missing = [parent for parent in missing if not self.doc.has_revision(parent)]
+        if len(missing) > 0:
+            self.logger.debug("Requesting missing parent revisions of revisions from %s", msg.sender)
+            await self.send_revision_request(missing, None, behaviour)
+
+    async def receive_revision_request(self, msg: Message, behaviour: CyclicBehaviour):
+        if str(msg.sender) not in self.known_agents:
+            return
+        self.logger.debug("Received revision request from %s", msg.sender)
+        body = json.loads(msg.body)
+        sender = str(msg.sender)
+        if sender == self.merge_master:
+            known_uuids = {agent.uuid for agent in self.known_agents.values()}
+
+            def may_send(revision: RDFRevision) -> bool:
+                return revision.author_uuid == self.uuid or revision.author_uuid not in known_uuids
+        elif self.is_merge_master:
+            def may_send(revision: RDFRevision) -> bool:
+                return True
+        else:
+            return
+
+        if "heads" in body:
+            known = BloomFilter.from_dict(body["known"]) if "known" in body else None
+            revisions = self.doc.revisions_missing(body["hashes"], body["heads"], known, SYNC_MAX_REVISIONS)
+            revisions = [revision for revision in revisions if may_send(revision)]
+            if len(revisions) == 0:
+                self.logger.debug("Revisions requested by %s not found", msg.sender)
+                return
+            await self.send_revisions(revisions, sender, behaviour)
+            return
+
+        revision = self.doc.revisions.get(body["hash"])
+        if revision is None:
+            self.logger.debug("Revision requested by %s not found", msg.sender)
+            return
+        if may_send(revision):
+            await self.send_revision(revision, sender, behaviour)
 
     class RegisterAgentOnServer(OneShotBehaviour):
         async def run(self):
@@ -114,121 +416,70 @@ class RDFAgent(Agent):
             if self.agent.is_merge_master:
                 self.agent.simulation.log_leaderboard()
 
-            for agent_jid in self.agent.simulation.server.registered_agents:
-                if agent_jid == str(self.agent.jid):
-                    continue
-                self.agent.logger.debug(f"Sending status message to {agent_jid}")
-                await self.agent.send_and_log(self, StatusMessage(to=agent_jid, uuid=self.agent.uuid, latest_revision=self.agent.doc.current_hash), "status")
-
-            to_remove = set()
-            for agent_jid in self.agent.known_agents:
-                if self.agent.known_agents[agent_jid].created + KNOWN_AGENTS_TTL < time.time():
-                    self.agent.logger.warning(f"Lost connection with {agent_jid}")
-                    self.agent.simulation.server.deregister_agent(agent_jid)
-                    to_remove.add(agent_jid)
-            while len(to_remove) > 0:
-                del self.agent.known_agents[to_remove.pop()]
-                if to_remove == self.agent.merge_master:
-                    self.agent.elect_merge_master()
-
-    class StatusReceive(CyclicBehaviour):
-        async def run(self):
-            msg = await self.receive()
-            if msg and msg.metadata["ontology"] == ONTOLOGY_STATUS:
-                self.agent.logger.debug(f"Received status message from {msg.sender}")
-                body = json.loads(msg.body)
-                self.agent.known_agents[str(msg.sender)] = RDFAgent.KnownAgent(str(msg.sender), body["uuid"], body["latest_revision"], body["status"])
-
-                hash_ = body["latest_revision"]
-                if hash_ not in self.agent.doc.revisions_hashes:
-                    await self.agent.send_revision_request(hash_, str(msg.sender), self)
+            if self.agent.status_mode == STATUS_MODE_GOSSIP:
+                await self.agent.gossip_status(self)
+            else:
+                await self.agent.broadcast_status(self)
 
-                self.agent.elect_merge_master()
+            self.agent.expire_known_agents()
 
     class LocalRevisionCreate(PeriodicBehaviour):
         async def run(self):
             if len(self.agent.doc.revisions) == 0 and not self.agent.is_merge_master:
                 return
+            fragments = await self.agent.simulation.uncover_graph_fragments(self.agent)
+            if len(fragments) == 0:
+                return
             self.agent.logger.debug("Creating new local revision")
             self.agent.doc.new_revision()
-            fragment = self.agent.simulation.graph_generator.uncover_graph_fragment(self.agent.doc.cached_state)
-            ChangeLog.log("uncovered", (str(self.agent.jid), fragment[0], fragment[1].hash))
-            self.agent.doc.parse_fragment(*fragment)
+            for operation, triple in fragments:
+                ChangeLog.log_uncovered(str(self.agent.jid), operation, triple.id)
+                self.agent.doc.parse_fragment(operation, triple)
             revision = self.agent.doc.current_revision
 
-            if self.agent.merge_master_agent.latest_revision in self.agent.doc.revisions_hashes:
+            if self.agent.doc.has_revision(self.agent.merge_master_agent.latest_revision):
                 await self.agent.send_revision(revision, None, self)
 
-    class RemoteRevisionReceive(CyclicBehaviour):
+    class HistoryCompact(PeriodicBehaviour):
         async def run(self):
-            msg = await self.receive()
-            if msg and msg.metadata["ontology"] == ONTOLOGY_REVISION and str(msg.sender) in self.agent.known_agents:
-                self.agent.logger.debug(f"Received revision message from {msg.sender}")
-                revision = RDFRevision.from_json(msg.body)
-
-                for parent in revision.parents:
-                    if parent not in self.agent.doc.revisions_hashes:
-                        self.agent.logger.debug(f"Requesting missing parent revision of revision from {msg.sender}")
-                        await self.agent.send_revision_request(parent, None, self)
-
-                if revision.hash in self.agent.doc.revisions_hashes:
-                    return
-                self.agent.logger.debug(f"Revision from {msg.sender} is new")
-
-                if len(self.agent.doc.revisions) == 0:
-                    self.agent.doc.append_revision(revision)
-                    return
-
-                to_insert = True
-                try:
-                    if revision.is_merge and self.agent.doc.can_rebase(revision):
-                        to_insert = False
-                        self.agent.logger.debug(f"Rebasing revision from {msg.sender}")
-                        rebased = self.agent.doc.rebase_revision(revision)
-                        for rev in rebased:
-                            await self.agent.send_revision(rev, None, self)
-
-                    if self.agent.is_merge_master:
-                        merge_revision = self.agent.doc.merge_revision(revision)
-                        if merge_revision is not None:
-                            to_insert = False
-                            self.agent.logger.debug(f"Merging revision from {msg.sender}")
-                            self.agent.doc.append_revision(revision)
-                            self.agent.doc.append_revision(merge_revision)
-                            await self.agent.send_revision(merge_revision, None, self)
-                except MissingRevision:
-                    self.agent.logger.debug(f"Detected missing ancestor revision from {msg.sender}")
-
-                if to_insert:
-                    self.agent.doc.append_revision(revision)
-
-    class RevisionRequestReceive(CyclicBehaviour):
+            self.agent.compact_history()
+
+    class RevisionStoreFlush(PeriodicBehaviour):
+        async def run(self):
+            await self.agent.store.flush()
+
+    class MessageReceive(CyclicBehaviour):
         async def run(self):
-            msg = await self.receive()
-            if msg and msg.metadata["ontology"] == ONTOLOGY_REVISION_REQUEST and str(msg.sender) in self.agent.known_agents:
-                self.agent.logger.debug(f"Received revision request from {msg.sender}")
-                body = json.loads(msg.body)
-                hash_ = body["hash"]
-                revision = self.agent.doc.revisions.get(hash_)
-                if revision is None:
-                    self.agent.logger.debug(f"Revision requested by {msg.sender} not found")
-                    return
-                if str(msg.sender) == self.agent.merge_master:
-                    if revision.author_uuid == self.agent.uuid or revision.author_uuid not in [agent.uuid for agent in self.agent.known_agents.values()]:
-                        await self.agent.send_revision(revision, str(msg.sender), self)
-                elif self.agent.is_merge_master:
-                    await self.agent.send_revision(revision, str(msg.sender), self)
+            msg = await self.agent.dispatcher.get()
+            ontology = msg.metadata["ontology"]
+            handler = self.agent.message_handlers[ontology]
+            self.agent.metrics.message_received(ontology, msg.body)
+            started = time.perf_counter()
+            failed = False
+            try:
+                await handler(msg, self)
+            except Exception as e:
+                failed = True
+                self.agent.logger.error("Failed to handle %s message from %s: %r", ontology, msg.sender, e)
+            self.agent.metrics.message_handled(ontology, time.perf_counter() - started, failed)
 
     async def stop(self):
         self.logger.info("Agent is stopping")
         self.simulation.server.deregister_agent(str(self.jid))
-        return await super().stop()
+        if self.simulation.convergence is not None:
+            self.simulation.convergence.untrack(str(self.jid))
+        result = await super().stop()
+        if self.store is not None:
+            await self.store.close()
+        return result
 
     async def setup(self):
-        self.add_behaviour(self.RegisterAgentOnServer())
-        self.add_behaviour(self.RevisionRequestReceive())
-        self.add_behaviour(self.StatusReceive())
-        self.add_behaviour(self.StatusSend(period=STATUS_SEND_PERIOD))
-        self.add_behaviour(self.RemoteRevisionReceive())
-        self.add_behaviour(self.LocalRevisionCreate(period=LOCAL_REVISION_CREATE_PERIOD, start_at=datetime.datetime.now() + datetime.timedelta(seconds=8)))
+        self.add_behaviour(self.RegisterAgentOnServer(), NO_MESSAGES)
+        self.add_behaviour(self.MessageReceive(), NO_MESSAGES)
+        self.add_behaviour(self.StatusSend(period=STATUS_SEND_PERIOD), NO_MESSAGES)
+        self.add_behaviour(self.LocalRevisionCreate(period=LOCAL_REVISION_CREATE_PERIOD, start_at=datetime.datetime.now() + datetime.timedelta(seconds=8)), NO_MESSAGES)
+        if COMPACTION_PERIOD > 0:
+            self.add_behaviour(self.HistoryCompact(period=COMPACTION_PERIOD), NO_MESSAGES)
+        if self.store is not None:
+            self.add_behaviour(self.RevisionStoreFlush(period=STORE_FLUSH_PERIOD), NO_MESSAGES)
         self.logger.info("Agent started")
@@ -0,0 +1,19 @@
+from spade.message import Message
+
+from services.rdf_document import RDFRevision
+from services.revision_codec import REVISION_FORMAT_JSON, decode_revisions, encode_revisions
+
+ONTOLOGY_REVISION_BATCH = "revision_batch"
+
+
+class RevisionBatchMessage(Message):
+    def __init__(self, to: str, revisions: list[RDFRevision], language: str = REVISION_FORMAT_JSON):
+        super().__init__(to=to)
+        self.body = encode_revisions(revisions, language)
+        self.set_metadata("performative", "inform")
+        self.set_metadata("ontology", ONTOLOGY_REVISION_BATCH)
+        self.set_metadata("language", language)
+
+    @staticmethod
+    def parse(message: Message) -> list[RDFRevision]:
+        return decode_revisions(message.body, message.metadata.get("language", REVISION_FORMAT_JSON))
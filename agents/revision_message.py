@@ -1,14 +1,19 @@
 from spade.message import Message
 
 from services.rdf_document import RDFRevision
+from services.revision_codec import REVISION_FORMAT_JSON, decode_revision, encode_revision
 
 ONTOLOGY_REVISION = "revision"
 
 
 class RevisionMessage(Message):
-    def __init__(self, to: str, revision: RDFRevision):
+    def __init__(self, to: str, revision: RDFRevision, language: str = REVISION_FORMAT_JSON):
         super().__init__(to=to)
-        self.body = revision.to_json()
+        self.body = encode_revision(revision, language)
         self.set_metadata("performative", "inform")
         self.set_metadata("ontology", ONTOLOGY_REVISION)
-        self.set_metadata("language", "json")
+        self.set_metadata("language", language)
+
+    @staticmethod
+    def parse(message: Message) -> RDFRevision:
+        return decode_revision(message.body, message.metadata.get("language", REVISION_FORMAT_JSON))
@@ -1,16 +1,26 @@
 import json
+from typing import Optional
 
 from spade.message import Message
 
+from services.bloom_filter import BloomFilter
+
 ONTOLOGY_REVISION_REQUEST = "revision_request"
 
 
 class RevisionRequestMessage(Message):
-    def __init__(self, to: str, hash_: str):
+    def __init__(self, to: str, hashes: list[str], heads: Optional[list[str]] = None, known: Optional[BloomFilter] = None):
         super().__init__(to=to)
-        self.body = json.dumps({
-            "hash": hash_,
-        })
+        body = {
+            "hash": hashes[0],
+        }
+        if heads is not None:
+            # range sync: the responder sends every revision missing between the hashes and the requester's heads
+            body["hashes"] = hashes
+            body["heads"] = heads
+            if known is not None:
+                body["known"] = known.to_dict()
+        self.body = json.dumps(body)
         self.set_metadata("performative", "request")
         self.set_metadata("ontology", ONTOLOGY_REVISION_REQUEST)
         self.set_metadata("language", "json")
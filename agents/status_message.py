@@ -1,18 +1,26 @@
 import json
+from typing import Optional
 
 from spade.message import Message
 
+from services.revision_codec import SUPPORTED_REVISION_FORMATS
+
 ONTOLOGY_STATUS = "status"
 
 
 class StatusMessage(Message):
-    def __init__(self, to: str, uuid: str, latest_revision: str):
+    def __init__(self, to: str, uuid: str, latest_revision: str, peers: Optional[dict[str, dict]] = None):
         super().__init__(to=to)
-        self.body = json.dumps({
+        body = {
             "uuid": uuid,
             "latest_revision": latest_revision,
             "status": "online",
-        })
+            "formats": SUPPORTED_REVISION_FORMATS,
+        }
+        if peers is not None:
+            # gossip digest: what the sender knows about other agents, with the age of that knowledge in seconds
+            body["peers"] = peers
+        self.body = json.dumps(body)
         self.set_metadata("performative", "inform")
         self.set_metadata("ontology", ONTOLOGY_STATUS)
         self.set_metadata("language", "json")
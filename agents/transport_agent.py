@@ -0,0 +1,32 @@
+from spade.agent import Agent
+
+from services.transport import XMPPTransport
+
+
+class TransportAgent(Agent):
+    """Agent connected through a transport, it only logs in to the XMPP server when the transport uses it."""
+
+    def __init__(self, jid: str, password: str, transport: XMPPTransport):
+        super().__init__(jid, password)
+        self.transport = transport
+
+    async def _async_register(self):
+        if self.transport.uses_xmpp:
+            await super()._async_register()
+
+    async def _async_connect(self):
+        if self.transport.uses_xmpp:
+            await super()._async_connect()
+        self.transport.attach(self)
+
+    async def _async_stop(self):
+        self.transport.detach(self)
+        if self.transport.uses_xmpp:
+            return await super()._async_stop()
+
+        # there is no XMPP stream to close
+        for behaviour in self.behaviours:
+            behaviour.kill()
+        if self.web.is_started():
+            await self.web.runner.cleanup()
+        self._alive.clear()
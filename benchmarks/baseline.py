@@ -0,0 +1,85 @@
+import argparse
+import json
+import os.path
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Optional
+
+BASELINES_DIRECTORY = os.path.join(os.path.dirname(__file__), "baselines")
+# a result slower than its baseline by more than this fraction is reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def add_arguments(parser: argparse.ArgumentParser, name: str):
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark, the median is reported")
+    parser.add_argument("--save", nargs="?", const=os.path.join(BASELINES_DIRECTORY, f"{name}.json"), default=None,
+                        help="write the results as a baseline, by default to benchmarks/baselines/")
+    parser.add_argument("--compare", nargs="?", const=os.path.join(BASELINES_DIRECTORY, f"{name}.json"), default=None,
+                        help="compare the results with a baseline and exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+
+def measure(run: Callable[[], Optional[int]], repeat: int, setup: Optional[Callable[[], None]] = None) -> dict:
+    """Times `run` `repeat` times, `setup` is called untimed before each run.
+    `run` may return the number of operations it did, so the time per operation is reported too."""
+    times = []
+    operations = 1
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        operations = run() or 1
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {"seconds": median, "min_seconds": min(times), "operations": operations, "us_per_operation": median / operations * 1e6}
+
+
+def report(benchmark: str, parameters: dict, results: dict[str, dict], args: argparse.Namespace):
+    """Prints the results, then saves them or compares them with a baseline as requested by the arguments."""
+    print(f"{'benchmark':<28} {'median s':>10} {'min s':>10} {'ops':>8} {'us/op':>10}")
+    for name, result in results.items():
+        print(f"{name:<28} {result['seconds']:>10.4f} {result['min_seconds']:>10.4f} {result['operations']:>8} {result['us_per_operation']:>10.1f}")
+        for key, value in result.items():
+            if key not in ("seconds", "min_seconds", "operations", "us_per_operation"):
+                print(f"  {key}: {value}")
+
+    document = {
+        "benchmark": benchmark,
+        "parameters": parameters,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+    if args.save is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as file:
+            json.dump(document, file, indent=2)
+            file.write("\n")
+        print(f"Saved baseline to {args.save}")
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline["parameters"] != parameters:
+            print(f"Baseline parameters {baseline['parameters']} differ from {parameters}, results are not comparable")
+            sys.exit(2)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for name, ratio in regressions.items():
+            print(f"Regression in {name}: {ratio:.2f}x the baseline time")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> dict[str, float]:
+    """Returns the ratio to the baseline time per operation of results slower than the tolerance allows."""
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["us_per_operation"] / baseline[name]["us_per_operation"]
+        if ratio > 1 + tolerance:
+            regressions[name] = ratio
+    return regressions
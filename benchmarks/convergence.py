@@ -0,0 +1,148 @@
+import argparse
+import heapq
+import random
+
+from benchmarks.baseline import add_arguments, measure, report
+from services.convergence import ConvergenceTracker
+from services.graph_generator import GraphGenerator
+from services.rdf_document import MissingRevision, RDFDocument, RDFRevision
+from services.workload import load_profile
+
+
+class InProcessSimulation:
+    """Agents of one process exchanging revisions through a delay queue, with the merge master logic of RDFAgent
+    but without XMPP, status messages or timers. The first agent is the merge master.
+    Messages between two agents arrive in the order they were sent, like over XMPP, missing parents are sent
+    by the agent that sent the revision after another delay, as if they were requested."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.generator = GraphGenerator(total_triples=args.triples, **load_profile(args.workload))
+        self.tracker = ConvergenceTracker()
+        self.generator.observers.append(self.tracker.truth_changed)
+        self.jids = [f"agent{i}@localhost" for i in range(args.agents)]
+        self.docs = [RDFDocument(f"author{i}") for i in range(args.agents)]
+        for jid, doc in zip(self.jids, self.docs):
+            self.tracker.track(jid, doc)
+        self.tick = 0
+        self._queue: list[tuple[int, int, int, int, str]] = []
+        self._sequence = 0
+        self._arrivals: dict[tuple[int, int], int] = {}
+        self.messages = 0
+        self.merges = 0
+        self.rebases = 0
+
+    def send(self, sender: int, revision: RDFRevision, to: list[int]):
+        data = revision.to_json()
+        for recipient in to:
+            self._sequence += 1
+            arrival = max(self.tick + 1 + self.rng.randrange(self.args.delay), self._arrivals.get((sender, recipient), 0))
+            self._arrivals[(sender, recipient)] = arrival
+            heapq.heappush(self._queue, (arrival, self._sequence, sender, recipient, data))
+
+    def broadcast(self, sender: int, revision: RDFRevision):
+        self.send(sender, revision, [i for i in range(len(self.docs)) if i != sender])
+
+    def create_revision(self, i: int):
+        doc = self.docs[i]
+        if len(doc.revisions) == 0 and i != 0:
+            return
+        fragments = self.generator.uncover_graph_fragments(doc.cached_state, self.jids[i])
+        if len(fragments) == 0:
+            return
+        doc.new_revision()
+        for operation, triple in fragments:
+            doc.parse_fragment(operation, triple)
+        self.broadcast(i, doc.current_revision)
+
+    def receive(self, sender: int, i: int, data: str):
+        self.messages += 1
+        doc = self.docs[i]
+        revision = RDFRevision.from_json(data)
+        source = self.docs[sender]
+        for parent in revision.parents:
+            if not doc.has_revision(parent) and parent in source.revisions:
+                self.send(sender, source.revisions[parent], [i])
+        if doc.has_revision(revision.hash):
+            return
+        if len(doc.revisions) == 0:
+            doc.append_revision(revision)
+            return
+
+        # the same steps as RDFAgent.integrate_revision
+        to_insert = True
+        try:
+            if revision.is_merge and doc.can_rebase(revision):
+                to_insert = False
+                self.rebases += 1
+                for rebased in doc.rebase_revision(revision):
+                    self.broadcast(i, rebased)
+            if i == 0:
+                merge = doc.merge_revision(revision)
+                if merge is not None:
+                    to_insert = False
+                    self.merges += 1
+                    doc.append_revision(revision)
+                    doc.append_revision(merge)
+                    self.broadcast(i, merge)
+        except MissingRevision:
+            pass
+        if to_insert:
+            doc.append_revision(revision)
+
+    def step(self, generate: bool):
+        self.tick += 1
+        if generate:
+            for i in self.rng.sample(range(len(self.docs)), len(self.docs)):
+                if self.rng.random() < self.args.create_chance:
+                    self.create_revision(i)
+        while len(self._queue) > 0 and self._queue[0][0] <= self.tick:
+            _, _, sender, recipient, data = heapq.heappop(self._queue)
+            self.receive(sender, recipient, data)
+
+    def run(self) -> dict:
+        for _ in range(self.args.ticks):
+            self.step(True)
+        generated_at = self.tick
+        converged_at = None
+        while len(self._queue) > 0:
+            self.step(False)
+            if converged_at is None and self.tracker.converged:
+                converged_at = self.tick
+        # concurrent changes of one triple are merged with removals first, so agents may agree on a state other than the truth
+        states = {frozenset(doc.cached_state) for doc in self.docs}
+        return {
+            "converged": self.tracker.converged,
+            "ticks_to_converge": converged_at - generated_at if converged_at is not None else None,
+            "ticks_to_quiesce": self.tick - generated_at,
+            "agreed": len(states) == 1,
+            "difference_from_truth": max(self.tracker.lagging_agents().values(), default=0),
+            "revisions": sum(len(doc.revisions) for doc in self.docs) // len(self.docs),
+            "merges": self.merges,
+            "rebases": self.rebases
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convergence of in-process agents uncovering a generated graph")
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--ticks", type=int, default=200, help="ticks in which agents uncover fragments")
+    parser.add_argument("--create-chance", type=float, default=0.5, help="probability that an agent creates a revision in a tick")
+    parser.add_argument("--delay", type=int, default=3, help="maximum ticks a message takes to arrive")
+    parser.add_argument("--triples", type=int, default=25, help="triples of the generated graph")
+    parser.add_argument("--workload", default="uniform", help="workload profile of the graph generator")
+    parser.add_argument("--seed", type=int, default=0)
+    add_arguments(parser, "convergence")
+    args = parser.parse_args()
+
+    outcome = {}
+
+    def run():
+        simulation = InProcessSimulation(args)
+        outcome.update(simulation.run())
+        return simulation.messages
+    result = measure(run, args.repeat)
+    result.update(outcome)
+    parameters = {key: value for key, value in vars(args).items() if key not in ("repeat", "save", "compare", "tolerance")}
+    report("convergence", parameters, {"convergence": result}, args)
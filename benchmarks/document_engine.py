@@ -0,0 +1,166 @@
+import argparse
+import copy
+import random
+
+from benchmarks.baseline import add_arguments, measure, report
+from services.rdf_document import RDFDocument, RDFRevision, RDFTriple
+
+MASTER = "master"
+
+
+def random_triple(rng: random.Random, entities: int, predicates: int) -> RDFTriple:
+    return RDFTriple(f"E{rng.randrange(entities)}", f"P{rng.randrange(predicates)}", f"E{rng.randrange(entities)}")
+
+
+def fill(rng: random.Random, doc: RDFDocument, triples: int, entities: int, predicates: int):
+    for _ in range(triples):
+        triple = random_triple(rng, entities, predicates)
+        doc.parse_fragment("-" if triple.hash in doc.cached_state and rng.random() < 0.3 else "+", triple)
+
+
+def branch_revision(rng: random.Random, master: RDFDocument, history: list[str], args: argparse.Namespace) -> RDFRevision:
+    """A revision of another author created on top of a recent revision of the merge master, like one that was sent before a merge arrived."""
+    parent = history[max(0, len(history) - 1 - rng.randrange(args.branch_depth))]
+    revision = RDFRevision(parents=[parent], author=f"author{rng.randrange(args.authors)}")
+    for _ in range(args.triples):
+        triple = random_triple(rng, args.entities, args.predicates)
+        if rng.random() < 0.2:
+            revision.remove(triple)
+        else:
+            revision.add(triple)
+    return revision
+
+
+def generate_dag(args: argparse.Namespace) -> tuple[RDFDocument, list[RDFRevision]]:
+    """Builds the document of a merge master which merges a revision of another author with probability `merge_chance`
+    and creates a revision of its own otherwise. Returns it with copies of its revisions in the order they were appended."""
+    rng = random.Random(args.seed)
+    master = RDFDocument(MASTER)
+    appended = []
+    history = []
+    master.new_revision()
+    fill(rng, master, args.triples, args.entities, args.predicates)
+    history.append(master.current_hash)
+    appended.append(master.current_revision)
+    while len(master.revisions) < args.revisions:
+        if rng.random() < args.merge_chance and len(history) > 1:
+            revision = branch_revision(rng, master, history, args)
+            if master.has_revision(revision.hash):
+                # revision hashes only depend on the parents and the author
+                continue
+            merge = master.merge_revision(revision)
+            master.append_revision(revision)
+            appended.append(revision)
+            if merge is not None:
+                master.append_revision(merge)
+                appended.append(merge)
+        else:
+            master.new_revision()
+            fill(rng, master, args.triples, args.entities, args.predicates)
+            appended.append(master.current_revision)
+        history.append(master.current_hash)
+    return master, [RDFRevision.from_json(revision.to_json()) for revision in appended]
+
+
+def benchmark(args: argparse.Namespace) -> dict[str, dict]:
+    rng = random.Random(args.seed)
+    master, revisions = generate_dag(args)
+    merges = sum(1 for revision in revisions if revision.is_merge)
+    hashes = list(master.revisions)
+    samples = [master.revisions[hash_] for hash_ in rng.sample(hashes, min(args.samples, len(hashes)))]
+    # received revisions are mostly recent ones, but a revision of an agent which was offline can start deep in the history
+    recent = [master.revisions[hash_] for hash_ in rng.choices(hashes[-args.window:], k=args.samples)]
+    root = master.revisions[hashes[0]]
+    results = {}
+
+    documents = []
+
+    def append_setup():
+        documents[:] = [RDFDocument(MASTER)]
+
+    def append_run():
+        doc = documents[0]
+        for revision in revisions:
+            doc.append_revision(copy.copy(revision))
+        return len(revisions)
+    results["append_revision"] = measure(append_run, args.repeat, append_setup)
+    results["append_revision"]["merges"] = merges
+
+    def common_ancestor_run(revisions: list[RDFRevision]):
+        for revision in revisions:
+            master.index.invalidate()
+            master.common_ancestor(revision)
+        return len(revisions)
+    results["common_ancestor"] = measure(lambda: common_ancestor_run(samples), args.repeat)
+    results["common_ancestor_recent"] = measure(lambda: common_ancestor_run(recent), args.repeat)
+
+    def revisions_between_run():
+        for revision in samples:
+            master.revisions_between(root.hash, revision)
+        return len(samples)
+    results["revisions_between"] = measure(revisions_between_run, args.repeat)
+
+    branches = [branch_revision(rng, master, hashes, args) for _ in range(args.samples)]
+
+    def merge_run():
+        for revision in branches:
+            master.index.invalidate()
+            master.merge_revision(revision)
+        return len(branches)
+    results["merge_revision"] = measure(merge_run, args.repeat)
+
+    # an agent whose local revisions get rebased on top of a merge of the first of them, which is what rebase_revision is for
+    rebase_docs = []
+    local = RDFDocument("local")
+    for revision in revisions:
+        local.append_revision(copy.copy(revision))
+    fork = local.current_hash
+    local_revisions = []
+    for _ in range(args.local_revisions):
+        local.new_revision()
+        fill(rng, local, args.triples, args.entities, args.predicates)
+        local_revisions.append(local.current_hash)
+    merge = RDFRevision(parents=[fork, local_revisions[0]], author=MASTER, merge_ancestor=fork)
+
+    def rebase_setup():
+        rebase_docs[:] = [copy.deepcopy(local)]
+
+    def rebase_run():
+        rebase_docs[0].rebase_revision(copy.copy(merge))
+        return args.local_revisions - 1
+    results["rebase_revision"] = measure(rebase_run, args.repeat, rebase_setup)
+
+    def regenerate_setup():
+        master._checkpoints.clear()
+
+    def regenerate_run():
+        master.regenerate_state()
+    results["regenerate_state_cold"] = measure(regenerate_run, args.repeat, regenerate_setup)
+    results["regenerate_state_warm"] = measure(regenerate_run, args.repeat)
+
+    def json_run():
+        for revision in revisions:
+            RDFRevision.from_json(revision.to_json())
+        return len(revisions)
+    results["json_round_trip"] = measure(json_run, args.repeat)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmarks of RDFDocument operations on a generated revision DAG")
+    parser.add_argument("--revisions", type=int, default=2000, help="revisions in the generated document")
+    parser.add_argument("--merge-chance", type=float, default=0.3, help="probability that the next revision is a merge")
+    parser.add_argument("--branch-depth", type=int, default=8, help="how many revisions back merged branches may start")
+    parser.add_argument("--triples", type=int, default=5, help="fragments per revision")
+    parser.add_argument("--entities", type=int, default=100)
+    parser.add_argument("--predicates", type=int, default=20)
+    parser.add_argument("--authors", type=int, default=8)
+    parser.add_argument("--local-revisions", type=int, default=50, help="local revisions moved by rebase_revision")
+    parser.add_argument("--window", type=int, default=64, help="latest revisions common_ancestor is looked up for")
+    parser.add_argument("--samples", type=int, default=200, help="revisions used by the per-revision benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    add_arguments(parser, "document_engine")
+    args = parser.parse_args()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("repeat", "save", "compare", "tolerance")}
+    report("document_engine", parameters, benchmark(args), args)
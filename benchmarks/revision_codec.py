@@ -0,0 +1,57 @@
+import argparse
+import random
+import time
+
+from services.rdf_document import RDFRevision, RDFTriple
+from services.revision_codec import REVISION_FORMAT_BINARY, REVISION_FORMAT_JSON, decode_revision, encode_revision
+
+
+def make_revision(rng: random.Random, triples: int, entities: int, predicates: int) -> RDFRevision:
+    parent = RDFRevision(parents=None, author=str(rng.random()))
+    revision = RDFRevision(parents=[parent.hash], author=str(rng.random()))
+    for _ in range(triples):
+        triple = RDFTriple(f"E{rng.randrange(entities)}", f"P{rng.randrange(predicates)}", f"E{rng.randrange(entities)}")
+        if rng.random() < 0.8:
+            revision.add(triple)
+        else:
+            revision.remove(triple)
+    return revision
+
+
+def measure(revisions: list[RDFRevision], language: str, compress_threshold) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    bodies = [encode_revision(r, language, compress_threshold=compress_threshold) for r in revisions]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [decode_revision(b, language) for b in bodies]
+    decode_time = time.perf_counter() - start
+
+    for original, copy in zip(revisions, decoded):
+        assert copy.hash == original.hash and copy.parents == original.parents
+        assert copy.deltas_add.keys() == original.deltas_add.keys()
+        assert copy.deltas_remove.keys() == original.deltas_remove.keys()
+    return encode_time, decode_time, sum(len(b) for b in bodies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Encode/decode throughput of revision wire formats")
+    parser.add_argument("--revisions", type=int, default=2000)
+    parser.add_argument("--triples", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--predicates", type=int, default=50)
+    args = parser.parse_args()
+
+    formats = [
+        ("json", REVISION_FORMAT_JSON, None),
+        ("binary", REVISION_FORMAT_BINARY, None),
+        ("binary+zlib", REVISION_FORMAT_BINARY, 0),
+    ]
+    rng = random.Random(0)
+    print(f"{'triples':>8} {'format':>12} {'encode rev/s':>14} {'decode rev/s':>14} {'bytes/rev':>10}")
+    for triples in args.triples:
+        count = max(1, args.revisions // max(1, triples // 10))
+        revisions = [make_revision(rng, triples, args.entities, args.predicates) for _ in range(count)]
+        for name, language, compress_threshold in formats:
+            encode_time, decode_time, size = measure(revisions, language, compress_threshold)
+            print(f"{triples:>8} {name:>12} {count / encode_time:>14.0f} {count / decode_time:>14.0f} {size / count:>10.0f}")
@@ -2,4 +2,40 @@ import os
 
 AGENT_ADDRESS = os.getenv("ADDRESS")
 AGENT_PASSWORD = os.getenv("PASSWORD")
-PREFIX = os.getenv("PREFIX") or ""
\ No newline at end of file
+PREFIX = os.getenv("PREFIX") or ""
+STATUS_MODE = os.getenv("STATUS_MODE") or "broadcast"
+GOSSIP_FANOUT = int(os.getenv("GOSSIP_FANOUT") or 3)
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY") or 16)
+
+LOG_MODE = os.getenv("LOG_MODE") or "per-logger"
+LOG_LEVELS = os.getenv("LOG_LEVELS") or ""
+LOG_AGENT_SAMPLE = float(os.getenv("LOG_AGENT_SAMPLE") or 1)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES") or 64 * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT") or 5)
+
+SIMULATION_WORKERS = int(os.getenv("SIMULATION_WORKERS") or 0)
+STARTUP_CONCURRENCY = int(os.getenv("STARTUP_CONCURRENCY") or 16)
+
+TRANSPORT = os.getenv("TRANSPORT") or "xmpp"
+LOOPBACK_LATENCY = float(os.getenv("LOOPBACK_LATENCY") or 0)
+LOOPBACK_JITTER = float(os.getenv("LOOPBACK_JITTER") or 0)
+LOOPBACK_LOSS = float(os.getenv("LOOPBACK_LOSS") or 0)
+LOOPBACK_REORDER = float(os.getenv("LOOPBACK_REORDER") or 0)
+LOOPBACK_REORDER_DELAY = float(os.getenv("LOOPBACK_REORDER_DELAY") or 0.1)
+LOOPBACK_SEED = int(os.getenv("LOOPBACK_SEED")) if os.getenv("LOOPBACK_SEED") else None
+
+GRAPH_TRIPLES = int(os.getenv("GRAPH_TRIPLES") or 25)
+GRAPH_ENTITIES = int(os.getenv("GRAPH_ENTITIES") or 10)
+GRAPH_PREDICATES = int(os.getenv("GRAPH_PREDICATES") or 10)
+GRAPH_LAZY = os.getenv("GRAPH_LAZY") == "1" if os.getenv("GRAPH_LAZY") else None
+WORKLOAD = os.getenv("WORKLOAD") or "uniform"
+WORKLOAD_RECORD = os.getenv("WORKLOAD_RECORD")
+WORKLOAD_REPLAY = os.getenv("WORKLOAD_REPLAY")
+
+STORE_DIRECTORY = os.getenv("STORE_DIRECTORY")
+STORE_FLUSH_PERIOD = float(os.getenv("STORE_FLUSH_PERIOD") or 1)
+STORE_SYNC = os.getenv("STORE_SYNC") or "NORMAL"
+STORE_SNAPSHOT_REVISIONS = int(os.getenv("STORE_SNAPSHOT_REVISIONS") or 256)
+
+COMPACTION_PERIOD = float(os.getenv("COMPACTION_PERIOD") or 30)
+COMPACTION_MIN_REVISIONS = int(os.getenv("COMPACTION_MIN_REVISIONS") or 256)
@@ -1,50 +1,135 @@
+import atexit
 import logging
+import logging.handlers
 import os.path
+import queue
 import time
+import zlib
+from typing import Optional
 
-from agents.message_delivery_fail import MessageDeliveryFail
+from config import LOG_AGENT_SAMPLE, LOG_BACKUP_COUNT, LOG_LEVELS, LOG_MAX_BYTES, LOG_MODE
+
+LOG_MODE_PER_LOGGER = "per-logger"
+LOG_MODE_SHARED = "shared"
 
 directory = ""
+_router: Optional['LoggerFileRouter'] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them, the listener thread formats them when writing."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # tracebacks are rendered while their frames are still alive
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LoggerFileRouter(logging.Handler):
+    """Writes records of each logger created by `get_logger` to its own file, runs in the listener thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.names: set[str] = set()
+        self._handlers: dict[str, logging.Handler] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.name not in self.names:
+            return
+        handler = self._handlers.get(record.name)
+        if handler is None:
+            handler = logging.FileHandler(os.path.join(directory, f"{record.name.replace('/', '_')}.log"))
+            handler.setFormatter(logging.Formatter("[%(levelname)s] %(asctime)s: %(message)s"))
+            self._handlers[record.name] = handler
+        handler.handle(record)
+
+    def close(self) -> None:
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
 
 
-def setup_logging():
-    global directory
-    time_ = time.strftime("%Y-%m-%d_%H-%M-%S")
-    directory = os.path.join("logs", time_)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+def parse_levels(levels: str) -> dict[str, int]:
+    """Parses per-subsystem levels, e.g. `Agent=INFO,Server=DEBUG,spade=WARNING`."""
+    parsed = {}
+    for entry in filter(None, levels.split(",")):
+        subsystem, level = entry.split("=")
+        parsed[subsystem.strip()] = logging.getLevelName(level.strip().upper())
+    return parsed
+
+
+_levels = parse_levels(LOG_LEVELS)
+
+
+def setup_logging(shared_directory: Optional[str] = None, name: str = "log"):
+    """Sets up logging into a new directory, or into `shared_directory` of the main process for worker processes."""
+    global directory, _router, _listener
+    if shared_directory is not None:
+        directory = shared_directory
     else:
-        raise Exception(f"Directory {directory} already exists - cannot create logs")
+        time_ = time.strftime("%Y-%m-%d_%H-%M-%S")
+        directory = os.path.join("logs", time_)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        else:
+            raise Exception(f"Directory {directory} already exists - cannot create logs")
 
     stream_handle = logging.StreamHandler()
     stream_handle.setLevel(logging.INFO)
 
-    handlers = [
-        logging.FileHandler(os.path.join(directory, "log.log")),
-        stream_handle
-    ]
+    formatter = logging.Formatter("[%(levelname)s] %(asctime)s (%(name)s): %(message)s")
+    if LOG_MODE == LOG_MODE_SHARED:
+        file_handle = logging.handlers.RotatingFileHandler(os.path.join(directory, f"{name}.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    else:
+        file_handle = logging.FileHandler(os.path.join(directory, f"{name}.log"))
+    file_handle.setFormatter(formatter)
+    stream_handle.setFormatter(formatter)
+
+    handlers = [file_handle, stream_handle]
+    if LOG_MODE != LOG_MODE_SHARED:
+        _router = LoggerFileRouter()
+        handlers.append(_router)
+
+    # file I/O happens in the listener thread instead of the asyncio loop
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(logging.WARNING)
+    root.addHandler(DeferredQueueHandler(records))
+    # levels of libraries, e.g. spade or aioxmpp, apply through their logger hierarchy
+    for subsystem, level in _levels.items():
+        logging.getLogger(subsystem).setLevel(level)
+
 
-    def message_delivery_fail_filter(record: logging.LogRecord) -> bool:
-        if record.levelno == logging.WARNING and record.msg.startswith("No behaviour matched for message: "):
-            raise MessageDeliveryFail()
-        return True
+def log_directory() -> str:
+    return directory
 
-    for i in range(len(handlers)):
-        handlers[i].addFilter(message_delivery_fail_filter)
 
-    logging.basicConfig(
-        level=logging.WARNING,
-        format="[%(levelname)s] %(asctime)s (%(name)s): %(message)s",
-        handlers=handlers
-    )
+def _is_sampled(name: str) -> bool:
+    return zlib.crc32(name.encode("utf-8")) / 2 ** 32 < LOG_AGENT_SAMPLE
 
 
 def get_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    subsystem = name.split("-")[0]
+    level = _levels.get(subsystem, logging.DEBUG)
+    if subsystem == "Agent" and not _is_sampled(name):
+        # only a deterministic sample of agents keeps debug logs
+        level = max(level, logging.INFO)
+    logger.setLevel(level)
 
-    fh = logging.FileHandler(os.path.join(directory, f"{name.replace('/', '_')}.log"))
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(logging.Formatter("[%(levelname)s] %(asctime)s: %(message)s"))
-    logger.addHandler(fh)
+    if _router is not None:
+        _router.names.add(name)
+    elif _listener is None and not any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
+        # loggers are shared by name, so a logger got again keeps writing through its first handler
+        fh = logging.FileHandler(os.path.join(directory, f"{name.replace('/', '_')}.log"))
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(logging.Formatter("[%(levelname)s] %(asctime)s: %(message)s"))
+        logger.addHandler(fh)
     return logger
@@ -1,7 +1,8 @@
+from config import SIMULATION_WORKERS
 from logger.logger import setup_logging
-from services.graph_generator import GraphGenerator
 from services.server import Server
 from services.simulation import Simulation
+from services.workload import create_graph_generator
 from web.gui_server import GuiServer
 
 if __name__ == '__main__':
@@ -9,7 +10,8 @@ if __name__ == '__main__':
 
     simulation = Simulation(
         server=Server(),
-        graph_generator=GraphGenerator()
+        graph_generator=create_graph_generator(),
+        workers=SIMULATION_WORKERS
     )
     simulation.populate(4)
     
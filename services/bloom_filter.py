@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import math
+from typing import Iterable
+
+
+class BloomFilter:
+    """Compact set summary without false negatives, used to tell peers which revisions are already known."""
+
+    def __init__(self, size: int, hashes: int, bits: bytes = None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((size + 7) // 8)
+
+    @staticmethod
+    def for_capacity(capacity: int, error_rate: float = 0.01) -> 'BloomFilter':
+        capacity = max(1, capacity)
+        size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return BloomFilter(size, hashes)
+
+    @staticmethod
+    def of(items: Iterable[str], capacity: int, error_rate: float = 0.01) -> 'BloomFilter':
+        bloom = BloomFilter.for_capacity(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_dict(self) -> dict:
+        return {"size": self.size, "hashes": self.hashes, "bits": base64.b64encode(self.bits).decode("ascii")}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'BloomFilter':
+        return BloomFilter(data["size"], data["hashes"], base64.b64decode(data["bits"]))
@@ -1,19 +1,182 @@
+import asyncio
+from array import array
 from collections import defaultdict
+import threading
 import time
+from typing import Iterable, NamedTuple, Optional, Union
+
+from services.rdf_document import RDFRevision, TripleStore
+
+CHANGE_LOG_CAPACITY = 65536
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_COALESCE = "coalesce"
+
+
+class MessageChange(NamedTuple):
+    seq: int
+    label: str
+    sender: str
+    to: str
+    added: Optional[array]  # ids of interned triples, None for messages without revisions
+    removed: Optional[array]
+
+    kind = "message"
+
+
+class UncoveredChange(NamedTuple):
+    seq: int
+    agent: str
+    operation: str
+    triple_id: int
+
+    kind = "uncovered"
+
+
+Change = Union[MessageChange, UncoveredChange]
+
+
+class ChangeCursor:
+    """Independent reader position in the change log.
+    Changes older than `limit` behind the newest one are dropped or coalesced into per-kind counts on read."""
+
+    def __init__(self, seq: int, limit: int, overflow: str = OVERFLOW_DROP):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_COALESCE):
+            raise ValueError(f"Unknown overflow policy {overflow}")
+        self.seq = seq
+        self.limit = limit
+        self.overflow = overflow
+        self.dropped = 0
+        self.last_read = time.time()
+        self._ready: asyncio.Event = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+    @property
+    def pending(self) -> int:
+        return ChangeLog.next_seq - self.seq
+
+    def read(self) -> tuple[list[Change], int, dict[str, int], float]:
+        """Returns the changes since the previous read, the number of dropped ones, coalesced counts and the time since the previous read."""
+        previous_read = self.last_read
+        self.last_read = time.time()
+        if self._ready is not None:
+            self._ready.clear()
+
+        start, end = self.seq, ChangeLog.next_seq
+        oldest = max(0, end - ChangeLog.capacity)
+        dropped = max(0, oldest - start)
+        start = max(start, oldest)
+        coalesced = defaultdict(int)
+        if end - start > self.limit:
+            excess = end - start - self.limit
+            if self.overflow == OVERFLOW_COALESCE:
+                for change in ChangeLog.changes(start, start + excess):
+                    coalesced[change.kind] += 1
+            else:
+                dropped += excess
+            start += excess
+
+        self.seq = end
+        self.dropped += dropped
+        return ChangeLog.changes(start, end), dropped, dict(coalesced), self.last_read - previous_read
+
+    def notify(self) -> None:
+        if self._ready is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._ready.set()
+        else:
+            # changes of sharded agents are logged from the coordinator's threads
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def wait(self, timeout: float) -> None:
+        if self._ready is None:
+            self._loop = asyncio.get_running_loop()
+            self._ready = asyncio.Event()
+        if self.pending > 0:
+            return
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
 
 class ChangeLog:
-    state = []
-    last_read = time.time()
+    """Bounded ring buffer of simulation changes, the oldest changes are overwritten once it is full."""
+    capacity = CHANGE_LOG_CAPACITY
+    _records: list[Optional[Change]] = [None] * CHANGE_LOG_CAPACITY
+    next_seq = 0
+    cursors: list[ChangeCursor] = []
+    _default_cursor = ChangeCursor(0, CHANGE_LOG_CAPACITY)
+    # the coordinator of sharded agents logs from several threads at once
+    _lock = threading.Lock()
+
+    @classmethod
+    def _append(cls, kind: type, *fields) -> None:
+        with cls._lock:
+            change = kind(cls.next_seq, *fields)
+            cls._records[change.seq % cls.capacity] = change
+            cls.next_seq += 1
+        for cursor in cls.cursors:
+            cursor.notify()
+
+    @staticmethod
+    def encode_deltas(revisions: Iterable[RDFRevision]) -> tuple[array, array]:
+        """Encodes the deltas of the sent revisions once, so records of a fan-out can share them."""
+        revisions = list(revisions)
+        added = TripleStore.encode(triple for revision in revisions for triple in revision.added_triples())
+        removed = TripleStore.encode(triple for revision in revisions for triple in revision.removed_triples())
+        return added, removed
+
+    @classmethod
+    def log_message(cls, label: str, sender: str, to: str, deltas: Optional[tuple[array, array]] = None) -> None:
+        added, removed = deltas if deltas is not None else (None, None)
+        cls._append(MessageChange, label, sender, to, added, removed)
+
+    @classmethod
+    def log_uncovered(cls, agent: str, operation: str, triple_id: int) -> None:
+        cls._append(UncoveredChange, agent, operation, triple_id)
+
+    @classmethod
+    def triple_ids(cls) -> set[int]:
+        """Returns ids of the triples the records refer to, which must stay interned while the records can be read."""
+        ids = set()
+        for change in cls._records:
+            if change is None:
+                continue
+            if change.kind == "uncovered":
+                ids.add(change.triple_id)
+            elif change.added is not None:
+                ids.update(change.added)
+                ids.update(change.removed)
+        return ids
+
+    @classmethod
+    def changes(cls, start: int, end: int) -> list[Change]:
+        records = cls._records
+        return [records[seq % cls.capacity] for seq in range(start, end)]
+
+    @classmethod
+    def read(cls) -> tuple[list[Change], float]:
+        changes, _, _, delta_time = cls._default_cursor.read()
+        return changes, delta_time
+
+    @classmethod
+    def dropped(cls) -> int:
+        """Returns the number of changes readers fell too far behind to read."""
+        return cls._default_cursor.dropped + sum(cursor.dropped for cursor in cls.cursors)
 
     @classmethod
-    def log(cls, key: str, change: any) -> None:
-        cls.state.append([key, *change])
+    def subscribe(cls, limit: int, overflow: str = OVERFLOW_DROP) -> ChangeCursor:
+        cursor = ChangeCursor(cls.next_seq, limit, overflow)
+        cls.cursors.append(cursor)
+        return cursor
 
     @classmethod
-    def read(cls) -> list[any]:
-        previous_read = cls.last_read
-        cls.last_read = time.time()
-        values = cls.state
-        cls.state = []
-        return values, cls.last_read-previous_read
\ No newline at end of file
+    def unsubscribe(cls, cursor: ChangeCursor) -> None:
+        if cursor in cls.cursors:
+            cls.cursors.remove(cursor)
@@ -0,0 +1,164 @@
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+from services.rdf_document import RDFDocument
+
+CONVERGENCE_HISTORY = 64
+
+
+class ConvergenceTracker:
+    """Keeps the difference between every agent's state and the uncovered truth up to date as either of them changes.
+
+    The difference of an agent is `|state| + |truth| - 2 * |state & truth|`, so only the size of the intersection
+    is kept per agent, along with the agents holding each triple, which is what a change of the truth affects."""
+
+    def __init__(self):
+        self._truth: set[str] = set()
+        self.reset()
+
+    def reset(self):
+        """Forgets all agents and convergence history, the truth outlives restarts of the simulation."""
+        self._holders: dict[str, set[str]] = {}
+        self._states: dict[str, set[str]] = {}
+        self._common: dict[str, int] = {}
+        self._synchronized: set[str] = set()
+        self._diverged_at: dict[str, float] = {}
+        self._converged = False
+        self._diverged_since = time.time()
+        self._converged_since: Optional[float] = None
+        self.times_to_convergence: deque[float] = deque(maxlen=CONVERGENCE_HISTORY)
+
+    def track(self, jid: str, doc: RDFDocument):
+        self._states[jid] = set()
+        self._common[jid] = 0
+        self._diverged_at[jid] = time.time()
+        self.state_changed(jid, doc.cached_state.keys(), ())
+        doc.observers.append(lambda added, removed: self.state_changed(jid, added, removed))
+
+    def untrack(self, jid: str):
+        state = self._states.pop(jid, None)
+        if state is None:
+            return
+        for hash_ in state:
+            holders = self._holders[hash_]
+            holders.discard(jid)
+            if len(holders) == 0:
+                del self._holders[hash_]
+        del self._common[jid]
+        self._synchronized.discard(jid)
+        self._diverged_at.pop(jid, None)
+        self._update_convergence()
+
+    def replace_state(self, jid: str, hashes: Iterable[str]):
+        """Tracks the new state of an agent whose changes are not observed one by one."""
+        if jid not in self._states:
+            self._states[jid] = set()
+            self._common[jid] = 0
+            self._diverged_at[jid] = time.time()
+        state = self._states[jid]
+        hashes = set(hashes)
+        self.state_changed(jid, hashes - state, state - hashes)
+
+    def state_changed(self, jid: str, added: Iterable[str], removed: Iterable[str]):
+        state = self._states.get(jid)
+        if state is None:
+            return
+        for hash_ in added:
+            if hash_ in state:
+                continue
+            state.add(hash_)
+            self._holders.setdefault(hash_, set()).add(jid)
+            if hash_ in self._truth:
+                self._common[jid] += 1
+        for hash_ in removed:
+            if hash_ not in state:
+                continue
+            state.remove(hash_)
+            holders = self._holders[hash_]
+            holders.discard(jid)
+            if len(holders) == 0:
+                del self._holders[hash_]
+            if hash_ in self._truth:
+                self._common[jid] -= 1
+        self._refresh(jid)
+        self._update_convergence()
+
+    def truth_changed(self, added: Iterable[str], removed: Iterable[str]):
+        affected = set()
+        for hash_ in added:
+            if hash_ in self._truth:
+                continue
+            self._truth.add(hash_)
+            for jid in self._holders.get(hash_, ()):
+                self._common[jid] += 1
+                affected.add(jid)
+        shrunk = False
+        for hash_ in removed:
+            if hash_ not in self._truth:
+                continue
+            self._truth.remove(hash_)
+            shrunk = True
+            for jid in self._holders.get(hash_, ()):
+                self._common[jid] -= 1
+                affected.add(jid)
+        if shrunk:
+            # a removed triple an agent never held brings it closer to the truth too
+            affected.update(jid for jid in self._states if jid not in self._synchronized)
+        if len(affected) == 0 and len(self._synchronized) == 0:
+            return
+        # an added triple can only synchronize agents holding it, but any change desynchronizes all others
+        for jid in affected | self._synchronized:
+            self._refresh(jid)
+        self._update_convergence()
+
+    def difference(self, jid: str) -> int:
+        return len(self._states[jid]) + len(self._truth) - 2 * self._common[jid]
+
+    def _refresh(self, jid: str):
+        if self.difference(jid) == 0:
+            self._synchronized.add(jid)
+            self._diverged_at.pop(jid, None)
+        elif jid in self._synchronized or jid not in self._diverged_at:
+            self._synchronized.discard(jid)
+            self._diverged_at[jid] = time.time()
+
+    def _update_convergence(self):
+        converged = len(self._states) > 0 and len(self._synchronized) == len(self._states)
+        if converged == self._converged:
+            return
+        now = time.time()
+        if converged:
+            self.times_to_convergence.append(now - self._diverged_since)
+            self._converged_since = now
+        else:
+            self._diverged_since = now
+            self._converged_since = None
+        self._converged = converged
+
+    @property
+    def converged(self) -> bool:
+        return self._converged
+
+    def lagging_agents(self) -> dict[str, int]:
+        """Returns the differences of the unsynchronized agents, the largest first."""
+        lagging = {jid: self.difference(jid) for jid in self._states if jid not in self._synchronized}
+        return dict(sorted(lagging.items(), key=lambda item: item[1], reverse=True))
+
+    def agent_lag(self) -> dict[str, dict[str, float]]:
+        """Returns the difference of every unsynchronized agent and the time since it was last synchronized."""
+        now = time.time()
+        return {jid: {"difference": difference, "lag": now - self._diverged_at[jid]} for jid, difference in self.lagging_agents().items()}
+
+    def metrics(self) -> dict:
+        now = time.time()
+        return {
+            "agents": len(self._states),
+            "synchronized": len(self._synchronized),
+            "truth": len(self._truth),
+            "converged": self._converged,
+            "converged_for": now - self._converged_since if self._converged_since is not None else None,
+            "diverged_for": now - self._diverged_since if not self._converged else None,
+            "last_time_to_convergence": self.times_to_convergence[-1] if len(self.times_to_convergence) > 0 else None,
+            "times_to_convergence": list(self.times_to_convergence)
+        }
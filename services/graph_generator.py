@@ -1,58 +1,299 @@
-from typing import Optional
+from collections import deque
+from typing import Callable, Iterable, Optional
 
 import numpy as np
 
 from services.rdf_document import RDFTriple
 
+MARKER_CHANGES_LIMIT = 1024
+# number of random draws and spare ground truth triples generated at once
+RANDOM_BATCH_SIZE = 4096
+# larger graphs only create triples once they are uncovered
+EAGER_TRIPLES_LIMIT = 100_000
+
+DISTRIBUTION_UNIFORM = "uniform"
+DISTRIBUTION_ZIPF = "zipf"
+
 
 class GraphGenerator:
     def __init__(self, *, total_triples: int = 25, mutation_chance: float = 0.1, uncover_outdated_chance: float = 0.3,
-                 triple_generator: Optional['TripleGenerator'] = None, seed=123):
+                 triple_generator: Optional['TripleGenerator'] = None, total_entities: int = 10, total_predicates: int = 10,
+                 entity_distribution: str = DISTRIBUTION_UNIFORM, predicate_distribution: str = DISTRIBUTION_UNIFORM, zipf_exponent: float = 1.1,
+                 batch_size: int = 1, burst_chance: float = 0, burst_size: int = 1, seed=123, lazy: Optional[bool] = None,
+                 trace: Optional['TraceRecorder'] = None):
+        """With `lazy`, ground truth is kept as term indices and triples are only created once uncovered,
+        by default for graphs of more than EAGER_TRIPLES_LIMIT triples.
+
+        Each tick of an agent uncovers `batch_size` fragments, or `batch_size * burst_size` with probability `burst_chance`.
+        Ticks are written to `trace` for a later replay."""
         self.random = np.random.default_rng(seed=seed)
-        self.triple_generator = triple_generator or TripleGenerator(self.random)
+        self.triple_generator = triple_generator or TripleGenerator(self.random, total_entities=total_entities, total_predicates=total_predicates,
+                                                                    entity_distribution=entity_distribution,
+                                                                    predicate_distribution=predicate_distribution, zipf_exponent=zipf_exponent)
         self.mutation_chance = mutation_chance
         self.uncover_outdated_chance = uncover_outdated_chance
+        self.batch_size = batch_size
+        self.burst_chance = burst_chance
+        self.burst_size = burst_size
+        self.trace = trace
         self.total_triples = total_triples
+        self.lazy = lazy if lazy is not None else total_triples > EAGER_TRIPLES_LIMIT
         self.uncovered_triples = {}
+        # called with hashes of triples added to and removed from uncovered_triples
+        self.observers: list[Callable[[Iterable[str], Iterable[str]], None]] = []
+        self.markers_version = 0
+        self._marker_changes: deque[tuple[int, str]] = deque()
+        self._marker_changes_start = 0
+        self._draws = np.empty(0)
+        self._draws_position = 0
+        self._spare_terms = np.empty((0, 3), dtype=np.int64)
+        self._spare_position = 0
+        # triples that were created, by their key, so leaving the ground truth can be tracked for them
+        self._created: dict[int, RDFTriple] = {}
+        # created triples which are no longer in the ground truth, only these can be outdated in agents' states
+        self.outdated: dict[str, RDFTriple] = {}
 
         self.restart()
 
     def restart(self) -> None:
-        self.ground_truth = [self.triple_generator.generate_triple() for _ in range(self.total_triples)]
-        self.triple_markers = {t.hash: i+1 for i, t in enumerate(self.ground_truth)}
+        for triple in self._created.values():
+            self.outdated[triple.hash] = triple
+        self._terms = self.triple_generator.generate_terms(self.total_triples)
+        keys, counts = np.unique(self.triple_generator.keys(self._terms), return_counts=True)
+        self._truth_counts: dict[int, int] = dict(zip(keys.tolist(), counts.tolist()))
+        for key in self._truth_counts:
+            triple = self._created.get(key)
+            if triple is not None:
+                del self.outdated[triple.hash]
+
+        self.ground_truth: list[Optional[RDFTriple]] = [None] * self.total_triples
+        self.triple_markers = {}
+        if not self.lazy:
+            for tid in range(self.total_triples):
+                self.truth_triple(tid)
+        # incremented whenever triple_markers change, a restart outdates every marker derived from them
+        self.markers_version += 1
+        self._marker_changes.clear()
+        self._marker_changes_start = self.markers_version
+
+    def forget_outdated(self) -> None:
+        """Stops tracking outdated triples, once every agent which could hold them was replaced."""
+        self._created = {key: triple for key, triple in self._created.items() if triple.hash not in self.outdated}
+        self.outdated = {}
+
+    def triples(self) -> Iterable[RDFTriple]:
+        """Returns the triples the generator refers to, which must stay interned."""
+        yield from (triple for triple in self.ground_truth if triple is not None)
+        yield from self._created.values()
+        yield from self.outdated.values()
+        yield from self.uncovered_triples.values()
+
+    def truth_triple(self, tid: int) -> RDFTriple:
+        """Returns the ground truth triple at the index, creating it if it was not uncovered yet."""
+        triple = self.ground_truth[tid]
+        if triple is None:
+            terms = self._terms[tid]
+            triple = self.ground_truth[tid] = self.triple_generator.triple(terms)
+            self._created[self.triple_generator.key(terms)] = triple
+            self.triple_markers[triple.hash] = tid+1
+        return triple
+
+    def adopt(self, triples: Iterable[RDFTriple]) -> None:
+        """Tracks triples of a state restored from an earlier run, which this generator never created,
+        so those outside the ground truth are uncovered as outdated and those in it get markers."""
+        tids = None
+        for triple in triples:
+            if triple.hash in self.triple_markers or triple.hash in self.outdated:
+                continue
+            terms = self.triple_generator.terms_of(triple)
+            key = self.triple_generator.key(terms) if terms is not None else None
+            if key is None or key not in self._truth_counts:
+                if key is not None:
+                    self._created[key] = triple
+                self.outdated[triple.hash] = triple
+                continue
+            if tids is None:
+                tids = dict(zip(self.triple_generator.keys(self._terms).tolist(), range(self.total_triples)))
+            self.truth_triple(tids[key])
+
+    def uncover_graph_fragments(self, known_triples: dict[str, RDFTriple], agent: Optional[str] = None) -> list[tuple[str, RDFTriple]]:
+        """Uncovers the fragments of one tick of the agent, each of them given the state left by the previous ones."""
+        count = self.batch_size
+        if self.burst_chance > 0 and self._draw() < self.burst_chance:
+            count *= self.burst_size
+        if count == 1:
+            fragments = [self.uncover_graph_fragment(known_triples)]
+        else:
+            known = dict(known_triples)
+            fragments = []
+            for _ in range(count):
+                operation, triple = self.uncover_graph_fragment(known)
+                if operation == "+":
+                    known[triple.hash] = triple
+                else:
+                    del known[triple.hash]
+                fragments.append((operation, triple))
+        if self.trace is not None:
+            # triples adopted from a restored state may have no marker
+            self.trace.record(agent, [(operation, triple, self.triple_markers.get(triple.hash, 0)) for operation, triple in fragments])
+        return fragments
 
     def uncover_graph_fragment(self, known_triples: dict[str, RDFTriple]) -> tuple[str, RDFTriple]:
-        if self.random.random() < self.mutation_chance:
-            tid = self.get_random_triple_id()
-            self.triple_markers[self.ground_truth[tid].hash] = -tid-1
-            self.ground_truth[tid] = self.triple_generator.generate_triple()
-            self.triple_markers[self.ground_truth[tid].hash] = tid+1
-        if self.random.random() < self.uncover_outdated_chance:
-            removed = list(set(known_triples.keys()).difference({t.hash for t in self.ground_truth}))
+        if self._draw() < self.mutation_chance:
+            self._mutate(self.get_random_triple_id())
+        if self._draw() < self.uncover_outdated_chance:
+            removed = self._outdated_in(known_triples)
             if len(removed) > 0:
-                to_remove = self.random.choice(removed)
-                if to_remove in self.uncovered_triples:
-                    del self.uncovered_triples[to_remove]
-                return "-", known_triples[to_remove]
-        to_add = self.ground_truth[self.get_random_triple_id()]
-        self.uncovered_triples[to_add.hash] = to_add
+                to_remove = known_triples[removed[self._index(len(removed))]]
+                self._uncover("-", to_remove)
+                return "-", to_remove
+        to_add = self.truth_triple(self.get_random_triple_id())
+        self._uncover("+", to_add)
         return "+", to_add
 
+    def _uncover(self, operation: str, triple: RDFTriple):
+        if operation == "-" and triple.hash in self.uncovered_triples:
+            del self.uncovered_triples[triple.hash]
+            self._notify((), (triple.hash,))
+        elif operation == "+" and triple.hash not in self.uncovered_triples:
+            self.uncovered_triples[triple.hash] = triple
+            self._notify((triple.hash,), ())
+
+    def _mutate(self, tid: int):
+        old = self.ground_truth[tid]
+        if old is not None:
+            self.triple_markers[old.hash] = -tid-1
+            self._record_marker_change(old.hash)
+        self._leave_truth(self.triple_generator.key(self._terms[tid]))
+
+        self._terms[tid] = self._spare_triple_terms()
+        self.ground_truth[tid] = None
+        self._enter_truth(self.triple_generator.key(self._terms[tid]))
+        if not self.lazy or old is not None:
+            # a created triple was replaced, agents may know about the triple at its index
+            self._record_marker_change(self.truth_triple(tid).hash)
+
+    def _leave_truth(self, key: int):
+        count = self._truth_counts[key] - 1
+        if count > 0:
+            self._truth_counts[key] = count
+            return
+        del self._truth_counts[key]
+        triple = self._created.get(key)
+        if triple is not None:
+            self.outdated[triple.hash] = triple
+
+    def _enter_truth(self, key: int):
+        count = self._truth_counts.get(key, 0)
+        self._truth_counts[key] = count + 1
+        if count == 0:
+            triple = self._created.get(key)
+            if triple is not None:
+                del self.outdated[triple.hash]
+
+    def _outdated_in(self, known_triples: dict[str, RDFTriple]) -> list[str]:
+        """Returns hashes of the known triples which are no longer in the ground truth, iterating the smaller collection."""
+        if len(self.outdated) < len(known_triples):
+            return [hash_ for hash_ in self.outdated if hash_ in known_triples]
+        return [hash_ for hash_ in known_triples if hash_ in self.outdated]
+
+    def _notify(self, added: Iterable[str], removed: Iterable[str]):
+        for observer in self.observers:
+            observer(added, removed)
+
+    def _record_marker_change(self, hash_: str):
+        self.markers_version += 1
+        self._marker_changes.append((self.markers_version, hash_))
+        if len(self._marker_changes) > MARKER_CHANGES_LIMIT:
+            self._marker_changes_start = self._marker_changes.popleft()[0]
+
+    def markers_changed_since(self, version: int) -> Optional[set[str]]:
+        """Returns hashes of triples whose markers changed after the given version, or None if that is no longer known."""
+        if version < self._marker_changes_start:
+            return None
+        changed = set()
+        for changed_version, hash_ in reversed(self._marker_changes):
+            if changed_version <= version:
+                break
+            changed.add(hash_)
+        return changed
+
+    def _draw(self) -> float:
+        """Returns a uniform draw from [0, 1), drawn from the generator in batches."""
+        if self._draws_position == len(self._draws):
+            self._draws = self.random.random(RANDOM_BATCH_SIZE)
+            self._draws_position = 0
+        draw = self._draws[self._draws_position]
+        self._draws_position += 1
+        return draw
+
+    def _index(self, length: int) -> int:
+        return int(self._draw() * length)
+
+    def _spare_triple_terms(self) -> np.ndarray:
+        if self._spare_position == len(self._spare_terms):
+            self._spare_terms = self.triple_generator.generate_terms(RANDOM_BATCH_SIZE)
+            self._spare_position = 0
+        terms = self._spare_terms[self._spare_position]
+        self._spare_position += 1
+        return terms
+
     def get_random_triple_id(self):
-        return self.random.integers(0, len(self.ground_truth))
+        return self._index(len(self.ground_truth))
 
 
 class TripleGenerator:
-    def __init__(self, random: np.random.Generator, *, total_entities: int = 10, total_predicates: int = 10):
+    def __init__(self, random: np.random.Generator, *, total_entities: int = 10, total_predicates: int = 10,
+                 entity_distribution: str = DISTRIBUTION_UNIFORM, predicate_distribution: str = DISTRIBUTION_UNIFORM, zipf_exponent: float = 1.1):
+        """Entities and predicates are drawn uniformly, or with `zipf` the one of rank k is drawn with weight 1 / k^zipf_exponent."""
         self.random = random
         self.total_entities = total_entities
         self.total_predicates = total_predicates
+        self._entity_cdf = self._cdf(total_entities - 1, entity_distribution, zipf_exponent)
+        self._predicate_cdf = self._cdf(total_predicates - 1, predicate_distribution, zipf_exponent)
 
-    def generate_triple(self) -> RDFTriple:
-        return RDFTriple(self.random_entity(), self.random_predicate(), self.random_entity())
+    @staticmethod
+    def _cdf(count: int, distribution: str, zipf_exponent: float) -> Optional[np.ndarray]:
+        if distribution == DISTRIBUTION_UNIFORM:
+            return None
+        if distribution != DISTRIBUTION_ZIPF:
+            raise ValueError(f"Unknown distribution {distribution}")
+        weights = 1 / np.arange(1, count + 1) ** zipf_exponent
+        cdf = np.cumsum(weights)
+        return cdf / cdf[-1]
+
+    def _sample(self, count: int, cdf: Optional[np.ndarray], size) -> np.ndarray:
+        if cdf is None:
+            return self.random.integers(0, count, size=size)
+        return np.minimum(np.searchsorted(cdf, self.random.random(size), side="right"), count - 1)
+
+    def generate_terms(self, count: int) -> np.ndarray:
+        """Returns indices of the object, predicate and subject of `count` random triples, one triple per row."""
+        terms = np.empty((count, 3), dtype=np.int64)
+        terms[:, [0, 2]] = self._sample(self.total_entities - 1, self._entity_cdf, (count, 2))
+        terms[:, 1] = self._sample(self.total_predicates - 1, self._predicate_cdf, count)
+        return terms
+
+    def keys(self, terms: np.ndarray) -> np.ndarray:
+        """Encodes rows of term indices as single integers, equal triples get equal keys."""
+        return (terms[:, 0] * self.total_predicates + terms[:, 1]) * self.total_entities + terms[:, 2]
 
-    def random_entity(self) -> str:
-        return "E" + str(self.random.integers(0, self.total_entities - 1))
+    def key(self, terms: np.ndarray) -> int:
+        return (int(terms[0]) * self.total_predicates + int(terms[1])) * self.total_entities + int(terms[2])
 
-    def random_predicate(self) -> str:
-        return "P" + str(self.random.integers(0, self.total_predicates - 1))
+    def terms_of(self, triple: RDFTriple) -> Optional[np.ndarray]:
+        """Returns the term indices of a triple created by `triple`, or None if it can't have been created by this generator."""
+        terms = []
+        for value, prefix, count in ((triple.object, "E", self.total_entities), (triple.predicate, "P", self.total_predicates),
+                                     (triple.subject, "E", self.total_entities)):
+            if not value.startswith(prefix) or not value[1:].isdigit() or int(value[1:]) >= count:
+                return None
+            terms.append(int(value[1:]))
+        return np.array(terms, dtype=np.int64)
+
+    @staticmethod
+    def triple(terms: np.ndarray) -> RDFTriple:
+        return RDFTriple(f"E{terms[0]}", f"P{terms[1]}", f"E{terms[2]}")
+
+    def generate_triple(self) -> RDFTriple:
+        return self.triple(self.generate_terms(1)[0])
@@ -0,0 +1,160 @@
+import math
+from bisect import bisect_left
+from typing import Callable, Optional, Union
+
+# upper bounds in seconds, handlers of a busy agent take from tens of microseconds to seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is of values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        total = 0
+        result = []
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricFamily:
+    def __init__(self, name: str, type_: str, help_: str):
+        self.name = name
+        self.type = type_
+        self.help = help_
+        self.samples: list[tuple[dict[str, str], Union[float, Histogram]]] = []
+
+    def add(self, labels: dict[str, str], value: Union[float, Histogram]) -> 'MetricFamily':
+        self.samples.append((labels, value))
+        return self
+
+
+def family_of(families: dict[str, MetricFamily], name: str, type_: str, help_: str) -> MetricFamily:
+    """Returns the family of that name, adding it if no collector did yet, so collectors can add samples to shared families."""
+    if name not in families:
+        families[name] = MetricFamily(name, type_, help_)
+    return families[name]
+
+
+class AgentMetrics:
+    """Counters of one agent, recording only increments plain dicts and ints, so it is cheap enough for every message.
+    Sizes that can be read at any time, like the number of revisions, are collected when metrics are requested instead."""
+
+    def __init__(self):
+        # by ontology, [messages, bytes]
+        self.sent: dict[str, list[int]] = {}
+        self.received: dict[str, list[int]] = {}
+        self.handler_latency: dict[str, Histogram] = {}
+        self.handler_errors: dict[str, int] = {}
+        self.merges = Histogram()
+        self.rebases = Histogram()
+        self.rebased_revisions = 0
+
+    @staticmethod
+    def _count(counters: dict[str, list[int]], ontology: str, body: Optional[str]):
+        counter = counters.get(ontology)
+        if counter is None:
+            counter = counters[ontology] = [0, 0]
+        counter[0] += 1
+        counter[1] += len(body) if body is not None else 0
+
+    def message_sent(self, ontology: str, body: Optional[str]):
+        self._count(self.sent, ontology, body)
+
+    def message_received(self, ontology: str, body: Optional[str]):
+        self._count(self.received, ontology, body)
+
+    def message_handled(self, ontology: str, seconds: float, failed: bool = False):
+        histogram = self.handler_latency.get(ontology)
+        if histogram is None:
+            histogram = self.handler_latency[ontology] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            self.handler_errors[ontology] = self.handler_errors.get(ontology, 0) + 1
+
+    def collect(self, agent: str, families: dict[str, MetricFamily]):
+        for ontology, (count, size) in self.sent.items():
+            family_of(families, "rdf_messages_sent_total", COUNTER, "Messages sent by the agent").add({"agent": agent, "ontology": ontology}, count)
+            family_of(families, "rdf_message_bytes_sent_total", COUNTER, "Bytes of message bodies sent by the agent").add({"agent": agent, "ontology": ontology}, size)
+        for ontology, (count, size) in self.received.items():
+            family_of(families, "rdf_messages_received_total", COUNTER, "Messages handled by the agent").add({"agent": agent, "ontology": ontology}, count)
+            family_of(families, "rdf_message_bytes_received_total", COUNTER, "Bytes of message bodies handled by the agent").add({"agent": agent, "ontology": ontology}, size)
+        for ontology, histogram in self.handler_latency.items():
+            family_of(families, "rdf_handler_seconds", HISTOGRAM, "Time the agent took to handle a message").add({"agent": agent, "ontology": ontology}, histogram)
+        for ontology, count in self.handler_errors.items():
+            family_of(families, "rdf_handler_errors_total", COUNTER, "Messages whose handler failed").add({"agent": agent, "ontology": ontology}, count)
+        family_of(families, "rdf_merge_seconds", HISTOGRAM, "Time the merge master took to merge a revision").add({"agent": agent}, self.merges)
+        family_of(families, "rdf_rebase_seconds", HISTOGRAM, "Time the agent took to rebase its revisions on a merge").add({"agent": agent}, self.rebases)
+        family_of(families, "rdf_rebased_revisions_total", COUNTER, "Local revisions moved by rebases").add({"agent": agent}, self.rebased_revisions)
+
+
+class MetricsRegistry:
+    """Collects metric families from registered collectors when they are requested and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._collectors: list[Callable[[dict[str, MetricFamily]], None]] = []
+
+    def register(self, collector: Callable[[dict[str, MetricFamily]], None]):
+        self._collectors.append(collector)
+
+    def unregister(self, collector: Callable[[dict[str, MetricFamily]], None]):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def collect(self) -> dict[str, MetricFamily]:
+        families: dict[str, MetricFamily] = {}
+        for collector in self._collectors:
+            collector(families)
+        return families
+
+    def render(self) -> str:
+        lines = []
+        for family in self.collect().values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for labels, value in family.samples:
+                if isinstance(value, Histogram):
+                    for bound, count in value.cumulative():
+                        lines.append(f"{family.name}_bucket{_labels({**labels, 'le': _number(bound)})} {count}")
+                    lines.append(f"{family.name}_sum{_labels(labels)} {_number(value.sum)}")
+                    lines.append(f"{family.name}_count{_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{family.name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for key, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: Union[float, bool, None]) -> str:
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,189 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import os.path
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from typing import Iterable, Optional
+
+from services.rdf_document import TRIPLES, RDFDocument, RDFRevision, RDFTriple
+
+PROFILER_SAMPLING = "sampling"
+PROFILER_DETERMINISTIC = "deterministic"
+SAMPLING_INTERVAL = 0.005
+# bounds of a requested sampling interval, a shorter one would keep the sampler thread busy all the time
+MIN_SAMPLING_INTERVAL = 0.001
+MAX_SAMPLING_INTERVAL = 1.0
+# a profiler nobody stops stops collecting after this many seconds, so a forgotten one does not slow the simulation down for good
+MAX_PROFILE_SECONDS = 600
+TRACEMALLOC_TOP = 20
+
+
+class ProfileResult:
+    def __init__(self, mode: str, duration: float, profile: Optional[cProfile.Profile] = None, samples: Optional[dict[tuple, int]] = None):
+        self.mode = mode
+        self.duration = duration
+        self._profile = profile
+        self._samples = samples
+
+    def collapsed(self) -> str:
+        """Returns the sampled stacks in the collapsed format of flamegraph tools, one `root;...;leaf count` line per stack."""
+        if self._samples is None:
+            raise ValueError("Collapsed stacks are only available from the sampling profiler")
+        lines = []
+        for stack, count in sorted(self._samples.items(), key=lambda item: item[1], reverse=True):
+            frames = (f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})" for code in stack)
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_dump(self) -> bytes:
+        """Returns the statistics in the format written by `pstats.Stats.dump_stats`, so they can be loaded by pstats or snakeviz."""
+        if self._profile is None:
+            raise ValueError("pstats dumps are only available from the deterministic profiler")
+        self._profile.create_stats()
+        return marshal.dumps(self._profile.stats)
+
+    def text(self, limit: int = 50) -> str:
+        if self._profile is None:
+            return self.collapsed()
+        stream = io.StringIO()
+        pstats.Stats(self._profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return stream.getvalue()
+
+
+class Profiler:
+    """Profiles the thread of the event loop it is started from, either by sampling its stack from another thread
+    or with cProfile, which traces every call. Nothing is installed while it is stopped."""
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.interval = SAMPLING_INTERVAL
+        self._profile: Optional[cProfile.Profile] = None
+        self._samples: dict[tuple, int] = {}
+        # counted by the sampler thread, so the status does not iterate the samples while they are added to
+        self.sample_count = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._expiry: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "elapsed": time.time() - self.started_at if self.started_at is not None else None,
+            "samples": self.sample_count if self.mode == PROFILER_SAMPLING else None
+        }
+
+    def start(self, mode: str = PROFILER_SAMPLING, interval: float = SAMPLING_INTERVAL, max_seconds: float = MAX_PROFILE_SECONDS):
+        if self.running:
+            raise ValueError(f"The {self.mode} profiler is already running")
+        if mode == PROFILER_SAMPLING:
+            self._samples = {}
+            self.sample_count = 0
+            self.interval = interval
+            self._stopping.clear()
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), time.time() + max_seconds), name="profiler", daemon=True)
+            self._sampler.start()
+        elif mode == PROFILER_DETERMINISTIC:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            self._expiry = asyncio.get_running_loop().call_later(max_seconds, self._profile.disable)
+        else:
+            raise ValueError(f"Unknown profiler mode {mode}")
+        self.mode = mode
+        self.started_at = time.time()
+
+    def stop(self) -> ProfileResult:
+        if not self.running:
+            raise ValueError("The profiler is not running")
+        duration = time.time() - self.started_at
+        if self.mode == PROFILER_SAMPLING:
+            self._stopping.set()
+            self._sampler.join()
+            self._sampler = None
+            result = ProfileResult(self.mode, duration, samples=self._samples)
+        else:
+            self._profile.disable()
+            self._expiry.cancel()
+            result = ProfileResult(self.mode, duration, profile=self._profile)
+            self._profile = None
+        self.mode = None
+        self.started_at = None
+        return result
+
+    def _sample(self, thread_id: int, deadline: float):
+        samples = self._samples
+        while not self._stopping.wait(self.interval) and time.time() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            key = tuple(stack)
+            samples[key] = samples.get(key, 0) + 1
+            self.sample_count += 1
+
+
+def _revision_size(revision: RDFRevision) -> tuple[int, int]:
+    """Returns shallow sizes of the revision with its hashes and of its delta containers, triples are not included."""
+    size = sys.getsizeof(revision) + sys.getsizeof(revision.hash) + sys.getsizeof(revision.parents)
+    size += sum(sys.getsizeof(parent) for parent in revision.parents)
+    return size, sys.getsizeof(revision._deltas_add) + sys.getsizeof(revision._deltas_remove)
+
+
+def document_memory(doc: RDFDocument) -> dict[str, int]:
+    revisions, packed, unpacked = 0, 0, 0
+    for revision in doc.revisions.values():
+        size, deltas = _revision_size(revision)
+        revisions += size
+        if type(revision._deltas_add) is array:
+            packed += deltas
+        else:
+            unpacked += deltas
+    return {
+        "revisions": len(doc.revisions),
+        "revision_bytes": revisions,
+        "packed_delta_bytes": packed,
+        "delta_dict_bytes": unpacked,
+        "state_bytes": sys.getsizeof(doc.cached_state),
+        "checkpoint_bytes": sum(sys.getsizeof(state) for state in doc._checkpoints.values()),
+        "index_bytes": sum(sys.getsizeof(part) for part in (doc.index.generations, doc.index.children, doc.index._parents))
+    }
+
+
+def memory_report(documents: Iterable[tuple[str, RDFDocument]], top: int = TRACEMALLOC_TOP) -> dict:
+    """Estimates memory of each agent's document and totals by object type from shallow object sizes.
+    Triples are interned in TRIPLES and shared by all agents, so they are only counted in the totals.
+    While tracemalloc is tracing, the lines which allocated the most memory are reported too."""
+    agents = {jid: document_memory(doc) for jid, doc in documents}
+    triples = len(TRIPLES)
+    types = {
+        "RDFRevision": sum(agent["revision_bytes"] for agent in agents.values()),
+        "packed deltas": sum(agent["packed_delta_bytes"] for agent in agents.values()),
+        "delta dicts": sum(agent["delta_dict_bytes"] for agent in agents.values()),
+        "states": sum(agent["state_bytes"] + agent["checkpoint_bytes"] for agent in agents.values()),
+        "revision indices": sum(agent["index_bytes"] for agent in agents.values()),
+        "RDFTriple": triples * RDFTriple.__basicsize__,
+        "terms": sum(sys.getsizeof(term) for term in TRIPLES.term_values)
+    }
+    report = {"agents": agents, "types": types, "triples": triples, "tracemalloc": None}
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {
+            "current": current,
+            "peak": peak,
+            "top": [{"location": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in snapshot.statistics("lineno")[:top]]
+        }
+    return report
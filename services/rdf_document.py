@@ -1,22 +1,62 @@
 import hashlib
+import heapq
 import json
 import time
-from collections import deque
-from typing import Optional
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+from types import MappingProxyType
+from typing import Callable, Container, Iterable, KeysView, Mapping, Optional, Union
+
+from services.revision_index import RevisionIndex
 
 
 class RDFDocument:
-    def __init__(self, author: str):
+    def __init__(self, author: str, *, checkpoint_revisions: int = 64, checkpoint_deltas: int = 4096, max_checkpoints: int = 32,
+                 pack_revisions: bool = True):
         self.author_uuid = author
         self.revisions = {}
         self.current_hash = None
         self.cached_state: dict[str, RDFTriple] = {}
+        # incremented whenever cached_state changes, so readers can skip unchanged documents
+        self.state_version = 0
+        # called with hashes of triples added to and removed from cached_state
+        self.observers: list[Callable[[Iterable[str], Iterable[str]], None]] = []
+        # durable copy of the revisions, told about every revision that changes
+        self.store: Optional['RevisionStore'] = None
+        self.index = RevisionIndex()
+        self.checkpoint_revisions = checkpoint_revisions
+        self.checkpoint_deltas = checkpoint_deltas
+        self.max_checkpoints = max_checkpoints
+        self._checkpoints: OrderedDict[str, dict[str, RDFTriple]] = OrderedDict()
+        self.pack_revisions = pack_revisions
 
     def new_revision(self):
         parent = [self.current_hash] if self.current_hash is not None else None
         revision = RDFRevision(parents=parent, author=self.author_uuid)
+        self._store_revision(revision)
+        self._move_current(revision.hash)
+
+    def _store_revision(self, revision: 'RDFRevision'):
         self.revisions[revision.hash] = revision
-        self.current_hash = revision.hash
+        self.index.add(revision.hash, revision.parents)
+        if self.store is not None:
+            self.store.revision_changed(revision.hash)
+
+    def _move_current(self, hash_: str):
+        # only the current revision is ever modified, the previous one can be packed
+        if self.pack_revisions and self.current_hash in self.revisions:
+            self.revisions[self.current_hash].pack()
+        self.current_hash = hash_
+
+    def _discard_revision(self, hash_: str) -> 'RDFRevision':
+        self.index.remove(hash_)
+        if self.store is not None:
+            self.store.revision_discarded(hash_)
+        return self.revisions.pop(hash_)
+
+    def has_revision(self, hash_: str) -> bool:
+        return hash_ in self.revisions
 
     @property
     def current_revision(self) -> 'RDFRevision':
@@ -27,20 +67,34 @@ class RDFDocument:
         return self.revisions[self.current_hash]
 
     @property
-    def revisions_hashes(self) -> list[str]:
-        return list(self.revisions.keys())
+    def revisions_hashes(self) -> KeysView[str]:
+        return self.revisions.keys()
 
     def add(self, triple: 'RDFTriple'):
         if self.current_revision.author_uuid != self.author_uuid:
             raise Exception("Can't add triple to an unowned revision")
         self.current_revision.add(triple)
+        if self.store is not None:
+            self.store.revision_changed(self.current_hash)
+        is_new = triple.hash not in self.cached_state
         self.cached_state[triple.hash] = triple
+        self.state_version += 1
+        if is_new:
+            self._notify((triple.hash,), ())
 
     def remove(self, triple: 'RDFTriple'):
         if self.current_revision.author_uuid != self.author_uuid:
             raise Exception("Can't remove triple from an unowned revision")
         self.current_revision.remove(triple)
+        if self.store is not None:
+            self.store.revision_changed(self.current_hash)
         del self.cached_state[triple.hash]
+        self.state_version += 1
+        self._notify((), (triple.hash,))
+
+    def _notify(self, added: Iterable[str], removed: Iterable[str]):
+        for observer in self.observers:
+            observer(added, removed)
 
     def parse_fragment(self, operation: str, triple: 'RDFTriple'):
         if operation == "+":
@@ -59,70 +113,296 @@ class RDFDocument:
         return True
 
     def common_ancestor(self, revision: 'RDFRevision') -> Optional['RDFRevision']:
-        visited_1 = {self.current_revision}
-        visited_2 = {revision}
-        to_visit_1 = deque([self.current_revision])
-        to_visit_2 = deque([revision])
-        while len(to_visit_1) > 0 or len(to_visit_2) > 0:
-            if len(to_visit_1) > 0:
-                current_1 = to_visit_1.popleft()
-                visited_1.add(current_1)
-                if current_1 in visited_2:
-                    return current_1
-                for parent in current_1.parents:
-                    if parent not in visited_1:
-                        if parent not in self.revisions:
-                            raise MissingRevision()
-                        to_visit_1.append(self.revisions[parent])
-            if len(to_visit_2) > 0:
-                current_2 = to_visit_2.popleft()
-                visited_2.add(current_2)
-                if current_2 in visited_1:
-                    return current_2
-                for parent in current_2.parents:
-                    if parent not in visited_2:
-                        if parent not in self.revisions:
-                            raise MissingRevision()
-                        to_visit_2.append(self.revisions[parent])
+        # handling one received revision looks its common ancestor up in can_rebase and again in rebase or merge
+        cached = self.index.cached_common_ancestor(self.current_hash, revision.hash)
+        if cached is not None and cached in self.revisions:
+            return self.revisions[cached]
+        ancestor = self._find_common_ancestor(revision)
+        if ancestor is not None:
+            self.index.cache_common_ancestor(self.current_hash, revision.hash, ancestor.hash)
+        return ancestor
+
+    def _find_common_ancestor(self, revision: 'RDFRevision') -> Optional['RDFRevision']:
+        # walks both histories at once, always expanding the highest generation first: children have higher generations
+        # than their parents, so a revision is only popped after every path to it was followed and the first one
+        # reached from both sides is the closest common ancestor, every revision is queued once
+        first, second, both = 1, 2, 3
+        if revision.hash in self.revisions:
+            generation = self.index.generation(revision.hash)
+        else:
+            generation = self.index.generation_of(revision.parents)
+        flags = {revision.hash: second}
+        to_visit = [(-generation, revision.hash)]
+        if self.current_hash == revision.hash:
+            flags[revision.hash] = both
+        else:
+            flags[self.current_hash] = first
+            heapq.heappush(to_visit, (-self.index.generation(self.current_hash), self.current_hash))
+        while len(to_visit) > 0:
+            _, hash_ = heapq.heappop(to_visit)
+            flag = flags[hash_]
+            current = revision if hash_ == revision.hash else self.revisions[hash_]
+            if flag == both:
+                return current
+            for parent in current.parents:
+                if parent not in self.revisions:
+                    raise MissingRevision()
+                previous = flags.get(parent)
+                if previous is None:
+                    flags[parent] = flag
+                    heapq.heappush(to_visit, (-self.index.generation(parent), parent))
+                else:
+                    flags[parent] = previous | flag
         return None
 
     def revisions_between(self, hash_: str, revision: 'RDFRevision') -> list['RDFRevision']:
-        to_visit = deque([[revision]])
+        # breadth-first walk keeping only the first child each revision was reached from, which yields the same path
+        # as expanding every path, revisions at or below the target generation can't lead to it and are skipped
+        min_generation = self.index.generations.get(hash_, -1)
+        successors: dict[str, Optional[RDFRevision]] = {revision.hash: None}
+        to_visit = deque([revision])
         while len(to_visit) > 0:
             current = to_visit.popleft()
-            current_rev = current[-1]
-            if current_rev.hash == hash_:
-                current.reverse()
-                return current[1:]
-            for parent in current_rev.parents:
+            if current.hash == hash_:
+                between = []
+                successor = successors[current.hash]
+                while successor is not None:
+                    between.append(successor)
+                    successor = successors[successor.hash]
+                return between
+            for parent in current.parents:
                 if parent not in self.revisions:
                     raise MissingRevision()
-                to_visit.append(current + [self.revisions[parent]])
+            for parent in current.parents:
+                if parent in successors:
+                    continue
+                if parent != hash_ and self.index.generation(parent) <= min_generation:
+                    continue
+                successors[parent] = current
+                to_visit.append(self.revisions[parent])
         raise Exception("There is no path between the revisions")
 
+    @property
+    def heads(self) -> set[str]:
+        return self.index.heads
+
+    def complete_heads(self) -> set[str]:
+        return self.index.complete_heads()
+
+    def recent_hashes(self, count: int) -> list[str]:
+        return list(islice(reversed(self.revisions.keys()), count))
+
+    def revisions_missing(self, hashes: Iterable[str], known_heads: Iterable[str], known: Optional[Container[str]] = None,
+                          limit: Optional[int] = None) -> list['RDFRevision']:
+        """Revisions needed to obtain `hashes` by someone who has `known_heads` and their history, oldest first.
+        Requested hashes are sent even if they are ancestors of `known_heads`, which only holds for complete heads.
+        Ancestors in `known` are skipped without assuming anything about their ancestors, `known` may be a Bloom filter
+        with false positives, so it is never applied to `hashes` themselves.
+        With a `limit` the oldest revisions are returned, so they can be applied before asking for the rest."""
+        wanted, has = 1, 2
+        flags: dict[str, int] = {}
+        to_visit = []
+        pending = 0
+
+        def mark(hash_: str, flag: int):
+            nonlocal pending
+            if hash_ in requested:
+                # the requester doesn't have it whatever its heads claim, so neither it nor its ancestors count as known
+                flag &= wanted
+            previous = flags.get(hash_, 0)
+            if previous | flag == previous:
+                return
+            flags[hash_] = previous | flag
+            if flags[hash_] == wanted:
+                pending += 1
+            elif previous == wanted:
+                pending -= 1
+            heapq.heappush(to_visit, (-self.index.generation(hash_), hash_))
+
+        requested = {hash_ for hash_ in hashes if hash_ in self.revisions}
+        for hash_ in known_heads:
+            if hash_ in self.revisions:
+                mark(hash_, has)
+        for hash_ in requested:
+            mark(hash_, wanted)
+
+        missing = []
+        visited = set()
+        while pending > 0 and len(to_visit) > 0:
+            _, hash_ = heapq.heappop(to_visit)
+            if hash_ in visited:
+                continue
+            visited.add(hash_)
+            flag = flags[hash_]
+            if flag == wanted:
+                pending -= 1
+                if known is None or hash_ in requested or hash_ not in known:
+                    missing.append(self.revisions[hash_])
+            for parent in self.revisions[hash_].parents:
+                if parent in self.revisions:
+                    mark(parent, flag)
+
+        missing.reverse()
+        return missing[:limit]
+
     @staticmethod
     def combine_revisions(revisions: list['RDFRevision']) -> 'RDFRevision':
         if len(revisions) == 1:
             return revisions[0]
-        return RDFDocument.combine_revisions([revisions[0].combine(revisions[1])] + revisions[2:])
+        combined = RDFRevision(parents=revisions[0].parents, author=revisions[0].author_uuid)
+        combined.deltas_add = dict(revisions[0].deltas_add)
+        combined.deltas_remove = dict(revisions[0].deltas_remove)
+        for revision in islice(revisions, 1, None):
+            combined.fold(revision)
+        return combined
 
     def regenerate_state(self):
         if len(self.revisions) == 0:
             return
         state = {}
-        visited = [self.current_revision]
-        i = 0
-        while i < len(visited):
-            current = visited[i]
-            i += 1
-            if current.closest_ancestor is not None and current.closest_ancestor in self.revisions:
-                visited.append(self.revisions[current.closest_ancestor])
+        visited = []
+        complete = True
+        current = self.current_revision
+        while current is not None:
+            checkpoint = self._checkpoints.get(current.hash)
+            if checkpoint is not None:
+                self._checkpoints.move_to_end(current.hash)
+                state = dict(checkpoint)
+                break
+            visited.append(current)
+            ancestor = current.closest_ancestor
+            current = self.revisions.get(ancestor) if ancestor is not None else None
+            if ancestor is not None and current is None:
+                complete = False  # states over a missing ancestor change once it arrives, so they can't be checkpointed
 
         visited.reverse()
-        for rev in visited:
-            state = {**state, **rev.deltas_add}
-            state = {k: v for k, v in state.items() if k not in rev.deltas_remove}
-        self.cached_state = state
+        since_revisions, since_deltas = 0, 0
+        for i, rev in enumerate(visited):
+            rev.apply_to(state)
+            since_revisions += 1
+            since_deltas += rev.delta_count
+            # the last revision is the current one, which may still be modified locally
+            if complete and i < len(visited) - 1 and (since_revisions >= self.checkpoint_revisions or since_deltas >= self.checkpoint_deltas):
+                self._save_checkpoint(rev.hash, state)
+                since_revisions, since_deltas = 0, 0
+        previous, self.cached_state = self.cached_state, state
+        self.state_version += 1
+        if len(self.observers) > 0:
+            self._notify(state.keys() - previous.keys(), previous.keys() - state.keys())
+
+    def _save_checkpoint(self, hash_: str, state: dict[str, 'RDFTriple']):
+        if self.max_checkpoints <= 0:
+            return
+        self._checkpoints[hash_] = dict(state)
+        self._checkpoints.move_to_end(hash_)
+        while len(self._checkpoints) > self.max_checkpoints:
+            self._checkpoints.popitem(last=False)
+
+    def _state_at(self, hash_: str) -> Optional[dict[str, 'RDFTriple']]:
+        """Returns the state of the revision without changing cached_state, or None if one of its ancestors is missing."""
+        visited = []
+        state = {}
+        current = self.revisions.get(hash_)
+        if current is None:
+            return None
+        while current is not None:
+            checkpoint = self._checkpoints.get(current.hash)
+            if checkpoint is not None:
+                state = dict(checkpoint)
+                break
+            visited.append(current)
+            ancestor = current.closest_ancestor
+            if ancestor is None:
+                break
+            current = self.revisions.get(ancestor)
+            if current is None:
+                return None
+        for rev in reversed(visited):
+            rev.apply_to(state)
+        return state
+
+    def stable_cut(self, live: Iterable[str]) -> Optional[tuple[str, list[str]]]:
+        """Finds the latest revision which every path from the live revisions to the roots goes through,
+        counting merge ancestors as edges too, so the states of the live revisions don't depend on anything below it.
+        Returns it with the revisions above it, or None if a live revision or one of their ancestors is missing."""
+        queued = set()
+        to_visit = []
+        for hash_ in live:
+            if hash_ not in self.revisions:
+                return None
+            if hash_ not in queued:
+                queued.add(hash_)
+                heapq.heappush(to_visit, (-self.index.generation(hash_), hash_))
+
+        # revisions are visited after all their descendants, so once a single one is queued every path leads through it
+        above = []
+        while len(to_visit) > 0:
+            _, hash_ = heapq.heappop(to_visit)
+            if len(queued) == 1:
+                return hash_, above
+            queued.remove(hash_)
+            above.append(hash_)
+            revision = self.revisions[hash_]
+            edges = revision.parents if revision.merge_ancestor is None else [*revision.parents, revision.merge_ancestor]
+            for parent in edges:
+                if parent not in self.revisions:
+                    return None
+                if parent not in queued:
+                    queued.add(parent)
+                    heapq.heappush(to_visit, (-self.index.generation(parent), parent))
+        return None
+
+    def compact(self, live: Iterable[str], min_revisions: int = 1) -> int:
+        """Squashes the history below the stable cut of the live revisions into a base revision holding its state.
+        Heads at least as new as the oldest live revision are live too, so received revisions nobody announced yet keep their
+        ancestors, while an older head, e.g. an abandoned branch, can't pin the cut and is dropped with the history below it.
+        The cut revision keeps its hash and deltas but gets the base as its only parent, the base hash is derived
+        from the cut hash, so agents compacting at the same cut create the same base.
+        Nothing is dropped unless at least `min_revisions` would be, returns the number of dropped revisions."""
+        live = list(live)
+        if any(hash_ not in self.revisions for hash_ in live):
+            return 0
+        oldest = min((self.index.generation(hash_) for hash_ in live), default=0)
+        cut = self.stable_cut([*live, *(hash_ for hash_ in self.heads if self.index.generation(hash_) >= oldest)])
+        if cut is None:
+            return 0
+        cut_hash, above = cut
+        cut_revision = self.revisions[cut_hash]
+        base_hash = hashlib.sha512(f"base:{cut_hash}".encode('utf-8')).hexdigest()
+        keep = set(above)
+        keep.add(cut_hash)
+        dropped = [hash_ for hash_ in self.revisions if hash_ not in keep]
+        if len(dropped) < min_revisions or set(dropped) <= {base_hash}:
+            return 0
+
+        base = None
+        if cut_revision.closest_ancestor is not None:
+            state = self._state_at(cut_revision.closest_ancestor)
+            if state is None:
+                return 0
+            base = RDFRevision(parents=None, author=cut_revision.author_uuid)
+            base.hash = base_hash
+            base.deltas_add = state
+
+        for hash_ in dropped:
+            self._discard_revision(hash_)
+            self._checkpoints.pop(hash_, None)
+        if base is not None:
+            if self.pack_revisions:
+                base.pack()
+            self._store_revision(base)
+            self.index.remove(cut_hash)
+            cut_revision.parents = [base.hash]
+            cut_revision.merge_ancestor = None
+            self.index.add(cut_hash, cut_revision.parents)
+            if self.store is not None:
+                self.store.revision_changed(cut_hash)
+        return len(dropped)
+
+    def _drop_checkpoints_after(self, revisions: list['RDFRevision']):
+        for hash_ in list(self._checkpoints):
+            if any(self.index.is_ancestor(rev.hash, hash_) for rev in revisions):
+                del self._checkpoints[hash_]
 
     def is_tip(self, revision: 'RDFRevision') -> bool:
         if len(self.revisions) == 0:
@@ -131,25 +411,30 @@ class RDFDocument:
             raise Exception("Revision already in the document")
         if self.current_hash in revision.parents or self.current_hash == revision.closest_ancestor:
             return True
-        to_visit = deque([self.current_revision])
-        while len(to_visit) > 0:
-            current = to_visit.popleft()
-            if revision.hash in current.parents or revision.closest_ancestor == current.hash:
+        for child in self.index.children.get(revision.hash, ()):
+            if self.index.is_ancestor(child, self.current_hash):
                 return False
-            for parent in current.parents:
-                if parent in self.revisions:
-                    to_visit.append(self.revisions[parent])
+        if revision.closest_ancestor is not None and self.index.is_ancestor(revision.closest_ancestor, self.current_hash):
+            return False
         return True
 
     def append_revision(self, revision: 'RDFRevision'):
         if self.is_tip(revision):
-            self.revisions[revision.hash] = revision
-            self.current_hash = revision.hash
-            self.cached_state = {**self.cached_state, **revision.deltas_add}
-            self.cached_state = {k: v for k, v in self.cached_state.items() if k not in revision.deltas_remove}
+            self._store_revision(revision)
+            self._move_current(revision.hash)
+            if len(self.observers) > 0:
+                added = [t.hash for t in revision.added_triples() if t.hash not in self.cached_state]
+                removed = [t.hash for t in revision.removed_triples() if t.hash in self.cached_state]
+                revision.apply_to(self.cached_state)
+                self._notify([hash_ for hash_ in added if hash_ in self.cached_state], removed)
+            else:
+                revision.apply_to(self.cached_state)
+            self.state_version += 1
             return
 
-        self.revisions[revision.hash] = revision
+        self._store_revision(revision)
+        if self.pack_revisions:
+            revision.pack()
         self.regenerate_state()
 
     def merge_revision(self, revision: 'RDFRevision') -> Optional['RDFRevision']:
@@ -161,9 +446,11 @@ class RDFDocument:
         revision1 = self.combine_revisions(self.revisions_between(ancestor.hash, self.current_revision))
         revision2 = self.combine_revisions(self.revisions_between(ancestor.hash, revision))
         merge_revision = RDFRevision(parents=[self.current_hash, revision.hash], author=self.author_uuid, merge_ancestor=ancestor.hash)
-        merge_revision.deltas_add = {k: ancestor.deltas_add[k] for k in set(ancestor.deltas_add) - set(revision1.deltas_remove) - set(revision2.deltas_remove)}
-        merge_revision.deltas_add = {**merge_revision.deltas_add, **revision1.deltas_add, **revision2.deltas_add}
-        merge_revision.deltas_remove = {**ancestor.deltas_remove, **revision1.deltas_remove, **revision2.deltas_remove}
+        removed_1, removed_2 = revision1.deltas_remove, revision2.deltas_remove
+        merge_revision.deltas_add = {k: v for k, v in ancestor.deltas_add.items() if k not in removed_1 and k not in removed_2}
+        merge_revision.deltas_add.update(revision1.deltas_add)
+        merge_revision.deltas_add.update(revision2.deltas_add)
+        merge_revision.deltas_remove = {**ancestor.deltas_remove, **removed_1, **removed_2}
         return merge_revision
 
     def rebase_revision(self, revision: 'RDFRevision') -> list['RDFRevision']:
@@ -171,12 +458,13 @@ class RDFDocument:
         if ancestor is None:
             raise Exception("Can't rebase revisions without a common ancestor")
         between = self.revisions_between(ancestor.hash, self.current_revision)
+        self._drop_checkpoints_after(between)
         r_next = revision
         rebased = []
         self.append_revision(revision)
         for r in between:
             r.parents = [r_next.hash]
-            self.revisions.pop(r.hash)
+            self._discard_revision(r.hash)
             self.append_revision(r)
             r_next = r
             rebased.append(r)
@@ -184,22 +472,67 @@ class RDFDocument:
 
 
 class RDFRevision:
+    __slots__ = ("parents", "author_uuid", "created_at", "hash", "_deltas_add", "_deltas_remove", "merge_ancestor")
+
     def __init__(self, *, parents: Optional[list[str]], author: str, merge_ancestor: Optional[str] = None):
         self.parents = parents if parents is not None else []
         self.author_uuid = author
         self.created_at = time.time()
         self.hash = hashlib.sha512((str(parents) + author).encode('utf-8')).hexdigest()
-        self.deltas_add: dict[str, RDFTriple] = {}
-        self.deltas_remove: dict[str, RDFTriple] = {}
+        self._deltas_add: Union[dict[str, RDFTriple], array] = {}
+        self._deltas_remove: Union[dict[str, RDFTriple], array] = {}
         self.merge_ancestor = merge_ancestor
 
+    @property
+    def deltas_add(self) -> Mapping[str, 'RDFTriple']:
+        if type(self._deltas_add) is array:
+            # decoded for reading only, changes go through add and remove, which unpack the revision
+            return MappingProxyType(TRIPLES.decode(self._deltas_add))
+        return self._deltas_add
+
+    @deltas_add.setter
+    def deltas_add(self, deltas: dict[str, 'RDFTriple']):
+        self._deltas_add = deltas
+
+    @property
+    def deltas_remove(self) -> Mapping[str, 'RDFTriple']:
+        if type(self._deltas_remove) is array:
+            # decoded for reading only, changes go through add and remove, which unpack the revision
+            return MappingProxyType(TRIPLES.decode(self._deltas_remove))
+        return self._deltas_remove
+
+    @deltas_remove.setter
+    def deltas_remove(self, deltas: dict[str, 'RDFTriple']):
+        self._deltas_remove = deltas
+
+    @property
+    def is_packed(self) -> bool:
+        return type(self._deltas_add) is array
+
+    @property
+    def delta_count(self) -> int:
+        return len(self._deltas_add) + len(self._deltas_remove)
+
+    def pack(self):
+        """Replaces the delta dicts with arrays of interned triple ids, reading the deltas decodes them again."""
+        if not self.is_packed:
+            self._deltas_add = TRIPLES.encode(self._deltas_add.values())
+            self._deltas_remove = TRIPLES.encode(self._deltas_remove.values())
+
+    def unpack(self):
+        if self.is_packed:
+            self._deltas_add = TRIPLES.decode(self._deltas_add)
+            self._deltas_remove = TRIPLES.decode(self._deltas_remove)
+
     def add(self, triple: 'RDFTriple'):
+        self.unpack()
         if triple.hash in self.deltas_remove:
             del self.deltas_remove[triple.hash]
         else:
             self.deltas_add[triple.hash] = triple
 
     def remove(self, triple: 'RDFTriple'):
+        self.unpack()
         if triple.hash in self.deltas_add:
             del self.deltas_add[triple.hash]
         else:
@@ -207,11 +540,39 @@ class RDFRevision:
 
     def combine(self, revision_next: 'RDFRevision') -> 'RDFRevision':
         new_revision = RDFRevision(parents=self.parents, author=self.author_uuid)
-        new_revision.deltas_add = {k: self.deltas_add[k] for k in set(self.deltas_add) - set(revision_next.deltas_remove)}
-        new_revision.deltas_add = {**new_revision.deltas_add, **revision_next.deltas_add}
-        new_revision.deltas_remove = {**self.deltas_remove, **revision_next.deltas_remove}
+        removed_next = revision_next.deltas_remove
+        new_revision.deltas_add = {k: v for k, v in self.deltas_add.items() if k not in removed_next}
+        new_revision.deltas_add.update(revision_next.deltas_add)
+        new_revision.deltas_remove = {**self.deltas_remove, **removed_next}
         return new_revision
 
+    def fold(self, revision_next: 'RDFRevision'):
+        """In-place version of `combine`, extends this revision's deltas with the ones of the next revision."""
+        self.unpack()
+        for triple in revision_next.removed_triples():
+            self._deltas_add.pop(triple.hash, None)
+        for triple in revision_next.added_triples():
+            self._deltas_add[triple.hash] = triple
+        for triple in revision_next.removed_triples():
+            self._deltas_remove[triple.hash] = triple
+
+    def apply_to(self, state: dict[str, 'RDFTriple']):
+        """Applies the deltas to the state in place, removals take precedence over additions."""
+        for triple in self.added_triples():
+            state[triple.hash] = triple
+        for triple in self.removed_triples():
+            state.pop(triple.hash, None)
+
+    def added_triples(self) -> Iterable['RDFTriple']:
+        if type(self._deltas_add) is array:
+            return map(TRIPLES.get, self._deltas_add)
+        return self._deltas_add.values()
+
+    def removed_triples(self) -> Iterable['RDFTriple']:
+        if type(self._deltas_remove) is array:
+            return map(TRIPLES.get, self._deltas_remove)
+        return self._deltas_remove.values()
+
     @property
     def is_merge(self) -> bool:
         return len(self.parents) > 1
@@ -242,7 +603,10 @@ class RDFRevision:
 
     @staticmethod
     def from_json(data: str) -> 'RDFRevision':
-        data = json.loads(data)
+        return RDFRevision.from_dict(json.loads(data))
+
+    @staticmethod
+    def from_dict(data: dict) -> 'RDFRevision':
         revision = RDFRevision(parents=data["parents"], author=data["author"])
         revision.created_at = data["created_at"]
         revision.hash = data["hash"]
@@ -253,11 +617,34 @@ class RDFRevision:
 
 
 class RDFTriple:
-    def __init__(self, object: str, predicate: str, subject: str):
-        self.object = object
-        self.predicate = predicate
-        self.subject = subject
-        self.hash = hashlib.sha256(str([object, predicate, subject]).encode('utf-8')).hexdigest()
+    """Triples are interned in `TRIPLES`, constructing an already known triple returns the existing instance."""
+    __slots__ = ("id", "hash", "_terms")
+
+    def __new__(cls, object: str, predicate: str, subject: str) -> 'RDFTriple':
+        return TRIPLES.intern(object, predicate, subject)
+
+    @classmethod
+    def _create(cls, id_: int, terms: tuple[int, int, int], hash_: str) -> 'RDFTriple':
+        triple = super().__new__(cls)
+        triple.id = id_
+        triple.hash = hash_
+        triple._terms = terms
+        return triple
+
+    @property
+    def object(self) -> str:
+        return TRIPLES.term_values[self._terms[0]]
+
+    @property
+    def predicate(self) -> str:
+        return TRIPLES.term_values[self._terms[1]]
+
+    @property
+    def subject(self) -> str:
+        return TRIPLES.term_values[self._terms[2]]
+
+    def __reduce__(self):
+        return RDFTriple, (self.object, self.predicate, self.subject)
 
     def __repr__(self):
         return f"({self.object}, {self.predicate}, {self.subject})"
@@ -273,9 +660,73 @@ class RDFTriple:
     @staticmethod
     def from_json(data: str) -> 'RDFTriple':
         data = json.loads(data)
-        rdf = RDFTriple(object=data["object"], predicate=data["predicate"], subject=data["subject"])
-        rdf.hash = data["hash"]
-        return rdf
+        return RDFTriple(object=data["object"], predicate=data["predicate"], subject=data["subject"])
+
+
+class TripleStore:
+    """Per-process table of interned triples, identified by compact integer ids.
+    Terms are stored once in a term dictionary and triples refer to them by id."""
+
+    def __init__(self):
+        self.terms: dict[str, int] = {}
+        self.term_values: list[str] = []
+        self._triples: list[Optional[RDFTriple]] = []
+        self._by_terms: dict[tuple[int, int, int], RDFTriple] = {}
+        self._by_hash: dict[str, RDFTriple] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_hash)
+
+    def term_id(self, term: str) -> int:
+        id_ = self.terms.get(term)
+        if id_ is None:
+            id_ = len(self.term_values)
+            self.terms[term] = id_
+            self.term_values.append(term)
+        return id_
+
+    def intern(self, object: str, predicate: str, subject: str) -> RDFTriple:
+        return self.intern_terms((self.term_id(object), self.term_id(predicate), self.term_id(subject)))
+
+    def intern_terms(self, terms: tuple[int, int, int]) -> RDFTriple:
+        triple = self._by_terms.get(terms)
+        if triple is None:
+            values = [self.term_values[term] for term in terms]
+            hash_ = hashlib.sha256(str(values).encode('utf-8')).hexdigest()
+            triple = RDFTriple._create(len(self._triples), terms, hash_)
+            self._triples.append(triple)
+            self._by_terms[terms] = triple
+            self._by_hash[hash_] = triple
+        return triple
+
+    def get(self, id_: int) -> RDFTriple:
+        return self._triples[id_]
+
+    def by_hash(self, hash_: str) -> Optional[RDFTriple]:
+        return self._by_hash.get(hash_)
+
+    def retain(self, ids: Iterable[int]):
+        """Drops interned triples whose ids are not given, e.g. when a restart discards every document.
+        Ids of dropped triples are not reused, so the caller must pass every id which may still be decoded."""
+        keep = set(ids)
+        for id_, triple in enumerate(self._triples):
+            if triple is not None and id_ not in keep:
+                self._triples[id_] = None
+                del self._by_terms[triple._terms]
+                del self._by_hash[triple.hash]
+
+    @staticmethod
+    def encode(triples: Iterable[RDFTriple]) -> array:
+        ids = array("q", (triple.id for triple in triples))
+        return ids if len(ids) > 0 else _NO_IDS
+
+    def decode(self, ids: Iterable[int]) -> dict[str, RDFTriple]:
+        triples = self._triples
+        return {triple.hash: triple for triple in (triples[id_] for id_ in ids)}
+
+
+TRIPLES = TripleStore()
+_NO_IDS = array("q")  # shared by all packed revisions without deltas, never modified in place
 
 
 class MissingRevision(Exception):
@@ -0,0 +1,209 @@
+import base64
+import json
+import binascii
+import struct
+import zlib
+from typing import Optional
+
+from services.rdf_document import RDFRevision, TRIPLES
+
+REVISION_FORMAT_JSON = "json"
+REVISION_FORMAT_BINARY = "rdf-revision-v1"
+SUPPORTED_REVISION_FORMATS = [REVISION_FORMAT_BINARY, REVISION_FORMAT_JSON]
+
+COMPRESSION_THRESHOLD = 512
+# upper bound of an inflated body, a compressed message may not expand past it
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+_MAGIC = b"RR"
+_VERSION = 1
+_FLAG_COMPRESSED = 1
+_FLAG_BATCH = 2
+
+_HASH_SIZE = 64
+_HEADER = struct.Struct("<2sBB")
+# hash, created_at, author length, parent count, has merge ancestor, term count, added count, removed count
+_REVISION = struct.Struct(f"<{_HASH_SIZE}sdHBBIII")
+_LENGTH = struct.Struct("<I")
+_DECODE_ERRORS = (binascii.Error, zlib.error, struct.error, IndexError, UnicodeDecodeError, ValueError)
+
+
+class RevisionDecodeError(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Can't decode revision: {reason}")
+
+
+def encode_revision(revision: RDFRevision, language: str = REVISION_FORMAT_BINARY, *,
+                    compress_threshold: Optional[int] = COMPRESSION_THRESHOLD) -> str:
+    if language == REVISION_FORMAT_JSON:
+        return revision.to_json()
+    if language != REVISION_FORMAT_BINARY:
+        raise ValueError(f"Unsupported revision format {language}")
+
+    return _wrap(_encode_payload(revision), 0, compress_threshold)
+
+
+def decode_revision(body: str, language: Optional[str] = REVISION_FORMAT_BINARY) -> RDFRevision:
+    if language != REVISION_FORMAT_BINARY:
+        return RDFRevision.from_json(body)
+
+    flags, payload = _unwrap(body)
+    if flags & _FLAG_BATCH:
+        raise RevisionDecodeError("expected a single revision, got a batch")
+    try:
+        parsed = _parse_payload(payload)
+    except _DECODE_ERRORS as e:
+        raise RevisionDecodeError(str(e))
+    return _build_revision(*parsed)
+
+
+def encode_revisions(revisions: list[RDFRevision], language: str = REVISION_FORMAT_BINARY, *,
+                     compress_threshold: Optional[int] = COMPRESSION_THRESHOLD) -> str:
+    if language == REVISION_FORMAT_JSON:
+        return "[" + ",".join(revision.to_json() for revision in revisions) + "]"
+    if language != REVISION_FORMAT_BINARY:
+        raise ValueError(f"Unsupported revision format {language}")
+
+    chunks = [_LENGTH.pack(len(revisions))]
+    for revision in revisions:
+        payload = _encode_payload(revision)
+        chunks.append(_LENGTH.pack(len(payload)))
+        chunks.append(payload)
+    return _wrap(b"".join(chunks), _FLAG_BATCH, compress_threshold)
+
+
+def decode_revisions(body: str, language: Optional[str] = REVISION_FORMAT_BINARY) -> list[RDFRevision]:
+    if language != REVISION_FORMAT_BINARY:
+        return [RDFRevision.from_dict(data) for data in json.loads(body)]
+
+    flags, payload = _unwrap(body)
+    if not flags & _FLAG_BATCH:
+        raise RevisionDecodeError("expected a batch, got a single revision")
+    try:
+        parsed = []
+        offset = _LENGTH.size
+        for _ in range(_LENGTH.unpack_from(payload)[0]):
+            size = _LENGTH.unpack_from(payload, offset)[0]
+            offset += _LENGTH.size
+            if offset + size > len(payload):
+                raise RevisionDecodeError("truncated batch")
+            parsed.append(_parse_payload(payload[offset:offset + size]))
+            offset += size
+        if offset != len(payload):
+            raise RevisionDecodeError("trailing data after batch")
+    except _DECODE_ERRORS as e:
+        raise RevisionDecodeError(str(e))
+    # nothing is interned until every revision of the batch parsed
+    return [_build_revision(*revision) for revision in parsed]
+
+
+def _wrap(payload: bytes, flags: int, compress_threshold: Optional[int]) -> str:
+    if compress_threshold is not None and len(payload) >= compress_threshold:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= _FLAG_COMPRESSED
+    return base64.b64encode(_HEADER.pack(_MAGIC, _VERSION, flags) + payload).decode("ascii")
+
+
+def _unwrap(body: str) -> tuple[int, bytes]:
+    try:
+        data = base64.b64decode(body, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise RevisionDecodeError(f"invalid base64: {e}")
+    if len(data) < _HEADER.size:
+        raise RevisionDecodeError("truncated header")
+    magic, version, flags = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise RevisionDecodeError(f"unknown format {magic!r} version {version}")
+    payload = data[_HEADER.size:]
+    if flags & _FLAG_COMPRESSED:
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(payload, MAX_DECOMPRESSED_SIZE)
+        except zlib.error as e:
+            raise RevisionDecodeError(f"invalid compressed data: {e}")
+        if decompressor.unconsumed_tail:
+            raise RevisionDecodeError(f"decompressed payload exceeds {MAX_DECOMPRESSED_SIZE} bytes")
+        if not decompressor.eof:
+            raise RevisionDecodeError("truncated compressed data")
+    return flags, payload
+
+
+def _encode_payload(revision: RDFRevision) -> bytes:
+    terms: dict[str, int] = {}
+    ids: list[int] = []
+    added, removed = 0, 0
+    for triple in revision.added_triples():
+        ids.extend((terms.setdefault(triple.object, len(terms)),
+                    terms.setdefault(triple.predicate, len(terms)),
+                    terms.setdefault(triple.subject, len(terms))))
+        added += 1
+    for triple in revision.removed_triples():
+        ids.extend((terms.setdefault(triple.object, len(terms)),
+                    terms.setdefault(triple.predicate, len(terms)),
+                    terms.setdefault(triple.subject, len(terms))))
+        removed += 1
+
+    author = revision.author_uuid.encode("utf-8")
+    encoded_terms = [term.encode("utf-8") for term in terms]
+    hashes = [revision.hash, *revision.parents]
+    if revision.merge_ancestor is not None:
+        hashes.append(revision.merge_ancestor)
+    hashes = [bytes.fromhex(hash_) for hash_ in hashes]
+    if any(len(hash_) != _HASH_SIZE for hash_ in hashes):
+        raise ValueError("Binary revision format requires SHA-512 revision hashes")
+
+    return b"".join([
+        _REVISION.pack(hashes[0], revision.created_at, len(author), len(revision.parents),
+                       revision.merge_ancestor is not None, len(terms), added, removed),
+        author,
+        *hashes[1:],
+        struct.pack(f"<{len(encoded_terms)}I", *map(len, encoded_terms)),
+        *encoded_terms,
+        struct.pack(f"<{len(ids)}I", *ids),
+    ])
+
+
+def _parse_payload(payload: bytes) -> tuple:
+    """Checks a whole revision payload without touching TRIPLES, so a corrupt one can't intern garbage terms."""
+    if len(payload) < _REVISION.size:
+        raise RevisionDecodeError("truncated payload")
+    hash_, created_at, author_size, parent_count, has_merge_ancestor, term_count, added, removed = _REVISION.unpack_from(payload)
+    offset = _REVISION.size
+    expected = offset + author_size + _HASH_SIZE * (parent_count + has_merge_ancestor) + 4 * term_count
+    if has_merge_ancestor > 1 or expected > len(payload):
+        raise RevisionDecodeError("truncated payload")
+    author = payload[offset:offset + author_size].decode("utf-8")
+    offset += author_size
+    hashes = []
+    for _ in range(parent_count + has_merge_ancestor):
+        hashes.append(payload[offset:offset + _HASH_SIZE].hex())
+        offset += _HASH_SIZE
+
+    lengths = struct.unpack_from(f"<{term_count}I", payload, offset)
+    offset += 4 * term_count
+    if offset + sum(lengths) + 12 * (added + removed) != len(payload):
+        raise RevisionDecodeError("payload size doesn't match its header")
+    terms = []
+    for length in lengths:
+        terms.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    ids = struct.unpack_from(f"<{3 * (added + removed)}I", payload, offset)
+    if ids and max(ids) >= term_count:
+        raise RevisionDecodeError("term id out of range")
+    return hash_, created_at, author, hashes[:parent_count], hashes[parent_count] if has_merge_ancestor else None, terms, ids, added
+
+
+def _build_revision(hash_: bytes, created_at: float, author: str, parents: list[str], merge_ancestor: Optional[str],
+                    terms: list[str], ids: tuple[int, ...], added: int) -> RDFRevision:
+    term_ids = [TRIPLES.term_id(term) for term in terms]
+    triples = [TRIPLES.intern_terms((term_ids[ids[i]], term_ids[ids[i + 1]], term_ids[ids[i + 2]])) for i in range(0, len(ids), 3)]
+
+    revision = RDFRevision(parents=parents, author=author, merge_ancestor=merge_ancestor)
+    revision.hash = hash_.hex()
+    revision.created_at = created_at
+    revision.deltas_add = {triple.hash: triple for triple in triples[:added]}
+    revision.deltas_remove = {triple.hash: triple for triple in triples[added:]}
+    return revision
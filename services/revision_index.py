@@ -0,0 +1,126 @@
+from typing import Iterable, Optional
+
+MAX_ANCESTOR_CACHE = 65536
+
+
+class RevisionIndex:
+    """Adjacency, generation numbers and ancestry cache of the revision DAG.
+    Parents that are not indexed yet are still tracked as edges, so generations are fixed up when they arrive."""
+
+    def __init__(self):
+        self.generations: dict[str, int] = {}
+        self.children: dict[str, set[str]] = {}
+        self.heads: set[str] = set()
+        self._parents: dict[str, list[str]] = {}
+        self._ancestor_cache: dict[tuple[str, str], bool] = {}
+        self._common_ancestor_cache: dict[tuple[str, str], str] = {}
+
+    def __contains__(self, hash_: str) -> bool:
+        return hash_ in self.generations
+
+    def __len__(self) -> int:
+        return len(self.generations)
+
+    def has_missing_parents(self) -> bool:
+        return any(parent not in self.generations for parent in self.children)
+
+    def complete_heads(self) -> set[str]:
+        """Heads which don't descend from a parent that is not indexed yet."""
+        to_visit = [child for parent, children in self.children.items() if parent not in self.generations for child in children]
+        incomplete = set(to_visit)
+        while len(to_visit) > 0:
+            for child in self.children.get(to_visit.pop(), ()):
+                if child not in incomplete:
+                    incomplete.add(child)
+                    to_visit.append(child)
+        return self.heads - incomplete
+
+    def parents(self, hash_: str) -> list[str]:
+        return self._parents[hash_]
+
+    def generation(self, hash_: str) -> int:
+        return self.generations[hash_]
+
+    def generation_of(self, parents: Iterable[str]) -> int:
+        return 1 + max((self.generations[p] for p in parents if p in self.generations), default=-1)
+
+    def add(self, hash_: str, parents: list[str]):
+        self._parents[hash_] = list(parents)
+        self.generations[hash_] = self.generation_of(parents)
+        for parent in parents:
+            self.children.setdefault(parent, set()).add(hash_)
+            self.heads.discard(parent)
+
+        if len(self.children.get(hash_, ())) > 0:
+            self.invalidate()
+            self._propagate_generation(hash_)
+        else:
+            self.heads.add(hash_)
+
+    def remove(self, hash_: str):
+        if hash_ not in self.generations:
+            return
+        for parent in self._parents.pop(hash_):
+            children = self.children.get(parent)
+            if children is not None:
+                children.discard(hash_)
+                if len(children) == 0:
+                    del self.children[parent]
+                    if parent in self.generations:
+                        self.heads.add(parent)
+        del self.generations[hash_]
+        self.heads.discard(hash_)
+        self.invalidate()
+
+    def is_ancestor(self, ancestor: str, descendant: str) -> bool:
+        """Checks if `ancestor` is reachable from `descendant` (or is the same revision) through indexed revisions."""
+        if ancestor == descendant:
+            return True
+        if ancestor not in self.generations or descendant not in self.generations:
+            return False
+        key = (ancestor, descendant)
+        cached = self._ancestor_cache.get(key)
+        if cached is not None:
+            return cached
+
+        min_generation = self.generations[ancestor]
+        result = False
+        visited = {descendant}
+        to_visit = [descendant]
+        while len(to_visit) > 0 and not result:
+            for parent in self._parents[to_visit.pop()]:
+                if parent == ancestor:
+                    result = True
+                    break
+                if parent not in visited and self.generations.get(parent, -1) > min_generation:
+                    visited.add(parent)
+                    to_visit.append(parent)
+
+        self._cache(self._ancestor_cache, key, result)
+        return result
+
+    def cached_common_ancestor(self, hash_1: str, hash_2: str) -> Optional[str]:
+        return self._common_ancestor_cache.get((hash_1, hash_2))
+
+    def cache_common_ancestor(self, hash_1: str, hash_2: str, ancestor: str):
+        self._cache(self._common_ancestor_cache, (hash_1, hash_2), ancestor)
+
+    def invalidate(self):
+        self._ancestor_cache.clear()
+        self._common_ancestor_cache.clear()
+
+    @staticmethod
+    def _cache(cache: dict, key: tuple[str, str], value):
+        if len(cache) >= MAX_ANCESTOR_CACHE:
+            cache.clear()
+        cache[key] = value
+
+    def _propagate_generation(self, hash_: str):
+        to_visit = [hash_]
+        while len(to_visit) > 0:
+            current = to_visit.pop()
+            generation = self.generations[current] + 1
+            for child in self.children.get(current, ()):
+                if child in self.generations and self.generations[child] < generation:
+                    self.generations[child] = generation
+                    to_visit.append(child)
@@ -0,0 +1,135 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os.path
+import sqlite3
+from typing import Optional
+
+from services.rdf_document import RDFDocument, RDFRevision
+from services.revision_codec import decode_revision, encode_revision
+
+SNAPSHOT_REVISIONS = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS document (id INTEGER PRIMARY KEY CHECK (id = 0), author TEXT NOT NULL, current_hash TEXT);
+CREATE TABLE IF NOT EXISTS revisions (hash TEXT PRIMARY KEY, seq INTEGER NOT NULL, body TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS revisions_seq ON revisions (seq);
+CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 0), hash TEXT NOT NULL, body TEXT NOT NULL);
+"""
+
+
+class RevisionStore:
+    """SQLite file holding the revisions of one agent's document and a snapshot of its state.
+
+    Changed revisions are only collected while the document changes, `flush` writes them in one transaction,
+    so the flush period bounds both the number of fsyncs and the changes lost in a crash."""
+
+    def __init__(self, path: str, *, synchronous: str = "NORMAL", snapshot_revisions: int = SNAPSHOT_REVISIONS):
+        self.path = path
+        self.snapshot_revisions = snapshot_revisions
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA synchronous={synchronous}")
+        self._connection.executescript(_SCHEMA)
+        self._seq = self._connection.execute("SELECT COALESCE(MAX(seq), 0) FROM revisions").fetchone()[0]
+        self._snapshot_hash: Optional[str] = None
+        self._since_snapshot = 0
+        self._dirty: set[str] = set()
+        self._discarded: set[str] = set()
+        # a single thread runs the writes in order, so a write outlives a cancelled flush without overlapping the next one
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revision-store")
+        self.doc: Optional[RDFDocument] = None
+
+    @staticmethod
+    def for_agent(directory: str, jid: str, **kwargs) -> 'RevisionStore':
+        os.makedirs(directory, exist_ok=True)
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in jid)
+        return RevisionStore(os.path.join(directory, f"{name}.sqlite"), **kwargs)
+
+    def author(self) -> Optional[str]:
+        row = self._connection.execute("SELECT author FROM document").fetchone()
+        return row[0] if row is not None else None
+
+    def open(self, doc: RDFDocument) -> int:
+        """Loads the stored revisions into the empty document and starts collecting its changes, returns the number of loaded revisions."""
+        row = self._connection.execute("SELECT current_hash FROM document").fetchone()
+        if row is None:
+            self._connection.execute("INSERT INTO document (id, author, current_hash) VALUES (0, ?, NULL)", (doc.author_uuid,))
+        count = 0
+        for hash_, body in self._connection.execute("SELECT hash, body FROM revisions ORDER BY seq"):
+            revision = decode_revision(body)
+            doc._store_revision(revision)
+            if doc.pack_revisions:
+                revision.pack()
+            count += 1
+
+        current_hash = row[0] if row is not None else None
+        if current_hash is not None and current_hash in doc.revisions:
+            doc.current_hash = current_hash
+            snapshot = self._connection.execute("SELECT hash, body FROM snapshot").fetchone()
+            if snapshot is not None and snapshot[0] in doc.revisions:
+                # the snapshot is a checkpoint, so only revisions after it are replayed
+                doc._save_checkpoint(snapshot[0], dict(decode_revision(snapshot[1]).deltas_add))
+                self._snapshot_hash = snapshot[0]
+            doc.regenerate_state()
+        self.doc = doc
+        doc.store = self
+        return count
+
+    def revision_changed(self, hash_: str):
+        self._dirty.add(hash_)
+        self._discarded.discard(hash_)
+
+    def revision_discarded(self, hash_: str):
+        self._dirty.discard(hash_)
+        self._discarded.add(hash_)
+
+    def _collect(self) -> tuple[list[tuple[str, int, str]], list[str], Optional[str], Optional[tuple[str, str]]]:
+        doc = self.doc
+        written = []
+        for hash_ in self._dirty:
+            revision = doc.revisions.get(hash_)
+            if revision is not None:
+                self._seq += 1
+                written.append((hash_, self._seq, encode_revision(revision)))
+        discarded = list(self._discarded)
+        self._since_snapshot += len(written)
+        self._dirty, self._discarded = set(), set()
+
+        snapshot = None
+        stale = self._snapshot_hash is not None and any(hash_ == self._snapshot_hash for hash_, _, _ in written)
+        # a state over missing ancestors changes once they arrive, so it can't be used as a checkpoint after loading
+        if doc.current_hash is not None and (self._since_snapshot >= self.snapshot_revisions or stale) and not doc.index.has_missing_parents():
+            state = RDFRevision(parents=None, author=doc.author_uuid)
+            state.deltas_add = dict(doc.cached_state)
+            snapshot = (doc.current_hash, encode_revision(state))
+            self._snapshot_hash = doc.current_hash
+            self._since_snapshot = 0
+        return written, discarded, doc.current_hash, snapshot
+
+    def _write(self, written: list[tuple[str, int, str]], discarded: list[str], current_hash: Optional[str], snapshot: Optional[tuple[str, str]]):
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO revisions (hash, seq, body) VALUES (?, ?, ?)", written)
+            self._connection.executemany("DELETE FROM revisions WHERE hash = ?", [(hash_,) for hash_ in discarded])
+            self._connection.execute("UPDATE document SET current_hash = ?", (current_hash,))
+            if snapshot is not None:
+                self._connection.execute("INSERT OR REPLACE INTO snapshot (id, hash, body) VALUES (0, ?, ?)", snapshot)
+
+    @property
+    def pending(self) -> bool:
+        return len(self._dirty) > 0 or len(self._discarded) > 0
+
+    async def flush(self):
+        """Writes the changes since the previous flush from a worker thread, revisions are encoded in the calling loop."""
+        if self.doc is None or not self.pending:
+            return
+        batch = self._collect()
+        await asyncio.shield(asyncio.get_running_loop().run_in_executor(self._executor, self._write, *batch))
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            # queued behind any write still running, even when the flush was cancelled
+            await asyncio.shield(asyncio.get_running_loop().run_in_executor(self._executor, self._connection.close))
+            self._executor.shutdown(wait=False)
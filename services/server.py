@@ -10,13 +10,13 @@ class Server:
 
     def register_agent(self, address: str):
         with self._lock:
-            self.logger.debug(f"Registering agent {address}")
+            self.logger.debug("Registering agent %s", address)
             self._registered_agents.add(address)
 
     def deregister_agent(self, address: str):
         with self._lock:
             if address in self._registered_agents:
-                self.logger.debug(f"Deregistering agent {address}")
+                self.logger.debug("Deregistering agent %s", address)
                 self._registered_agents.remove(address)
 
     @property
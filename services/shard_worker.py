@@ -0,0 +1,228 @@
+import asyncio
+import time
+from threading import Lock
+from typing import Iterable
+
+from spade.container import Container
+
+from agents.rdf_agent import RDFAgent
+from logger.logger import get_logger, setup_logging
+from services.change_log import CHANGE_LOG_CAPACITY, Change, ChangeLog
+from services.rdf_document import RDFDocument, RDFTriple, TRIPLES
+from services.sharding import ShardCoordinator, StateChanges, connect
+from services.simulation import Simulation
+
+PUBLISH_PERIOD = 0.5
+
+
+class RemoteServer:
+    """Server registry of the main process, as seen by a worker.
+    Agents use a local copy from the event loop, `sync` exchanges changes with the coordinator from the worker's main thread."""
+
+    def __init__(self, coordinator: ShardCoordinator):
+        self._coordinator = coordinator
+        self._registered_agents: set[str] = set()
+        self._changes: list[tuple[bool, str]] = []
+        self._lock = Lock()
+
+    def register_agent(self, address: str):
+        with self._lock:
+            self._registered_agents.add(address)
+            self._changes.append((True, address))
+
+    def deregister_agent(self, address: str):
+        with self._lock:
+            self._registered_agents.discard(address)
+            self._changes.append((False, address))
+
+    @property
+    def registered_agents(self) -> set[str]:
+        with self._lock:
+            return self._registered_agents.copy()
+
+    def sync(self):
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for registered, address in changes:
+            if registered:
+                self._coordinator.register_agent(address)
+            else:
+                self._coordinator.deregister_agent(address)
+        registered_agents = self._coordinator.registered_agents()
+        with self._lock:
+            # changes made while fetching the registry are sent with the next sync
+            for registered, address in self._changes:
+                if registered:
+                    registered_agents.add(address)
+                else:
+                    registered_agents.discard(address)
+            self._registered_agents = registered_agents
+
+    def restart(self):
+        pass  # the coordinator restarts the shared server
+
+
+class RemoteGraphGenerator:
+    """Graph generator of the main process, as seen by a worker.
+    The coordinator keeps a copy of each agent's state, so a tick only sends the triples which changed since the previous one."""
+
+    def __init__(self, coordinator: ShardCoordinator):
+        self._coordinator = coordinator
+        self.observers = []  # the coordinator tracks convergence against the shared generator
+        self._states: dict[str, StateChanges] = {}
+
+    async def uncover(self, doc: RDFDocument, agent: str) -> list[tuple[str, RDFTriple]]:
+        """Uncovers the fragments of one tick of the agent, waiting for the coordinator in an executor."""
+        changes = self._states.get(agent)
+        if changes is None or changes.doc is not doc:
+            changes = self._states[agent] = StateChanges(doc)
+        loop = asyncio.get_running_loop()
+        fragments = await loop.run_in_executor(None, self._coordinator.uncover_graph_fragments, agent, *changes.take())
+        if fragments is None:
+            # the coordinator restarted and lost its copy of the state
+            changes.sent = False
+            fragments = await loop.run_in_executor(None, self._coordinator.uncover_graph_fragments, agent, *changes.take())
+
+        # the state may have changed while waiting, removals of triples which are no longer known are skipped
+        state = doc.cached_state
+        uncovered = []
+        added, removed = set(), set()
+        for operation, terms in fragments:
+            triple = RDFTriple(*terms)
+            known = triple.hash in added or (triple.hash in state and triple.hash not in removed)
+            if operation == "-" and not known:
+                continue
+            if operation == "+":
+                added.add(triple.hash)
+                removed.discard(triple.hash)
+            else:
+                removed.add(triple.hash)
+                added.discard(triple.hash)
+            uncovered.append((operation, triple))
+        return uncovered
+
+    def forget(self, agent: str):
+        self._states.pop(agent, None)
+
+    def adopt(self, triples: Iterable[RDFTriple]):
+        self._coordinator.adopt([(triple.object, triple.predicate, triple.subject) for triple in triples])
+
+    def restart(self):
+        pass  # the coordinator restarts the shared generator
+
+
+def _portable(change: Change) -> tuple:
+    def terms(id_: int) -> tuple[str, str, str]:
+        triple = TRIPLES.get(id_)
+        return triple.object, triple.predicate, triple.subject
+
+    if change.kind == "uncovered":
+        return "uncovered", change.agent, change.operation, terms(change.triple_id)
+    if change.added is None:
+        return "message", change.label, change.sender, change.to, None, None
+    return "message", change.label, change.sender, change.to, [terms(id_) for id_ in change.added], [terms(id_) for id_ in change.removed]
+
+
+class WorkerSimulation(Simulation):
+    """Runs a shard of the agents in a worker process and publishes their state to the coordinator."""
+
+    def __init__(self, shard: int, coordinator: ShardCoordinator):
+        super().__init__(server=RemoteServer(coordinator), graph_generator=RemoteGraphGenerator(coordinator))
+        self._logger = get_logger(f"Simulation-shard-{shard}")
+        self.convergence = None  # tracked by the coordinator from the published states
+        self.shard = shard
+        self._coordinator = coordinator
+        self._cursor = ChangeLog.subscribe(CHANGE_LOG_CAPACITY)
+        self._published: dict[str, tuple[bool, bool, int]] = {}
+        # changes of the agents' states since they were last published, separate from the ones sent to uncover fragments
+        self._state_changes: dict[str, StateChanges] = {}
+        self._resend: set[str] = set()
+
+    def log_leaderboard(self):
+        self._coordinator.log_leaderboard()
+
+    async def uncover_graph_fragments(self, agent: RDFAgent) -> list[tuple[str, RDFTriple]]:
+        return await self.graph_generator.uncover(agent.doc, str(agent.jid))
+
+    async def _snapshot(self) -> tuple[list[tuple], list[tuple]]:
+        # runs in the agents' event loop, so documents are not modified while they are read
+        snapshots = []
+        for agent in self._all_agents:
+            jid = str(agent.jid)
+            changes = self._state_changes.get(jid)
+            if changes is None or changes.doc is not agent.doc:
+                changes = self._state_changes[jid] = StateChanges(agent.doc)
+            if jid in self._resend:
+                changes.sent = False
+                self._published.pop(jid, None)
+            state = (agent.is_alive(), agent.is_merge_master, agent.doc.state_version)
+            published = self._published.get(jid)
+            if published == state and changes.sent:
+                continue
+            deltas = changes.take() if not changes.sent or published[2] != state[2] else (None, None, False)
+            snapshots.append((jid, *state, *deltas))
+            self._published[jid] = state
+        self._resend = set()
+        changes, dropped, _, _ = self._cursor.read()
+        if dropped > 0:
+            self._logger.warning("Dropped %s changes before publishing them", dropped)
+        return snapshots, [_portable(change) for change in changes]
+
+    def publish(self):
+        snapshots, changes = asyncio.run_coroutine_threadsafe(self._snapshot(), Container().loop).result()
+        if len(snapshots) > 0 or len(changes) > 0:
+            # the coordinator lost the states it can't apply changes to, they are sent whole with the next snapshot
+            self._resend.update(self._coordinator.publish(self.shard, snapshots, changes))
+
+    def _stop_agents(self, jids: set[str] = None):
+        stopped = [agent for agent in self._all_agents if jids is None or str(agent.jid) in jids]
+        self._run_in_loop(self.stop_agents(stopped))
+        # the coordinator learns they stopped before the worker forgets them
+        self.publish()
+        self._all_agents = [agent for agent in self._all_agents if agent not in stopped]
+        for agent in stopped:
+            jid = str(agent.jid)
+            self._published.pop(jid, None)
+            self._state_changes.pop(jid, None)
+            self.graph_generator.forget(jid)
+
+    def _run_command(self, command: tuple) -> bool:
+        """Runs a command of the main process, returns whether the worker should keep running."""
+        if command[0] == "add":
+            self._run_in_loop(self.start_agents([self.add_rdf_agent(command[1], command[2])]))
+        elif command[0] == "stop":
+            self._stop_agents({command[1]})
+        elif command[0] == "stop_all":
+            self._stop_agents()
+            TRIPLES.retain(ChangeLog.triple_ids())
+        elif command[0] == "shutdown":
+            self._stop_agents()
+            return False
+        return True
+
+    def start(self):
+        self._logger.info("Starting shard %s with %s agents", self.shard, len(self._all_agents))
+        self._run_in_loop(self.start_agents(self._all_agents))
+
+        running = True
+        while running:
+            try:
+                for command in self._coordinator.poll_commands(self.shard):
+                    running = running and self._run_command(command)
+                self.server.sync()
+                self.publish()
+                time.sleep(PUBLISH_PERIOD)
+            except KeyboardInterrupt:
+                self._stop_agents()
+                break
+        self.server.sync()
+        self._logger.info("Shard %s stopped", self.shard)
+
+
+def run_worker(shard: int, address: tuple[str, int], authkey: bytes, log_directory: str):
+    setup_logging(log_directory, f"shard-{shard}")
+    coordinator = connect(address, authkey)
+    simulation = WorkerSimulation(shard, coordinator)
+    for jid, password in coordinator.assigned(shard):
+        simulation.add_rdf_agent(jid, password)
+    simulation.start()
@@ -0,0 +1,231 @@
+import os
+from collections import defaultdict
+from multiprocessing.managers import BaseManager
+from threading import RLock, Thread
+from typing import Callable, Iterable, Optional
+
+from logger.logger import get_logger
+from services.change_log import ChangeLog
+from services.convergence import ConvergenceTracker
+from services.graph_generator import GraphGenerator
+from services.rdf_document import RDFDocument, RDFTriple, TripleStore, TRIPLES
+from services.server import Server
+
+# triples cross process boundaries as their terms, as triple ids are only valid in the process that interned them
+Terms = tuple[str, str, str]
+
+
+class CoordinationServer(BaseManager):
+    pass
+
+
+class CoordinationClient(BaseManager):
+    pass
+
+
+CoordinationClient.register("coordinator")
+
+
+class DocumentSnapshot:
+    def __init__(self):
+        self.state_version = -1
+        self.cached_state: dict[str, None] = {}
+
+
+class AgentSnapshot:
+    """Last state of an agent running in a worker process, as published by that worker."""
+
+    def __init__(self, jid: str, shard: int, coordinator: 'ShardCoordinator'):
+        self.jid = jid
+        self.shard = shard
+        self.is_merge_master = False
+        self.alive = True
+        self.doc = DocumentSnapshot()
+        self._coordinator = coordinator
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+    async def stop(self):
+        self._coordinator.send_command(self.shard, ("stop", self.jid))
+
+
+class StateChanges:
+    """Hashes of triples which changed in an agent's state since it was last sent to the coordinator."""
+
+    def __init__(self, doc: RDFDocument):
+        self.doc = doc
+        self.changed: set[str] = set()
+        self.sent = False
+        doc.observers.append(self.state_changed)
+
+    def state_changed(self, added: Iterable[str], removed: Iterable[str]):
+        self.changed.update(added)
+        self.changed.update(removed)
+
+    def take(self) -> tuple[list[str], list[str], bool]:
+        """Returns hashes of triples added to and removed from the state since it was last sent, or the whole state the first time."""
+        state = self.doc.cached_state
+        reset = not self.sent
+        if reset:
+            added, removed = list(state), []
+        else:
+            added = [hash_ for hash_ in self.changed if hash_ in state]
+            removed = [hash_ for hash_ in self.changed if hash_ not in state]
+        self.changed = set()
+        self.sent = True
+        return added, removed, reset
+
+
+class ShardCoordinator:
+    """Shared simulation state for worker processes, served from the main process over a local manager connection.
+    Every method may be called concurrently from the manager's connection threads."""
+
+    def __init__(self, server: Server, graph_generator: GraphGenerator, convergence: ConvergenceTracker, leaderboard: Callable[[], None]):
+        self.logger = get_logger("Coordinator")
+        self.server = server
+        self.graph_generator = graph_generator
+        self.convergence = convergence
+        self._leaderboard = leaderboard
+        self._lock = RLock()
+        self._agents: dict[str, AgentSnapshot] = {}
+        self._assigned: defaultdict[int, list[tuple[str, str]]] = defaultdict(list)
+        self._commands: defaultdict[int, list[tuple]] = defaultdict(list)
+        # copies of the agents' states the graph generator uncovers fragments from, by agent
+        self._states: dict[str, dict[str, RDFTriple]] = {}
+
+    def register_agent(self, address: str):
+        self.server.register_agent(address)
+
+    def deregister_agent(self, address: str):
+        self.server.deregister_agent(address)
+
+    def registered_agents(self) -> set[str]:
+        return self.server.registered_agents
+
+    def uncover_graph_fragments(self, agent: str, added: list[str], removed: list[str], reset: bool) -> Optional[list[tuple[str, Terms]]]:
+        """Applies the changes of the agent's state since its previous tick to the copy kept for it and uncovers fragments.
+        Returns None if there is no copy to apply them to, so the worker sends the whole state."""
+        with self._lock:
+            known_triples = self._states.get(agent)
+            if reset or known_triples is None:
+                if not reset:
+                    return None
+                known_triples = self._states[agent] = {}
+            for hash_ in removed:
+                known_triples.pop(hash_, None)
+            # every triple originates from the graph generator or was adopted by it, so all of them are interned in this process
+            for hash_ in added:
+                known_triples[hash_] = TRIPLES.by_hash(hash_)
+            fragments = self.graph_generator.uncover_graph_fragments(known_triples, agent)
+        return [(operation, (triple.object, triple.predicate, triple.subject)) for operation, triple in fragments]
+
+    def adopt(self, triples: list[Terms]):
+        with self._lock:
+            self.graph_generator.adopt([RDFTriple(*terms) for terms in triples])
+
+    def log_leaderboard(self):
+        with self._lock:
+            self._leaderboard()
+
+    def assign(self, jid: str, password: str, shards: int) -> int:
+        """Assigns a new agent to the shard with the fewest agents."""
+        with self._lock:
+            shard = min(range(shards), key=lambda i: len(self._assigned[i]))
+            self._assigned[shard].append((jid, password))
+            self._agents[jid] = AgentSnapshot(jid, shard, self)
+            return shard
+
+    def assigned(self, shard: int) -> list[tuple[str, str]]:
+        with self._lock:
+            return list(self._assigned[shard])
+
+    def send_command(self, shard: int, command: tuple):
+        with self._lock:
+            self._commands[shard].append(command)
+
+    def poll_commands(self, shard: int) -> list[tuple]:
+        with self._lock:
+            commands = self._commands.pop(shard, [])
+        return commands
+
+    def publish(self, shard: int, snapshots: list[tuple[str, bool, bool, int, Optional[list[str]], Optional[list[str]], bool]],
+                changes: list[tuple]) -> list[str]:
+        """Receives states of the shard's agents that changed and the changes logged by them.
+        A state is sent as the hashes added and removed since it was last published, or whole when `reset` is set.
+        Returns agents whose previous state is not known here, so the worker sends their whole state again."""
+        resend = []
+        with self._lock:
+            for jid, alive, is_merge_master, state_version, added, removed, reset in snapshots:
+                agent = self._agents.get(jid)
+                if agent is None:
+                    agent = self._agents[jid] = AgentSnapshot(jid, shard, self)
+                agent.alive = alive
+                agent.is_merge_master = is_merge_master
+                if not alive:
+                    self.convergence.untrack(jid)
+                    self._states.pop(jid, None)
+                    agent.doc = DocumentSnapshot()
+                    continue
+                if added is None:
+                    continue
+                if reset:
+                    agent.doc.cached_state = dict.fromkeys(added)
+                    self.convergence.replace_state(jid, added)
+                elif agent.doc.state_version < 0:
+                    resend.append(jid)
+                    continue
+                else:
+                    for hash_ in removed:
+                        agent.doc.cached_state.pop(hash_, None)
+                    agent.doc.cached_state.update(dict.fromkeys(added))
+                    self.convergence.state_changed(jid, added, removed)
+                agent.doc.state_version = state_version
+
+            for change in changes:
+                if change[0] == "uncovered":
+                    _, agent, operation, terms = change
+                    ChangeLog.log_uncovered(agent, operation, RDFTriple(*terms).id)
+                else:
+                    _, label, sender, to, added, removed = change
+                    deltas = None
+                    if added is not None:
+                        deltas = (TripleStore.encode(RDFTriple(*t) for t in added), TripleStore.encode(RDFTriple(*t) for t in removed))
+                    ChangeLog.log_message(label, sender, to, deltas)
+        return resend
+
+    def agent(self, jid: str) -> AgentSnapshot:
+        with self._lock:
+            return self._agents[jid]
+
+    def active_agents(self) -> list[AgentSnapshot]:
+        with self._lock:
+            return [agent for agent in self._agents.values() if agent.alive]
+
+    def restart(self):
+        with self._lock:
+            self._agents = {}
+            self._assigned = defaultdict(list)
+            self._states = {}
+            self.convergence.reset()
+            self.server.restart()
+            self.graph_generator.restart()
+            # triples only the stopped agents knew are not needed anymore
+            self.graph_generator.forget_outdated()
+            TRIPLES.retain({triple.id for triple in self.graph_generator.triples()} | ChangeLog.triple_ids())
+
+
+def serve(coordinator: ShardCoordinator) -> tuple[tuple[str, int], bytes]:
+    """Serves the coordinator to worker processes from a background thread, returns its address and authentication key."""
+    authkey = os.urandom(16)
+    CoordinationServer.register("coordinator", callable=lambda: coordinator)
+    manager = CoordinationServer(address=("127.0.0.1", 0), authkey=authkey)
+    server = manager.get_server()
+    Thread(target=server.serve_forever, name="coordinator", daemon=True).start()
+    return server.address, authkey
+
+
+def connect(address: tuple[str, int], authkey: bytes) -> ShardCoordinator:
+    manager = CoordinationClient(address=address, authkey=authkey)
+    manager.connect()
+    return manager.coordinator()
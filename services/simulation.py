@@ -1,85 +1,260 @@
+import asyncio
+import multiprocessing
 import time
+from typing import Coroutine, Optional, Union
+
+from spade.container import Container
 
 from agents.rdf_agent import RDFAgent
-from config import AGENT_ADDRESS, AGENT_PASSWORD, PREFIX
-from logger.logger import get_logger
+from config import AGENT_ADDRESS, AGENT_PASSWORD, PREFIX, STARTUP_CONCURRENCY
+from logger.logger import get_logger, log_directory
+from services.change_log import ChangeLog
+from services.convergence import ConvergenceTracker
 from services.graph_generator import GraphGenerator
+from services.metrics import COUNTER, GAUGE, METRICS, MetricFamily, family_of
+from services.rdf_document import RDFTriple, TRIPLES
 from services.server import Server
+from services.sharding import AgentSnapshot, ShardCoordinator, serve
+from services.transport import create_transport
+
+SHARD_SHUTDOWN_TIMEOUT = 30
+STARTUP_RETRIES = 3
+STARTUP_BACKOFF = 1
+
+
+class StartupProgress:
+    def __init__(self, total: int):
+        self.total = total
+        self.started = 0
+        self.failed = 0
+        self.retries = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "started": self.started,
+            "failed": self.failed,
+            "retries": self.retries,
+            "elapsed": (self.finished_at or time.time()) - self.started_at,
+            "finished": self.finished_at is not None
+        }
 
 
 class Simulation:
-    def __init__(self, *, server: Server, graph_generator: GraphGenerator):
+    def __init__(self, *, server: Server, graph_generator: GraphGenerator, workers: int = 0):
+        """With `workers` above zero, agents run in that many worker processes and this process only coordinates them."""
         self._logger = get_logger("Simulation")
         self._all_agents: list[RDFAgent] = []
         self.server = server
         self.graph_generator = graph_generator
         self._last_agent_id = 0
         self.is_restarting = False
+        self.workers = workers
+        self.convergence: Optional[ConvergenceTracker] = ConvergenceTracker()
+        graph_generator.observers.append(self.convergence.truth_changed)
+        self.coordinator: Optional[ShardCoordinator] = ShardCoordinator(server, graph_generator, self.convergence, self.log_leaderboard) if workers > 0 else None
+        self._processes: list[multiprocessing.Process] = []
+        self.startup_progress = StartupProgress(0)
+        self.transport = create_transport()
+        if workers > 0 and not self.transport.uses_xmpp:
+            raise ValueError("Agents of different worker processes can only exchange messages over XMPP")
+        METRICS.register(self.collect_metrics)
 
-    def populate(self, count: int) -> list[RDFAgent]:
+    def populate(self, count: int) -> list[Union[RDFAgent, AgentSnapshot]]:
         agents = []
         for _ in range(count):
             self._last_agent_id += 1
-            agents.append(self.add_rdf_agent(f"{AGENT_ADDRESS}/{PREFIX}{self._last_agent_id}", AGENT_PASSWORD))
+            address = f"{AGENT_ADDRESS}/{PREFIX}{self._last_agent_id}"
+            if self.coordinator is not None:
+                agents.append(self.assign_rdf_agent(address, AGENT_PASSWORD))
+            else:
+                agents.append(self.add_rdf_agent(address, AGENT_PASSWORD))
         return agents
 
+    def assign_rdf_agent(self, address: str, password: str) -> AgentSnapshot:
+        self._logger.debug("Assigning RDF agent to a shard: %s", address)
+        shard = self.coordinator.assign(address, password, self.workers)
+        if len(self._processes) > 0:
+            self.coordinator.send_command(shard, ("add", address, password))
+        return self.coordinator.agent(address)
+
     def add_rdf_agent(self, address: str, password: str) -> RDFAgent:
-        self._logger.debug(f"Adding RDF agent: {address}")
+        self._logger.debug("Adding RDF agent: %s", address)
         agent = RDFAgent(address, password, self)
         self._all_agents.append(agent)
         return agent
 
     def start(self):
         self._logger.info("Starting simulation")
-        for agent in self._all_agents:
-            future = agent.start()
-            future.result()
+        if self.coordinator is not None:
+            self._start_shards()
+        self._run_in_loop(self.start_agents(self._all_agents))
 
-        while len(self.active_agents) > 0 or self.is_restarting:
+        while self.is_running or self.is_restarting:
             try:
                 time.sleep(10)
             except KeyboardInterrupt:
-                for agent in self._all_agents:
-                    agent.stop()
+                self._run_in_loop(self.stop_agents(self._all_agents))
+                self._stop_shards()
                 break
         self._logger.info("Simulation stopped")
 
+    @staticmethod
+    def _run_in_loop(coroutine: Coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, Container().loop).result()
+
+    async def start_agents(self, agents: list[RDFAgent]):
+        """Starts the agents concurrently, at most STARTUP_CONCURRENCY at a time.
+        Agents failing to connect are retried with exponential backoff."""
+        semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+        progress = self.startup_progress = StartupProgress(len(agents))
+
+        async def start(agent: RDFAgent):
+            for attempt in range(STARTUP_RETRIES + 1):
+                try:
+                    async with semaphore:
+                        await agent.start()
+                    if self.convergence is not None:
+                        self.convergence.track(str(agent.jid), agent.doc)
+                    progress.started += 1
+                    return
+                except Exception as e:
+                    if attempt == STARTUP_RETRIES:
+                        self._logger.error("Failed to start agent %s: %r", agent.jid, e)
+                        progress.failed += 1
+                        return
+                    delay = STARTUP_BACKOFF * 2 ** attempt
+                    self._logger.warning("Failed to start agent %s, retrying in %ss: %r", agent.jid, delay, e)
+                    progress.retries += 1
+                    await asyncio.sleep(delay)
+
+        await asyncio.gather(*(start(agent) for agent in agents))
+        progress.finished_at = time.time()
+        self._logger.info("Started %s/%s agents in %.1fs", progress.started, progress.total, progress.finished_at - progress.started_at)
+
+    async def stop_agents(self, agents: list[RDFAgent]):
+        semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+
+        async def stop(agent: RDFAgent):
+            async with semaphore:
+                await agent.stop()
+
+        results = await asyncio.gather(*(stop(agent) for agent in agents if agent.is_alive()), return_exceptions=True)
+        for error in results:
+            if isinstance(error, Exception):
+                self._logger.warning("Failed to stop agent: %r", error)
+
+    def _start_shards(self):
+        from services.shard_worker import run_worker
+
+        address, authkey = serve(self.coordinator)
+        context = multiprocessing.get_context("spawn")
+        for shard in range(self.workers):
+            process = context.Process(target=run_worker, args=(shard, address, authkey, log_directory()), name=f"shard-{shard}")
+            process.start()
+            self._processes.append(process)
+        self._logger.info("Started %s shard processes", self.workers)
+
+    def _stop_shards(self):
+        for shard in range(len(self._processes)):
+            self.coordinator.send_command(shard, ("shutdown",))
+        for process in self._processes:
+            process.join(SHARD_SHUTDOWN_TIMEOUT)
+
+    @property
+    def is_running(self) -> bool:
+        if self.coordinator is not None:
+            return any(process.is_alive() for process in self._processes)
+        return len(self.active_agents) > 0
+
     async def restart(self):
+        if self.coordinator is not None:
+            agent_count = len(self.coordinator.active_agents())
+            for shard in range(self.workers):
+                self.coordinator.send_command(shard, ("stop_all",))
+            self.coordinator.restart()
+            self.populate(agent_count)
+            return
+
         self.is_restarting = True
         agent_count = len(self._all_agents)
-        for agent in self._all_agents:
-            await agent.stop()
+        await self.stop_agents(self._all_agents)
         self._all_agents = []
         
         self.server.restart()
         self.graph_generator.restart()
-        self.populate(agent_count)
-        for agent in self._all_agents:
-            await agent.start()
+        self.convergence.reset()
+        # triples only the stopped agents knew are not needed anymore, agents restored from a store intern theirs again
+        self.graph_generator.forget_outdated()
+        TRIPLES.retain({triple.id for triple in self.graph_generator.triples()} | ChangeLog.triple_ids())
+        await self.start_agents(self.populate(agent_count))
         self.is_restarting = False
 
     async def add_agent(self):
         agent = self.populate(1)[0]
-        await agent.start()
+        if self.coordinator is None:
+            await self.start_agents([agent])
 
     async def pop_last_agent(self):
         if len(self.active_agents) > 1:
             await self.active_agents[-1].stop()
 
     @property
-    def active_agents(self) -> list[RDFAgent]:
+    def active_agents(self) -> list[Union[RDFAgent, AgentSnapshot]]:
+        if self.coordinator is not None:
+            return self.coordinator.active_agents()
         return [agent for agent in self._all_agents if agent.is_alive()]
 
+    def message_queue_metrics(self) -> dict[str, dict[str, int]]:
+        """Sums the message queues of the agents by ontology, the depth of the fullest queue is reported as `max_depth`.
+        Agents of worker processes are not included."""
+        totals = {}
+        for agent in self._all_agents:
+            if not agent.is_alive():
+                continue
+            for ontology, metrics in agent.dispatcher.metrics().items():
+                total = totals.setdefault(ontology, {"depth": 0, "max_depth": 0, "received": 0, "dropped": 0})
+                total["depth"] += metrics["depth"]
+                total["max_depth"] = max(total["max_depth"], metrics["max_depth"])
+                total["received"] += metrics["received"]
+                total["dropped"] += metrics["dropped"]
+        return totals
+
+    def collect_metrics(self, families: dict[str, MetricFamily]):
+        """Adds metrics of the simulation and of every agent of this process, agents of worker processes are not included."""
+        for agent in self._all_agents:
+            if agent.is_alive():
+                agent.collect_metrics(families)
+
+        progress = self.startup_progress
+        for state, count in (("total", progress.total), ("started", progress.started), ("failed", progress.failed)):
+            family_of(families, "rdf_startup_agents", GAUGE, "Agents of the last startup by state").add({"state": state}, count)
+        family_of(families, "rdf_startup_retries_total", COUNTER, "Retried agent starts of the last startup").add({}, progress.retries)
+
+        if self.convergence is not None:
+            convergence = self.convergence.metrics()
+            family_of(families, "rdf_convergence_agents", GAUGE, "Tracked agents").add({}, convergence["agents"])
+            family_of(families, "rdf_convergence_synchronized_agents", GAUGE, "Agents holding exactly the uncovered truth").add({}, convergence["synchronized"])
+            family_of(families, "rdf_truth_triples", GAUGE, "Uncovered triples of the ground truth").add({}, convergence["truth"])
+            for jid, difference in self.convergence.lagging_agents().items():
+                family_of(families, "rdf_convergence_difference", GAUGE, "Triples in which a lagging agent differs from the uncovered truth").add({"agent": jid}, difference)
+
+        for outcome, count in self.transport.stats().items():
+            family_of(families, "rdf_transport_messages_total", COUNTER, "Messages of the in-process transport by outcome").add({"outcome": outcome}, count)
+        family_of(families, "rdf_change_log_changes_total", COUNTER, "Changes written to the change log").add({}, ChangeLog.next_seq)
+        family_of(families, "rdf_change_log_dropped_total", COUNTER, "Changes dropped by readers of the change log which fell behind").add({}, ChangeLog.dropped())
+
+    async def uncover_graph_fragments(self, agent: RDFAgent) -> list[tuple[str, RDFTriple]]:
+        """Uncovers the fragments of one tick of the agent."""
+        return self.graph_generator.uncover_graph_fragments(agent.doc.cached_state, str(agent.jid))
+
     def log_leaderboard(self):
-        leaderboard = {}
-        for agent in self.active_agents:
-            n_diff = len(set(self.graph_generator.uncovered_triples).symmetric_difference(set(agent.doc.cached_state)))
-            if n_diff > 0:
-                leaderboard[str(agent.jid)] = n_diff
+        leaderboard = self.convergence.lagging_agents()
         if len(leaderboard) == 0:
             self._logger.info("All agents have the full knowledge")
         else:
             self._logger.info(f"Number of unsynchronized agents: {len(leaderboard)}/{len(self.active_agents)}")
-            leaderboard = dict(sorted(leaderboard.items(), key=lambda item: item[1], reverse=True))
             leaderboard = {k: leaderboard[k] for k in list(leaderboard.keys())[:3]}
             self._logger.info(f"Worst agents by difference in triples from uncovered truth: {leaderboard}")
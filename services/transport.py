@@ -0,0 +1,124 @@
+import asyncio
+import random
+from typing import Optional
+
+from spade.agent import Agent
+from spade.behaviour import CyclicBehaviour
+from spade.message import Message
+
+from agents.message_delivery_fail import MessageDeliveryFail
+from config import (LOOPBACK_JITTER, LOOPBACK_LATENCY, LOOPBACK_LOSS, LOOPBACK_REORDER, LOOPBACK_REORDER_DELAY,
+                    LOOPBACK_SEED, TRANSPORT)
+from logger.logger import get_logger
+
+TRANSPORT_XMPP = "xmpp"
+TRANSPORT_LOOPBACK = "loopback"
+
+
+class XMPPTransport:
+    """Sends messages through SPADE, which delivers them over XMPP or directly to agents of the same container."""
+    uses_xmpp = True
+
+    def attach(self, agent: Agent):
+        pass
+
+    def detach(self, agent: Agent):
+        pass
+
+    async def send(self, behaviour: CyclicBehaviour, message: Message):
+        await behaviour.send(message)
+
+    def stats(self) -> dict[str, int]:
+        return {}
+
+
+class LoopbackTransport(XMPPTransport):
+    """Delivers messages between agents of this process without an XMPP server.
+    Messages still go through `Agent.dispatch`, so behaviours receive them as with XMPP.
+
+    Every message is delayed by `latency` plus up to `jitter` seconds and lost with probability `loss`.
+    With probability `reorder` it is held back for up to `reorder_delay` more seconds, so later messages overtake it.
+    Faults are drawn from a generator seeded with `seed`, so a simulation injects the same faults into the same sequence of messages."""
+    uses_xmpp = False
+
+    def __init__(self, *, latency: float = 0, jitter: float = 0, loss: float = 0, reorder: float = 0, reorder_delay: float = 0, seed: Optional[int] = None):
+        self.logger = get_logger("Transport")
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self._random = random.Random(seed)
+        self._agents: dict[str, Agent] = {}
+        self.sent = 0
+        self.delivered = 0
+        self.lost = 0
+        self.reordered = 0
+
+    def attach(self, agent: Agent):
+        self._agents[str(agent.jid)] = agent
+
+    def detach(self, agent: Agent):
+        self._agents.pop(str(agent.jid), None)
+
+    def _delay(self) -> float:
+        delay = self.latency
+        if self.jitter > 0:
+            delay += self._random.uniform(0, self.jitter)
+        if self.reorder > 0 and self._random.random() < self.reorder:
+            self.reordered += 1
+            delay += self._random.uniform(0, self.reorder_delay)
+        return delay
+
+    async def send(self, behaviour: CyclicBehaviour, message: Message):
+        if not message.sender:
+            message.sender = str(behaviour.agent.jid)
+        if str(message.to) not in self._agents:
+            raise MessageDeliveryFail()
+        self.sent += 1
+        if self.loss > 0 and self._random.random() < self.loss:
+            self.lost += 1
+            self.logger.debug("Lost message from %s to %s", message.sender, message.to)
+            return
+
+        delay = self._delay()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._deliver, message)
+        else:
+            self._deliver(message)
+
+    def _deliver(self, message: Message):
+        # the recipient may have stopped while the message was delayed
+        agent = self._agents.get(str(message.to))
+        if agent is None:
+            self.lost += 1
+            return
+        try:
+            agent.dispatch(message)
+            self.delivered += 1
+        except MessageDeliveryFail:
+            self.lost += 1
+            self.logger.warning("No behaviour of %s accepted message from %s", message.to, message.sender)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "lost": self.lost,
+            "reordered": self.reordered
+        }
+
+
+def create_transport() -> XMPPTransport:
+    if TRANSPORT == TRANSPORT_LOOPBACK:
+        return LoopbackTransport(
+            latency=LOOPBACK_LATENCY,
+            jitter=LOOPBACK_JITTER,
+            loss=LOOPBACK_LOSS,
+            reorder=LOOPBACK_REORDER,
+            reorder_delay=LOOPBACK_REORDER_DELAY,
+            seed=LOOPBACK_SEED
+        )
+    if TRANSPORT != TRANSPORT_XMPP:
+        raise ValueError(f"Unknown transport {TRANSPORT}")
+    return XMPPTransport()
@@ -0,0 +1,109 @@
+import json
+import os.path
+import time
+from collections import deque
+from typing import Optional
+
+from config import GRAPH_ENTITIES, GRAPH_LAZY, GRAPH_PREDICATES, GRAPH_TRIPLES, WORKLOAD, WORKLOAD_RECORD, WORKLOAD_REPLAY
+from logger.logger import get_logger
+from services.graph_generator import DISTRIBUTION_ZIPF, GraphGenerator
+from services.rdf_document import RDFTriple
+
+# parameters of GraphGenerator, a profile may also be given as a JSON file of them
+WORKLOAD_PROFILES = {
+    "uniform": {},
+    "zipf": {"entity_distribution": DISTRIBUTION_ZIPF, "predicate_distribution": DISTRIBUTION_ZIPF},
+    "bulk": {"batch_size": 16},
+    "bursty": {"entity_distribution": DISTRIBUTION_ZIPF, "mutation_chance": 0.2, "burst_chance": 0.05, "burst_size": 20}
+}
+
+
+def load_profile(profile: str) -> dict:
+    if profile in WORKLOAD_PROFILES:
+        return dict(WORKLOAD_PROFILES[profile])
+    if not os.path.exists(profile):
+        raise ValueError(f"Unknown workload profile {profile}")
+    with open(profile) as file:
+        return json.load(file)
+
+
+class TraceRecorder:
+    """Writes the fragments uncovered in each tick of each agent to a file, one JSON line per tick after a header line."""
+
+    def __init__(self, path: str, total_triples: int):
+        self.started_at = time.time()
+        self._file = open(path, "w", buffering=1)
+        self._file.write(json.dumps({"total_triples": total_triples}) + "\n")
+
+    def record(self, agent: Optional[str], fragments: list[tuple[str, RDFTriple, int]]):
+        self._file.write(json.dumps({
+            "time": time.time() - self.started_at,
+            "agent": agent,
+            "fragments": [[operation, triple.object, triple.predicate, triple.subject, marker] for operation, triple, marker in fragments]
+        }) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayGraphGenerator(GraphGenerator):
+    """Uncovers the fragments of a recorded trace instead of generating them.
+    Each agent gets the ticks recorded for the agent of the same address in order, independently of timing.
+    Removals of triples the agent does not know in this run are skipped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = get_logger("GraphGenerator")
+        self.skipped = 0
+        self._ticks: dict[str, deque[list[list]]] = {}
+        with open(path) as file:
+            header = json.loads(file.readline())
+        super().__init__(total_triples=header["total_triples"], lazy=True)
+
+    def restart(self) -> None:
+        super().restart()
+        self._ticks = {}
+        with open(self.path) as file:
+            file.readline()
+            for line in file:
+                tick = json.loads(line)
+                self._ticks.setdefault(tick["agent"], deque()).append(tick["fragments"])
+        self.logger.info("Replaying %s ticks of %s agents from %s", sum(map(len, self._ticks.values())), len(self._ticks), self.path)
+
+    def uncover_graph_fragments(self, known_triples: dict[str, RDFTriple], agent: Optional[str] = None) -> list[tuple[str, RDFTriple]]:
+        ticks = self._ticks.get(agent)
+        if not ticks:
+            return []
+        fragments = []
+        added, removed = set(), set()
+        for operation, object_, predicate, subject, marker in ticks.popleft():
+            triple = RDFTriple(object_, predicate, subject)
+            known = triple.hash in added or (triple.hash in known_triples and triple.hash not in removed)
+            if operation == "-" and not known:
+                self.skipped += 1
+                continue
+            if self.triple_markers.get(triple.hash) != marker:
+                self.triple_markers[triple.hash] = marker
+                self._record_marker_change(triple.hash)
+            if operation == "+":
+                added.add(triple.hash)
+                removed.discard(triple.hash)
+            else:
+                removed.add(triple.hash)
+                added.discard(triple.hash)
+            self._uncover(operation, triple)
+            fragments.append((operation, triple))
+        return fragments
+
+
+def create_graph_generator() -> GraphGenerator:
+    if WORKLOAD_REPLAY:
+        return ReplayGraphGenerator(WORKLOAD_REPLAY)
+    return GraphGenerator(
+        total_triples=GRAPH_TRIPLES,
+        total_entities=GRAPH_ENTITIES,
+        total_predicates=GRAPH_PREDICATES,
+        lazy=GRAPH_LAZY,
+        trace=TraceRecorder(WORKLOAD_RECORD, GRAPH_TRIPLES) if WORKLOAD_RECORD else None,
+        **load_profile(WORKLOAD)
+    )
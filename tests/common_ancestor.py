@@ -0,0 +1,33 @@
+import time
+
+from services.rdf_document import RDFDocument, RDFRevision
+
+
+def build_diamonds(merges: int) -> tuple[RDFDocument, list[RDFRevision]]:
+    """A merge master's history of `merges` merge diamonds, each merging a revision of another author."""
+    doc = RDFDocument("main")
+    doc.new_revision()
+    bases = []
+    for i in range(merges):
+        base = doc.current_revision
+        bases.append(base)
+        side = RDFRevision(parents=[base.hash], author=f"side-{i}")
+        doc.new_revision()
+        doc.append_revision(side)
+        merge = RDFRevision(parents=[doc.current_hash, side.hash], author="main", merge_ancestor=base.hash)
+        doc.append_revision(merge)
+    return doc, bases
+
+
+# the closest common ancestor of a revision branching off deep in the history queues every revision once
+for merges in (30, 400, 800):
+    doc, bases = build_diamonds(merges)
+    base = bases[len(bases) // 4]
+    start = time.perf_counter()
+    ancestor = doc.common_ancestor(RDFRevision(parents=[base.hash], author="branch"))
+    elapsed = time.perf_counter() - start
+    assert ancestor is base
+    assert doc.common_ancestor(RDFRevision(parents=[bases[0].hash], author="branch")) is bases[0]
+    assert doc.common_ancestor(doc.current_revision) is doc.current_revision
+    print(f"{merges} merges, {len(doc.revisions)} revisions: common ancestor found in {elapsed * 1000:.2f}ms")
+    assert elapsed < 1.0
@@ -0,0 +1,58 @@
+import random
+
+from services.convergence import ConvergenceTracker
+from services.graph_generator import GraphGenerator
+from services.rdf_document import RDFDocument
+
+
+def brute_force_difference(generator: GraphGenerator, doc: RDFDocument) -> int:
+    return len(set(generator.uncovered_triples).symmetric_difference(set(doc.cached_state)))
+
+
+rng = random.Random(42)
+generator = GraphGenerator(total_triples=10, seed=7)
+tracker = ConvergenceTracker()
+generator.observers.append(tracker.truth_changed)
+docs = {f"agent{i}": RDFDocument(f"author{i}") for i in range(5)}
+for jid, doc in docs.items():
+    tracker.track(jid, doc)
+
+for step in range(3000):
+    jid = rng.choice(list(docs))
+    doc = docs[jid]
+    if rng.random() < 0.5:
+        # local revision, like LocalRevisionCreate
+        doc.new_revision()
+        doc.parse_fragment(*generator.uncover_graph_fragment(doc.cached_state))
+    else:
+        # revisions of another agent arrive, out of order or with gaps, so the state is sometimes regenerated
+        other = docs[rng.choice(list(docs))]
+        for revision in list(other.revisions.values()):
+            if not doc.has_revision(revision.hash) and rng.random() < 0.3:
+                doc.append_revision(revision)
+
+    if step == 1500:
+        tracker.untrack("agent4")
+        del docs["agent4"]
+
+    for jid_, doc_ in docs.items():
+        assert tracker.difference(jid_) == brute_force_difference(generator, doc_), (step, jid_)
+    assert set(tracker.lagging_agents()) == {j for j, d in docs.items() if brute_force_difference(generator, d) > 0}
+
+# an agent whose state is published as a whole converges once it holds exactly the uncovered triples
+tracker.replace_state("agent0", generator.uncovered_triples)
+assert tracker.difference("agent0") == 0
+for jid in list(docs)[1:]:
+    tracker.untrack(jid)
+tracker.untrack("agent0")
+tracker.replace_state("agent0", generator.uncovered_triples)
+assert tracker.converged and len(tracker.times_to_convergence) > 0
+
+# removing the only triple an agent lacks from the truth synchronizes it
+tracker = ConvergenceTracker()
+tracker.truth_changed(["x", "y"], [])
+tracker.replace_state("a", ["x"])
+assert tracker.lagging_agents() == {"a": 1} and not tracker.converged
+tracker.truth_changed([], ["y"])
+assert tracker.lagging_agents() == {} and tracker.converged
+print("incremental convergence tracking matches the symmetric difference")
@@ -0,0 +1,66 @@
+import random
+
+from services.rdf_document import RDFDocument, RDFRevision, RDFTriple
+
+
+def copying_apply(state: dict[str, RDFTriple], revision: RDFRevision) -> dict[str, RDFTriple]:
+    state = {**state, **revision.deltas_add}
+    return {k: v for k, v in state.items() if k not in revision.deltas_remove}
+
+
+def copying_combine(revision: RDFRevision, revision_next: RDFRevision) -> RDFRevision:
+    new_revision = RDFRevision(parents=revision.parents, author=revision.author_uuid)
+    new_revision.deltas_add = {k: revision.deltas_add[k] for k in set(revision.deltas_add) - set(revision_next.deltas_remove)}
+    new_revision.deltas_add = {**new_revision.deltas_add, **revision_next.deltas_add}
+    new_revision.deltas_remove = {**revision.deltas_remove, **revision_next.deltas_remove}
+    return new_revision
+
+
+def recursive_combine_revisions(revisions: list[RDFRevision]) -> RDFRevision:
+    if len(revisions) == 1:
+        return revisions[0]
+    return recursive_combine_revisions([copying_combine(revisions[0], revisions[1])] + revisions[2:])
+
+
+def random_revision(rng: random.Random, triples: list[RDFTriple], parents: list[str]) -> RDFRevision:
+    revision = RDFRevision(parents=parents, author=str(rng.random()))
+    for _ in range(rng.randint(0, 6)):
+        triple = rng.choice(triples)
+        if rng.random() < 0.6:
+            revision.add(triple)
+        else:
+            revision.remove(triple)
+    return revision
+
+
+rng = random.Random(42)
+triples = [RDFTriple(f"E{i}", f"P{j}", f"E{k}") for i in range(4) for j in range(3) for k in range(4)]
+
+for _ in range(2000):
+    revisions = []
+    parents = None
+    for _ in range(rng.randint(1, 12)):
+        revision = random_revision(rng, triples, parents)
+        revisions.append(revision)
+        parents = [revision.hash]
+
+    state = {t.hash: t for t in rng.sample(triples, rng.randint(0, len(triples)))}
+    expected_state = dict(state)
+    for revision in revisions:
+        expected_state = copying_apply(expected_state, revision)
+        revision.apply_to(state)
+    assert state == expected_state
+
+    expected = recursive_combine_revisions(revisions)
+    combined = RDFDocument.combine_revisions(revisions)
+    assert combined.deltas_add == expected.deltas_add
+    assert combined.deltas_remove == expected.deltas_remove
+    assert combined.parents == expected.parents and combined.author_uuid == expected.author_uuid
+
+    if len(revisions) > 1:
+        expected = copying_combine(revisions[0], revisions[1])
+        combined = revisions[0].combine(revisions[1])
+        assert combined.deltas_add == expected.deltas_add
+        assert combined.deltas_remove == expected.deltas_remove
+
+print("in-place delta application matches the copying implementation")
@@ -3,10 +3,10 @@ from services.rdf_document import RDFDocument
 
 
 generator = GraphGenerator(total_triples=4)
-doc = RDFDocument()
+doc = RDFDocument("author")
 doc.new_revision()
 
 for _ in range(100):
     fragment = generator.uncover_graph_fragment(doc.cached_state)
     doc.parse_fragment(*fragment)
-    print(generator.ground_truth, fragment, list(doc.cached_state.values()))
\ No newline at end of file
+    print(generator.ground_truth, fragment, list(doc.cached_state.values()))
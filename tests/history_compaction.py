@@ -0,0 +1,149 @@
+import random
+from typing import Optional
+
+from services.rdf_document import MissingRevision, RDFDocument, RDFRevision, RDFTriple
+
+
+def state_of(doc: RDFDocument) -> Optional[set[str]]:
+    state = doc._state_at(doc.current_hash)
+    return set(state) if state is not None else None
+
+
+def fresh_copy(doc: RDFDocument) -> RDFDocument:
+    # what an agent joining later receives when asking for the current revision
+    copy = RDFDocument("newcomer")
+    for revision in doc.revisions_missing([doc.current_hash], []):
+        copy.append_revision(RDFRevision.from_json(revision.to_json()))
+    copy.current_hash = doc.current_hash
+    copy.regenerate_state()
+    return copy
+
+
+def simulate(seed: int, steps: int = 3000):
+    rng = random.Random(seed)
+    docs = [RDFDocument(f"author{i}") for i in range(4)]
+    inbox = [[] for _ in docs]
+    truth = [RDFTriple(f"E{rng.randrange(6)}", f"P{rng.randrange(6)}", f"E{rng.randrange(6)}") for _ in range(12)]
+    statuses = [None] * len(docs)
+    compacted = 0
+
+    def send(sender: int, revision: RDFRevision):
+        for i in range(len(docs)):
+            if i != sender:
+                inbox[i].append((sender, revision.to_json()))
+
+    for step in range(steps):
+        i = rng.randrange(len(docs))
+        doc = docs[i]
+        action = rng.random()
+        if action < 0.1:
+            if len(doc.revisions) == 0 and i != 0:
+                continue
+            doc.new_revision()
+            triple = rng.choice(truth)
+            doc.parse_fragment("-" if triple.hash in doc.cached_state else "+", triple)
+            send(i, doc.current_revision)
+        elif action < 0.15:
+            # a status message, the latest revision other agents know about
+            statuses[i] = doc.current_hash
+        elif action < 0.2:
+            # agents only learn about each other from status messages
+            if doc.current_hash is None or any(status is None for status in statuses):
+                continue
+            live = [doc.current_hash] + [status for j, status in enumerate(statuses) if j != i]
+            before = state_of(doc)
+            # heads older than every live revision, like abandoned branches, may be dropped
+            oldest = min((doc.index.generation(hash_) for hash_ in live if hash_ in doc.revisions), default=0)
+            heads = {hash_ for hash_ in doc.heads if doc.index.generation(hash_) >= oldest}
+            dropped = doc.compact(live)
+            if before is None:
+                # the state depends on a missing ancestor, so there is no stable cut
+                assert dropped == 0, (seed, step)
+            elif dropped > 0:
+                compacted += dropped
+                assert all(hash_ in doc.revisions for hash_ in live), (seed, step)
+                assert heads <= doc.revisions.keys(), (seed, step)
+                assert state_of(doc) == before, (seed, step)
+                assert not doc.index.has_missing_parents(), (seed, step)
+                assert set(fresh_copy(doc).cached_state) == before, (seed, step)
+        elif len(inbox[i]) > 0:
+            sender, data = inbox[i].pop(0)
+            revision = RDFRevision.from_json(data)
+            for parent in revision.parents:
+                if not doc.has_revision(parent) and parent in docs[sender].revisions:
+                    inbox[i].append((sender, docs[sender].revisions[parent].to_json()))
+            if doc.has_revision(revision.hash):
+                continue
+            if len(doc.revisions) == 0:
+                doc.append_revision(revision)
+                continue
+            to_insert = True
+            try:
+                if revision.is_merge and doc.can_rebase(revision):
+                    to_insert = False
+                    for rebased in doc.rebase_revision(revision):
+                        send(i, rebased)
+                if i == 0:
+                    merge = doc.merge_revision(revision)
+                    if merge is not None:
+                        to_insert = False
+                        doc.append_revision(revision)
+                        doc.append_revision(merge)
+                        send(i, merge)
+            except MissingRevision:
+                pass
+            if to_insert:
+                doc.append_revision(revision)
+    return docs, compacted
+
+
+for seed in range(10):
+    docs, compacted = simulate(seed)
+    assert compacted > 0, seed
+
+# a linear history is squashed into a base revision below the oldest live revision
+doc = RDFDocument("author")
+hashes = []
+for i in range(100):
+    doc.new_revision()
+    doc.add(RDFTriple(f"E{i}", "P", "E"))
+    if i % 3 == 1:
+        doc.remove(RDFTriple(f"E{i - 1}", "P", "E"))
+    hashes.append(doc.current_hash)
+state = set(doc.cached_state)
+assert doc.compact([hashes[-1], hashes[90]]) == 90
+assert len(doc.revisions) == 11 and doc.revisions[hashes[90]].parents[0] in doc.revisions
+doc.regenerate_state()
+assert set(doc.cached_state) == state
+assert doc.compact([hashes[-1], hashes[90]]) == 0
+
+# a peer revision on top of the peer's announced latest revision is kept though nobody announced it yet
+doc = RDFDocument("author")
+for i in range(20):
+    doc.new_revision()
+    doc.add(RDFTriple(f"E{i}", "P", "E"))
+    if i == 9:
+        peer_latest = doc.current_hash
+unannounced = RDFRevision(parents=[peer_latest], author="peer")
+unannounced.add(RDFTriple("peer", "P", "E"))
+doc.append_revision(unannounced)
+assert doc.compact([doc.current_hash, peer_latest]) > 0
+assert unannounced.hash in doc.revisions and peer_latest in doc.revisions
+assert not doc.index.has_missing_parents()
+
+# an orphaned head far below the live revisions doesn't pin the cut to its ancestors
+doc = RDFDocument("author")
+for i in range(400):
+    doc.new_revision()
+    doc.add(RDFTriple(f"E{i}", "P", "E"))
+    if i == 4:
+        orphan = RDFRevision(parents=[doc.current_hash], author="peer")
+        orphan.add(RDFTriple("orphan", "P", "E"))
+state = set(doc.cached_state)
+doc.append_revision(orphan)
+assert orphan.hash in doc.heads
+assert doc.compact([doc.current_hash]) == 400
+assert orphan.hash not in doc.revisions and doc.heads == {doc.current_hash}
+doc.regenerate_state()
+assert set(doc.cached_state) == state
+print("compacted histories keep the states of live revisions")
@@ -0,0 +1,27 @@
+from services.metrics import AgentMetrics, GAUGE, MetricsRegistry, family_of
+
+metrics = AgentMetrics()
+for seconds in (0.00005, 0.0003, 0.002, 10):
+    metrics.message_handled("revision", seconds)
+metrics.message_handled("status", 0.001, failed=True)
+metrics.message_sent("revision", "a" * 100)
+metrics.message_sent("revision", "a" * 20)
+metrics.message_received("status", None)
+
+registry = MetricsRegistry()
+registry.register(lambda families: metrics.collect("agent@localhost/1", families))
+registry.register(lambda families: family_of(families, "rdf_revisions", GAUGE, "Revisions").add({"agent": 'a"b\\c'}, 3))
+lines = registry.render().splitlines()
+
+assert 'rdf_messages_sent_total{agent="agent@localhost/1",ontology="revision"} 2' in lines
+assert 'rdf_message_bytes_sent_total{agent="agent@localhost/1",ontology="revision"} 120' in lines
+assert 'rdf_message_bytes_received_total{agent="agent@localhost/1",ontology="status"} 0' in lines
+assert 'rdf_handler_seconds_bucket{agent="agent@localhost/1",ontology="revision",le="0.0001"} 1' in lines
+assert 'rdf_handler_seconds_bucket{agent="agent@localhost/1",ontology="revision",le="0.0005"} 2' in lines
+assert 'rdf_handler_seconds_bucket{agent="agent@localhost/1",ontology="revision",le="5"} 3' in lines
+assert 'rdf_handler_seconds_bucket{agent="agent@localhost/1",ontology="revision",le="+Inf"} 4' in lines
+assert 'rdf_handler_seconds_count{agent="agent@localhost/1",ontology="revision"} 4' in lines
+assert 'rdf_handler_errors_total{agent="agent@localhost/1",ontology="status"} 1' in lines
+assert 'rdf_revisions{agent="a\\"b\\\\c"} 3' in lines
+assert lines.count("# TYPE rdf_handler_seconds histogram") == 1
+print("metrics are rendered in the Prometheus text format")
@@ -0,0 +1,21 @@
+import random
+
+from services.graph_generator import GraphGenerator
+from services.rdf_document import RDFDocument
+
+for lazy in (False, True):
+    generator = GraphGenerator(total_triples=30, mutation_chance=0.3, seed=5, lazy=lazy)
+    docs = [RDFDocument(str(i)) for i in range(4)]
+    for doc in docs:
+        doc.new_revision()
+    rng = random.Random(1)
+
+    for step in range(5000):
+        doc = rng.choice(docs)
+        truth = {generator.truth_triple(tid).hash for tid in range(generator.total_triples)}
+        assert set(generator._outdated_in(doc.cached_state)) == set(doc.cached_state) - truth, (lazy, step)
+        doc.parse_fragment(*generator.uncover_graph_fragment(doc.cached_state))
+        if step == 2500:
+            generator.restart()
+
+print("maintained outdated triples match the difference from the ground truth")
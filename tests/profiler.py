@@ -0,0 +1,58 @@
+import asyncio
+import marshal
+import time
+import tracemalloc
+
+from services.profiler import PROFILER_DETERMINISTIC, Profiler, memory_report
+from services.rdf_document import RDFDocument, RDFTriple
+
+
+def busy_loop(seconds: float):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(1000))
+
+
+async def profile():
+    profiler = Profiler()
+    profiler.start(interval=0.001)
+    try:
+        profiler.start()
+        assert False, "a second profiler must not start"
+    except ValueError:
+        pass
+    busy_loop(0.2)
+    # the status is read while the sampler thread keeps adding samples
+    assert all(profiler.status()["samples"] >= 0 for _ in range(1000))
+    result = profiler.stop()
+    assert not profiler.running
+    assert profiler.sample_count == sum(int(line.rsplit(" ", 1)[1]) for line in result.collapsed().splitlines()) > 0
+    collapsed = result.collapsed()
+    assert "busy_loop" in collapsed, collapsed
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines())
+
+    profiler.start(PROFILER_DETERMINISTIC)
+    busy_loop(0.05)
+    result = profiler.stop()
+    assert any(function == "busy_loop" for _, _, function in marshal.loads(result.pstats_dump()))
+    assert "busy_loop" in result.text()
+    try:
+        result.collapsed()
+        assert False, "deterministic profiles have no collapsed stacks"
+    except ValueError:
+        pass
+
+asyncio.run(profile())
+
+tracemalloc.start()
+doc = RDFDocument("author")
+for i in range(10):
+    doc.new_revision()
+    doc.parse_fragment("+", RDFTriple(f"S{i}", "P", f"O{i}"))
+report = memory_report([("agent@localhost", doc)], top=5)
+tracemalloc.stop()
+assert report["agents"]["agent@localhost"]["revisions"] == 10
+assert report["agents"]["agent@localhost"]["revision_bytes"] > 0
+assert report["triples"] >= 10
+assert len(report["tracemalloc"]["top"]) == 5
+print("profiles and memory reports are collected on demand")
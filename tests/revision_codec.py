@@ -0,0 +1,75 @@
+import base64
+import zlib
+
+from services.rdf_document import TRIPLES, RDFRevision, RDFTriple
+from services.revision_codec import (MAX_DECOMPRESSED_SIZE, REVISION_FORMAT_JSON, RevisionDecodeError, _HEADER, _MAGIC, _VERSION,
+                                     decode_revision, decode_revisions, encode_revision, encode_revisions)
+
+
+def make_revision(i: int, triples: int) -> RDFRevision:
+    revision = RDFRevision(parents=[RDFRevision(parents=None, author=str(i)).hash], author=f"author{i}",
+                           merge_ancestor=RDFRevision(parents=None, author="ancestor").hash if i % 2 else None)
+    for j in range(triples):
+        revision.add(RDFTriple(f"E{i}", f"P{j}", f"zażółć{j}"))
+    revision.remove(RDFTriple(f"E{i}", "P", "E0"))
+    return revision
+
+
+def same(a: RDFRevision, b: RDFRevision) -> bool:
+    return (a.hash, a.parents, a.author_uuid, a.merge_ancestor, a.created_at, dict(a.deltas_add), dict(a.deltas_remove)) == \
+        (b.hash, b.parents, b.author_uuid, b.merge_ancestor, b.created_at, dict(b.deltas_add), dict(b.deltas_remove))
+
+
+def corrupt_body(body: str) -> bool:
+    terms = len(TRIPLES.term_values)
+    try:
+        decode_revision(body)
+    except RevisionDecodeError:
+        assert len(TRIPLES.term_values) == terms, "corrupt revision interned terms"
+        return True
+    return False
+
+
+# round trips, plain and compressed, single and batched
+revisions = [make_revision(i, triples) for i, triples in enumerate([0, 1, 5, 200])]
+for threshold in [None, 0]:
+    for revision in revisions:
+        assert same(decode_revision(encode_revision(revision, compress_threshold=threshold)), revision)
+    assert all(map(same, decode_revisions(encode_revisions(revisions, compress_threshold=threshold)), revisions))
+assert same(decode_revision(encode_revision(revisions[2], REVISION_FORMAT_JSON), REVISION_FORMAT_JSON), revisions[2])
+
+# every truncation is rejected and a flipped byte anywhere never escapes as anything but RevisionDecodeError
+body = base64.b64decode(encode_revision(make_revision(7, 3), compress_threshold=None))
+for size in range(len(body)):
+    assert corrupt_body(base64.b64encode(body[:size]).decode("ascii"))
+for position in range(_HEADER.size, len(body)):
+    damaged = bytearray(body)
+    damaged[position] ^= 0xFF
+    try:
+        decode_revision(base64.b64encode(damaged).decode("ascii"))
+    except RevisionDecodeError:
+        pass
+assert corrupt_body(base64.b64encode(body + b"\0").decode("ascii"))
+
+# malformed envelopes
+assert corrupt_body("not base64!")
+assert corrupt_body(base64.b64encode(b"XX\x01\x00").decode("ascii"))
+compressed = base64.b64decode(encode_revision(revisions[3], compress_threshold=0))
+assert corrupt_body(base64.b64encode(compressed[:-10]).decode("ascii"))
+assert corrupt_body(base64.b64encode(compressed[:_HEADER.size] + b"garbage").decode("ascii"))
+bomb = _HEADER.pack(_MAGIC, _VERSION, 1) + zlib.compress(b"\0" * (MAX_DECOMPRESSED_SIZE + 1), 9)
+assert corrupt_body(base64.b64encode(bomb).decode("ascii"))
+try:
+    decode_revisions(encode_revision(revisions[1]))
+    assert False
+except RevisionDecodeError:
+    pass
+batch = base64.b64decode(encode_revisions(revisions, compress_threshold=None))
+for size in [_HEADER.size, _HEADER.size + 4, len(batch) // 2, len(batch) - 1]:
+    try:
+        decode_revisions(base64.b64encode(batch[:size]).decode("ascii"))
+        assert False
+    except RevisionDecodeError:
+        pass
+
+print("Revision codec OK")
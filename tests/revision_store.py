@@ -0,0 +1,142 @@
+import asyncio
+import random
+import tempfile
+
+from services.graph_generator import GraphGenerator
+from services.rdf_document import MissingRevision, RDFDocument, RDFRevision, RDFTriple
+from services.revision_store import RevisionStore
+
+
+def reopen(directory: str, jid: str) -> RDFDocument:
+    store = RevisionStore.for_agent(directory, jid, snapshot_revisions=8)
+    doc = RDFDocument(store.author())
+    store.open(doc)
+    return doc
+
+
+async def simulate(seed: int, directory: str, steps: int = 400):
+    rng = random.Random(seed)
+    jids = [f"agent{i}@localhost" for i in range(4)]
+    stores = [RevisionStore.for_agent(directory, jid, snapshot_revisions=8) for jid in jids]
+    docs = [RDFDocument(f"author{i}") for i in range(4)]
+    for store, doc in zip(stores, docs):
+        store.open(doc)
+    inbox = [[] for _ in docs]
+    truth = [RDFTriple(f"E{rng.randrange(5)}", f"P{rng.randrange(5)}", f"E{rng.randrange(5)}") for _ in range(8)]
+
+    def send(sender: int, revision: RDFRevision):
+        for i in range(len(docs)):
+            if i != sender:
+                inbox[i].append((sender, revision.to_json()))
+
+    for step in range(steps):
+        i = rng.randrange(len(docs))
+        doc = docs[i]
+        if rng.random() < 0.35:
+            if len(doc.revisions) == 0 and i != 0:
+                continue
+            doc.new_revision()
+            triple = rng.choice(truth)
+            if triple.hash in doc.cached_state:
+                doc.parse_fragment("-", triple)
+            else:
+                doc.parse_fragment("+", triple)
+            send(i, doc.current_revision)
+        elif len(inbox[i]) > 0:
+            sender, data = inbox[i].pop(rng.randrange(len(inbox[i])) if rng.random() < 0.3 else 0)
+            revision = RDFRevision.from_json(data)
+            for parent in revision.parents:
+                if not doc.has_revision(parent) and parent in docs[sender].revisions:
+                    inbox[i].append((sender, docs[sender].revisions[parent].to_json()))
+            if doc.has_revision(revision.hash):
+                continue
+            if len(doc.revisions) == 0:
+                doc.append_revision(revision)
+                continue
+            to_insert = True
+            try:
+                if revision.is_merge and doc.can_rebase(revision):
+                    to_insert = False
+                    for rebased in doc.rebase_revision(revision):
+                        send(i, rebased)
+                if i == 0:
+                    merge = doc.merge_revision(revision)
+                    if merge is not None:
+                        to_insert = False
+                        doc.append_revision(revision)
+                        doc.append_revision(merge)
+                        send(i, merge)
+            except MissingRevision:
+                pass
+            if to_insert:
+                doc.append_revision(revision)
+
+        if step % 10 == 0:
+            await stores[i].flush()
+
+    for store in stores:
+        await store.close()
+    return jids, docs
+
+
+for seed in range(10):
+    directory = tempfile.mkdtemp()
+    jids, docs = asyncio.run(simulate(seed, directory))
+    for jid, doc in zip(jids, docs):
+        reopened = reopen(directory, jid)
+        assert reopened.author_uuid == doc.author_uuid
+        assert reopened.revisions.keys() == doc.revisions.keys(), (seed, jid)
+        assert all(reopened.revisions[h].parents == doc.revisions[h].parents for h in doc.revisions), (seed, jid)
+        assert reopened.current_hash == doc.current_hash
+        # a reopened state is regenerated from the revisions, which the live state only matches once no ancestors are missing
+        doc.regenerate_state()
+        assert reopened.cached_state.keys() == doc.cached_state.keys(), (seed, jid)
+
+print("reopened documents match the stored ones")
+
+# a state restored after a process restart was uncovered from another generator, which has to converge it to its own truth
+for lazy in (False, True):
+    directory = tempfile.mkdtemp()
+    store = RevisionStore.for_agent(directory, "agent@localhost")
+    doc = RDFDocument("author")
+    store.open(doc)
+    previous = GraphGenerator(total_triples=30, seed=1, lazy=lazy)
+    for _ in range(200):
+        doc.new_revision()
+        doc.parse_fragment(*previous.uncover_graph_fragment(doc.cached_state))
+    asyncio.run(store.close())
+
+    generator = GraphGenerator(total_triples=30, mutation_chance=0, seed=2, lazy=lazy)
+    doc = reopen(directory, "agent@localhost")
+    generator.adopt(doc.cached_state.values())
+    truth = {generator.truth_triple(tid).hash for tid in range(generator.total_triples)}
+    assert all(hash_ in generator.triple_markers or hash_ in generator.outdated for hash_ in doc.cached_state), lazy
+    assert set(generator._outdated_in(doc.cached_state)) == set(doc.cached_state) - truth, lazy
+    for _ in range(2000):
+        doc.new_revision()
+        doc.parse_fragment(*generator.uncover_graph_fragment(doc.cached_state))
+    assert set(doc.cached_state) == truth, lazy
+print("restored states converge to the truth of a new generator")
+
+
+# a cancelled flush still finishes its write, which the closing flush waits for instead of overlapping it
+async def cancel_flushes(directory: str) -> RDFDocument:
+    store = RevisionStore.for_agent(directory, "agent@localhost")
+    doc = RDFDocument("author")
+    store.open(doc)
+    for _ in range(20):
+        for _ in range(50):
+            doc.new_revision()
+        flush = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0)
+        flush.cancel()
+    doc.new_revision()
+    await store.close()
+    return doc
+
+
+directory = tempfile.mkdtemp()
+doc = asyncio.run(cancel_flushes(directory))
+reopened = reopen(directory, "agent@localhost")
+assert reopened.revisions.keys() == doc.revisions.keys() and reopened.current_hash == doc.current_hash
+print("cancelled flushes are written before the store closes")
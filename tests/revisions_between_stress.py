@@ -0,0 +1,76 @@
+import random
+import time
+from collections import deque
+
+from services.rdf_document import RDFDocument, RDFRevision, MissingRevision
+
+
+def path_enumerating_revisions_between(doc: RDFDocument, hash_: str, revision: RDFRevision) -> list[RDFRevision]:
+    to_visit = deque([[revision]])
+    while len(to_visit) > 0:
+        current = to_visit.popleft()
+        current_rev = current[-1]
+        if current_rev.hash == hash_:
+            current.reverse()
+            return current[1:]
+        for parent in current_rev.parents:
+            if parent not in doc.revisions:
+                raise MissingRevision()
+            to_visit.append(current + [doc.revisions[parent]])
+    raise Exception("There is no path between the revisions")
+
+
+def build_dag(merges: int, seed: int, max_branch: int = 3) -> tuple[RDFDocument, list[RDFRevision]]:
+    rng = random.Random(seed)
+    doc = RDFDocument("main")
+    doc.new_revision()
+    order = [doc.current_revision]
+    for i in range(merges):
+        base = doc.current_revision
+        left, right = base, base
+        for j in range(rng.randint(1, max_branch)):
+            left = RDFRevision(parents=[left.hash], author=f"left-{i}-{j}")
+            doc.append_revision(left)
+            order.append(left)
+        for j in range(rng.randint(1, max_branch)):
+            right = RDFRevision(parents=[right.hash], author=f"right-{i}-{j}")
+            doc.append_revision(right)
+            order.append(right)
+        merge = RDFRevision(parents=[left.hash, right.hash], author="main", merge_ancestor=base.hash)
+        doc.append_revision(merge)
+        order.append(merge)
+    return doc, order
+
+
+def check_path(doc: RDFDocument, hash_: str, revision: RDFRevision, between: list[RDFRevision]):
+    assert between[-1] is revision
+    assert hash_ in between[0].parents
+    for previous, current in zip(between, between[1:]):
+        assert previous.hash in current.parents
+
+
+# equivalence with the path-enumerating walk on DAGs small enough for it
+for seed in range(20):
+    doc, order = build_dag(8, seed)
+    rng = random.Random(seed)
+    for _ in range(50):
+        i, j = sorted(rng.sample(range(len(order)), 2))
+        expected = path_enumerating_revisions_between(doc, order[0].hash, order[j])
+        assert [r.hash for r in doc.revisions_between(order[0].hash, order[j])] == [r.hash for r in expected]
+        try:
+            expected = path_enumerating_revisions_between(doc, order[i].hash, order[j])
+        except Exception:
+            continue
+        assert [r.hash for r in doc.revisions_between(order[i].hash, order[j])] == [r.hash for r in expected]
+print("revisions_between matches the path-enumerating walk")
+
+# hundreds of merge diamonds, where enumerating paths would never finish
+for merges in (100, 200, 400, 800):
+    doc, order = build_dag(merges, seed=merges)
+    root, tip = order[0], doc.current_revision
+    start = time.perf_counter()
+    between = doc.revisions_between(root.hash, tip)
+    elapsed = time.perf_counter() - start
+    check_path(doc, root.hash, tip, between)
+    print(f"{merges} merges, {len(doc.revisions)} revisions: {len(between)} revisions between root and tip in {elapsed * 1000:.2f}ms")
+    assert elapsed < 1.0
@@ -0,0 +1,48 @@
+from services.rdf_document import RDFDocument, RDFRevision
+
+doc = RDFDocument("author")
+hashes = []
+for _ in range(5):
+    doc.new_revision()
+    hashes.append(doc.current_hash)
+root, wanted = hashes[0], hashes[-1]
+
+assert [revision.hash for revision in doc.revisions_missing([wanted], [root])] == hashes[1:]
+# ancestors reported as known are skipped, like false positives of the requester's Bloom filter
+assert [revision.hash for revision in doc.revisions_missing([wanted], [root], {hashes[2]})] == [hashes[1], hashes[3], wanted]
+# a requested revision is sent even if the filter claims it is known
+assert [revision.hash for revision in doc.revisions_missing([wanted], [root], {wanted})] == hashes[1:]
+assert [revision.hash for revision in doc.revisions_missing([wanted], [root], set(hashes))] == [wanted]
+assert [revision.hash for revision in doc.revisions_missing([wanted], [root], limit=2)] == hashes[1:3]
+
+# a requester holding a and c of a -> b -> c has c as a head although its history has a gap
+chain = RDFDocument("author")
+for _ in range(3):
+    chain.new_revision()
+a, b, c = (chain.revisions[hash_] for hash_ in chain.revisions)
+gap = RDFDocument("requester")
+gap.append_revision(a)
+gap.append_revision(c)
+assert gap.heads == {a.hash, c.hash} and gap.complete_heads() == {a.hash}
+assert [revision.hash for revision in chain.revisions_missing([b.hash], gap.heads)] == [b.hash]
+assert [revision.hash for revision in chain.revisions_missing([b.hash], gap.complete_heads())] == [b.hash]
+
+# diamond a -> b, a -> c, (b, c) -> d with b missing on the requester
+diamond = RDFDocument("author")
+diamond.new_revision()
+a = diamond.current_revision
+diamond.new_revision()
+b = diamond.current_revision
+c = RDFRevision(parents=[a.hash], author="other")
+d = RDFRevision(parents=[b.hash, c.hash], author="author", merge_ancestor=a.hash)
+diamond.append_revision(c)
+diamond.append_revision(d)
+gap = RDFDocument("requester")
+for revision in [a, c, d]:
+    gap.append_revision(revision)
+assert gap.heads == {d.hash} and gap.complete_heads() == set()
+assert [revision.hash for revision in diamond.revisions_missing([b.hash], gap.heads)] == [b.hash]
+# without a complete head everything up to the request is sent, unless the filter knows it
+assert [revision.hash for revision in diamond.revisions_missing([b.hash], gap.complete_heads())] == [a.hash, b.hash]
+assert [revision.hash for revision in diamond.revisions_missing([b.hash], gap.complete_heads(), {a.hash, c.hash, d.hash})] == [b.hash]
+print("missing revision ranges are found for sync requests")
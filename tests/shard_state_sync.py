@@ -0,0 +1,57 @@
+import random
+
+from services.convergence import ConvergenceTracker
+from services.graph_generator import GraphGenerator
+from services.rdf_document import RDFDocument, RDFRevision, RDFTriple
+from services.server import Server
+from services.sharding import ShardCoordinator, StateChanges
+
+generator = GraphGenerator(total_triples=30, mutation_chance=0.2, seed=3)
+coordinator = ShardCoordinator(Server(), generator, ConvergenceTracker(), lambda: None)
+rng = random.Random(0)
+docs = [RDFDocument(f"author{i}") for i in range(3)]
+changes = {}
+for i, doc in enumerate(docs):
+    doc.new_revision()
+    changes[f"agent{i}"] = StateChanges(doc)
+
+for step in range(3000):
+    i = rng.randrange(len(docs))
+    doc, agent = docs[i], f"agent{i}"
+    if rng.random() < 0.2:
+        # a revision of another agent changes the state between ticks
+        other = docs[(i + 1) % len(docs)]
+        revision = RDFRevision(parents=[doc.current_hash], author=f"other{step}")
+        for triple in rng.sample(list(other.cached_state.values()), min(2, len(other.cached_state))):
+            revision.add(triple)
+        doc.append_revision(revision)
+        continue
+    added, removed, reset = changes[agent].take()
+    assert reset == (agent not in coordinator._states)
+    fragments = coordinator.uncover_graph_fragments(agent, added, removed, reset)
+    assert coordinator._states[agent].keys() == doc.cached_state.keys(), step
+    doc.new_revision()
+    for operation, terms in fragments:
+        doc.parse_fragment(operation, RDFTriple(*terms))
+
+# published snapshots carry only the hashes which changed since the previous one
+published = StateChanges(docs[0])
+assert coordinator.publish(0, [("agent0", True, False, 0, *published.take())], []) == []
+for version in range(1, 200):
+    doc = docs[0]
+    doc.new_revision()
+    for operation, terms in coordinator.uncover_graph_fragments("agent0", *changes["agent0"].take()):
+        doc.parse_fragment(operation, RDFTriple(*terms))
+    added, removed, reset = published.take()
+    assert not reset and len(added) + len(removed) <= len(doc.cached_state.keys() ^ coordinator.agent("agent0").doc.cached_state.keys())
+    assert coordinator.publish(0, [("agent0", True, False, version, added, removed, reset)], []) == []
+    assert coordinator.agent("agent0").doc.cached_state.keys() == doc.cached_state.keys()
+    assert coordinator.convergence.difference("agent0") == len(doc.cached_state)  # the tracker is not told the truth here
+# a stopped agent is forgotten, changes published for it afterwards are answered with a request for its whole state
+coordinator.publish(0, [("agent0", False, False, 200, None, None, False)], [])
+assert coordinator.publish(0, [("agent0", True, False, 201, [], [], False)], []) == ["agent0"]
+
+# a coordinator which lost its copies asks for the whole state
+coordinator.restart()
+assert coordinator.uncover_graph_fragments("agent0", *changes["agent0"].take()) is None
+print("coordinator copies of agent states follow the changes sent every tick")
@@ -0,0 +1,63 @@
+import random
+
+from services.rdf_document import TRIPLES, RDFRevision, RDFTriple
+
+# equal terms give the same instance, different terms different ids
+triple = RDFTriple("E1", "P1", "E2")
+assert RDFTriple("E1", "P1", "E2") is triple
+assert RDFTriple("E2", "P1", "E1") is not triple and RDFTriple("E2", "P1", "E1").id != triple.id
+assert TRIPLES.get(triple.id) is triple and TRIPLES.by_hash(triple.hash) is triple
+assert RDFTriple.from_json(triple.to_json()) is triple
+
+# packed revisions read and fold like unpacked ones
+rng = random.Random(0)
+triples = [RDFTriple(f"E{i}", f"P{i % 3}", "E0") for i in range(20)]
+for _ in range(200):
+    revisions = []
+    for i in range(rng.randint(1, 5)):
+        revision = RDFRevision(parents=[str(i)], author="author")
+        for _ in range(rng.randint(0, 6)):
+            (revision.add if rng.random() < 0.6 else revision.remove)(rng.choice(triples))
+        revisions.append(revision)
+    expected = [(dict(revision.deltas_add), dict(revision.deltas_remove)) for revision in revisions]
+    unpacked = RDFRevision(parents=None, author="author")
+    for revision in revisions:
+        unpacked.fold(revision)
+    for revision in revisions:
+        revision.pack()
+    assert [(dict(revision.deltas_add), dict(revision.deltas_remove)) for revision in revisions] == expected
+    packed = RDFRevision(parents=None, author="author")
+    packed.pack()
+    for revision in revisions:
+        packed.fold(revision)
+    assert packed.deltas_add == unpacked.deltas_add and packed.deltas_remove == unpacked.deltas_remove
+    state, packed_state = {}, {}
+    unpacked.apply_to(state)
+    packed.pack()
+    packed.apply_to(packed_state)
+    assert state == packed_state
+    for revision in revisions:
+        revision.unpack()
+    assert [(revision.deltas_add, revision.deltas_remove) for revision in revisions] == expected
+
+# deltas of a packed revision can only be changed through add and remove
+revision = RDFRevision(parents=None, author="author")
+revision.add(triples[0])
+revision.pack()
+try:
+    revision.deltas_add[triples[1].hash] = triples[1]
+    assert False, "deltas of a packed revision must be read-only"
+except TypeError:
+    pass
+revision.add(triples[1])
+assert set(revision.deltas_add) == {triples[0].hash, triples[1].hash}
+
+# retained triples keep their ids, dropped ones are interned again under a new id
+dropped = RDFRevision(parents=None, author="author")
+dropped.add(RDFTriple("dropped", "P", "E"))
+dropped_id = next(iter(dropped.deltas_add.values())).id
+count = len(TRIPLES)
+TRIPLES.retain(t.id for t in TRIPLES._by_hash.values() if t.object != "dropped")
+assert len(TRIPLES) == count - 1 and TRIPLES.by_hash(triple.hash) is triple
+assert RDFTriple("dropped", "P", "E").id != dropped_id
+print("triples are interned and packed revisions match unpacked ones")
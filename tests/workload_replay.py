@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+from services.graph_generator import GraphGenerator
+from services.rdf_document import RDFDocument
+from services.workload import ReplayGraphGenerator, TraceRecorder, load_profile
+
+
+def run(generator: GraphGenerator, ticks: int) -> dict[str, set[str]]:
+    docs = {f"agent{i}": RDFDocument(str(i)) for i in range(3)}
+    for _ in range(ticks):
+        for jid, doc in docs.items():
+            fragments = generator.uncover_graph_fragments(doc.cached_state, jid)
+            doc.new_revision()
+            for fragment in fragments:
+                doc.parse_fragment(*fragment)
+    return {jid: set(doc.cached_state) for jid, doc in docs.items()}
+
+
+path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+for profile in ("uniform", "zipf", "bulk", "bursty"):
+    recorder = TraceRecorder(path, 200)
+    generator = GraphGenerator(total_triples=200, total_entities=50, total_predicates=20, trace=recorder, **load_profile(profile))
+    recorded = run(generator, 300)
+    recorder.close()
+
+    replay = ReplayGraphGenerator(path)
+    assert run(replay, 300) == recorded, profile
+    assert replay.skipped == 0 and replay.uncovered_triples.keys() == generator.uncovered_triples.keys(), profile
+
+print("replayed traces reproduce the recorded states")
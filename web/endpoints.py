@@ -1,13 +1,38 @@
-from typing import Callable
+import asyncio
+import json
+import math
+import tracemalloc
+from typing import Callable, Optional
+from aiohttp import web
 from spade.agent import Agent
-from services.change_log import ChangeLog
+from agents.rdf_agent import RDFAgent
+from services.change_log import Change, ChangeLog, OVERFLOW_DROP
+from services.metrics import METRICS
+from services.profiler import MAX_SAMPLING_INTERVAL, MIN_SAMPLING_INTERVAL, PROFILER_SAMPLING, SAMPLING_INTERVAL, TRACEMALLOC_TOP, Profiler, ProfileResult, memory_report
+from services.rdf_document import TRIPLES
 from services.simulation import Simulation
 import inspect
 
+STREAM_BUFFER_SIZE = 10000
+STREAM_FLUSH_PERIOD = 0.25
+STREAM_HEARTBEAT_PERIOD = 5
+PROFILE_SECONDS = 10
+
+
+class AgentKnowledge:
+    def __init__(self, knowledge: list[int], state_version: int, markers_version: int, version: int):
+        self.knowledge = knowledge
+        self.state_version = state_version
+        self.markers_version = markers_version
+        self.version = version
+
 
 class EndpointsContext:
     def __init__(self, simulation: Simulation):
         self.simulation = simulation
+        self.state_version = 0
+        self._knowledge: dict[str, AgentKnowledge] = {}
+        self.profiler = Profiler()
 
     def inject_endpoints(self, web_agent: Agent) -> None:
         def wrapped(func: Callable) -> Callable:
@@ -19,30 +44,190 @@ class EndpointsContext:
             if name.startswith("endpoint_"):
                 name = name[9:]
                 web_agent.web.add_get("/api/"+name, wrapped(func), template=None)
+            elif name.startswith("stream_"):
+                web_agent.web.add_get("/api/"+name, func, template=None, raw=True)
+            elif name.startswith("raw_"):
+                web_agent.web.add_get("/api/"+name[4:], func, template=None, raw=True)
+
+    def _is_outdated(self, entry: AgentKnowledge, agent: RDFAgent) -> bool:
+        generator = self.simulation.graph_generator
+        if entry.state_version != agent.doc.state_version:
+            return True
+        if entry.markers_version != generator.markers_version:
+            changed = generator.markers_changed_since(entry.markers_version)
+            if changed is None or any(k in agent.doc.cached_state for k in changed):
+                return True
+            entry.markers_version = generator.markers_version
+        return False
 
-    async def endpoint_get_state(self) -> dict:
-        state = {
+    def _update_knowledge(self) -> None:
+        generator = self.simulation.graph_generator
+        markers = generator.triple_markers
+        agents = {str(agent.jid): agent for agent in self.simulation.active_agents}
+        for jid in self._knowledge.keys() - agents.keys():
+            del self._knowledge[jid]
+
+        outdated = [jid for jid, agent in agents.items() if jid not in self._knowledge or self._is_outdated(self._knowledge[jid], agent)]
+        if len(outdated) == 0:
+            return
+        self.state_version += 1
+        for jid in outdated:
+            doc = agents[jid].doc
+            # triples restored from a store which the generator does not know have no marker
+            knowledge = [int(markers.get(k, 0)) for k in doc.cached_state.keys()]
+            self._knowledge[jid] = AgentKnowledge(knowledge, doc.state_version, generator.markers_version, self.state_version)
+
+    def _knowledge_state(self, since: Optional[int]) -> dict:
+        self._update_knowledge()
+        full = since is None or not 0 <= since <= self.state_version  # the client may have seen versions from before a server restart
+        return {
+            'version': self.state_version,
+            'full': full,
             'total_triples': len(self.simulation.graph_generator.ground_truth),
-            'agent_knowledge': {},
-            'merge_masters': []
+            'agents': list(self._knowledge.keys()),
+            'agent_knowledge': {jid: entry.knowledge for jid, entry in self._knowledge.items() if full or entry.version > since},
+            'merge_masters': [str(agent.jid) for agent in self.simulation.active_agents if agent.is_merge_master]
         }
 
+    def _transform_changes(self, changes: list[Change]) -> list[any]:
         markers = self.simulation.graph_generator.triple_markers
-        for agent in self.simulation.active_agents:
-            state['agent_knowledge'][str(agent.jid)] = [int(markers[k]) for k in agent.doc.cached_state.keys()]
-            if agent.is_merge_master:
-                state['merge_masters'].append(str(agent.jid))
 
-        transformers = {
-            "uncovered": lambda a, o, t: (a, o, int(markers[t])),
-            "message": lambda l, f, t, v: (l, f, t, {k: [int(markers[vvv]) for vvv in vv] for k, vv in v.items()}) if v is not None else (l, f, t)
-        }
+        def marker(id_: int) -> int:
+            return int(markers.get(TRIPLES.get(id_).hash, 0))
+
+        transformed = []
+        for change in changes:
+            if change.kind == "uncovered":
+                transformed.append(["uncovered", change.agent, change.operation, marker(change.triple_id)])
+            elif change.added is None:
+                transformed.append(["message", change.label, change.sender, change.to])
+            else:
+                transformed.append(["message", change.label, change.sender, change.to, {
+                    "+": [marker(id_) for id_ in change.added],
+                    "-": [marker(id_) for id_ in change.removed]
+                }])
+        return transformed
+
+    async def endpoint_get_state(self, since: Optional[str] = None) -> dict:
+        """Returns knowledge of the agents changed after the `since` version, or of all agents when it is not given or not a version."""
+        try:
+            version = int(since) if since is not None else None
+        except ValueError:
+            version = None  # a malformed version only costs a full refresh
+        state = self._knowledge_state(version)
         changes, delta_time = ChangeLog.read()
-        state["changes"] = [[e[0], *transformers[e[0]](*e[1:])] for e in changes]
+        state["changes"] = self._transform_changes(changes)
         state["delta_time"] = delta_time
         
         return state
-    
+
+    async def stream_state(self, request: web.Request) -> web.StreamResponse:
+        """Pushes state updates as server-sent events, each client reading changes through its own cursor."""
+        limit = int(request.rel_url.query.get("buffer", STREAM_BUFFER_SIZE))
+        overflow = request.rel_url.query.get("overflow", OVERFLOW_DROP)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        cursor = ChangeLog.subscribe(limit, overflow)
+        version = None
+        try:
+            while True:
+                await cursor.wait(STREAM_HEARTBEAT_PERIOD)
+                # let changes accumulate, so a busy simulation is sent in batches rather than event by event
+                await asyncio.sleep(STREAM_FLUSH_PERIOD)
+                state = self._knowledge_state(version)
+                version = state["version"]
+                changes, dropped, coalesced, delta_time = cursor.read()
+                state["changes"] = self._transform_changes(changes)
+                state["dropped"] = dropped
+                state["coalesced"] = coalesced
+                state["delta_time"] = delta_time
+                await response.write(f"data: {json.dumps(state)}\n\n".encode("utf-8"))
+        except ConnectionResetError:
+            pass
+        finally:
+            ChangeLog.unsubscribe(cursor)
+        return response
+
+    async def endpoint_get_startup_progress(self) -> dict:
+        return self.simulation.startup_progress.to_dict()
+
+    async def endpoint_get_message_queues(self) -> dict:
+        return self.simulation.message_queue_metrics()
+
+    async def endpoint_get_convergence(self) -> dict:
+        return {**self.simulation.convergence.metrics(), "lagging_agents": self.simulation.convergence.agent_lag()}
+
+    async def raw_metrics(self, request: web.Request) -> web.Response:
+        """Serves the metrics of the simulation and its agents in the Prometheus text format."""
+        return web.Response(body=METRICS.render().encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def _start_profiler(self, query) -> None:
+        interval = float(query.get("interval", SAMPLING_INTERVAL))
+        if math.isnan(interval):
+            raise ValueError("The sampling interval must be a number")
+        interval = min(max(interval, MIN_SAMPLING_INTERVAL), MAX_SAMPLING_INTERVAL)
+        self.profiler.start(query.get("mode", PROFILER_SAMPLING), interval)
+
+    @staticmethod
+    def _profile_response(result: ProfileResult, format_: Optional[str]) -> web.Response:
+        if format_ == "pstats":
+            return web.Response(body=result.pstats_dump(), headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Disposition": "attachment; filename=profile.pstats"
+            })
+        if format_ == "collapsed":
+            return web.Response(text=result.collapsed())
+        return web.Response(text=result.text())
+
+    async def raw_start_profiler(self, request: web.Request) -> web.Response:
+        """Starts the `sampling` (default) or `deterministic` profiler of the event loop running the agents."""
+        try:
+            self._start_profiler(request.rel_url.query)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        return web.json_response(self.profiler.status())
+
+    async def raw_stop_profiler(self, request: web.Request) -> web.Response:
+        """Stops the profiler and returns its result as `collapsed` stacks, a `pstats` dump or, by default, as text."""
+        try:
+            return self._profile_response(self.profiler.stop(), request.rel_url.query.get("format"))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=409)
+
+    async def raw_profile(self, request: web.Request) -> web.Response:
+        """Profiles the event loop for `seconds` and returns the result like stop_profiler."""
+        try:
+            self._start_profiler(request.rel_url.query)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        try:
+            await asyncio.sleep(float(request.rel_url.query.get("seconds", PROFILE_SECONDS)))
+        finally:
+            result = self.profiler.stop()
+        try:
+            return self._profile_response(result, request.rel_url.query.get("format"))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+    async def endpoint_get_profiler(self) -> dict:
+        return self.profiler.status()
+
+    async def endpoint_get_memory(self, top: Optional[str] = None) -> dict:
+        """Returns memory of the agents' documents by agent and by object type, with the top allocations while tracemalloc traces."""
+        documents = [(str(agent.jid), agent.doc) for agent in self.simulation.active_agents if isinstance(agent, RDFAgent)]
+        return memory_report(documents, int(top) if top is not None else TRACEMALLOC_TOP)
+
+    async def endpoint_start_tracemalloc(self, frames: Optional[str] = None) -> dict:
+        """Starts tracing allocations, which slows every allocation down until it is stopped."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(int(frames) if frames is not None else 1)
+        return {"tracing": True}
+
+    async def endpoint_stop_tracemalloc(self) -> dict:
+        tracemalloc.stop()
+        return {"tracing": False}
+
     async def endpoint_restart(self) -> None:
         await self.simulation.restart()
     